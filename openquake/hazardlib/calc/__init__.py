@@ -17,9 +17,16 @@
 Package :mod:`openquake.hazardlib.calc` contains hazard calculator modules
 and utilities for them, such as :mod:`~openquake.hazardlib.calc.filters`.
 """
-from openquake.hazardlib.calc.hazard_curve import hazard_curves
-from openquake.hazardlib.calc.gmf import ground_motion_fields
-from openquake.hazardlib.calc.stochastic import stochastic_event_set
+from openquake.hazardlib.calc.hazard_curve import (
+    hazard_curves, batch_hazard_curves, parallel_hazard_curves,
+    hazard_curves_per_gsim, mean_hazard_curves, incremental_hazard_curves,
+    hazard_curves_per_source, hazard_curves_per_time_span)
+from openquake.hazardlib.calc.hazard_map import (
+    hazard_maps, uniform_hazard_spectra)
+from openquake.hazardlib.calc.gmf import (
+    ground_motion_fields, batch_ground_motion_fields)
+from openquake.hazardlib.calc.stochastic import (
+    stochastic_event_set, random_state)
 # from disagg we want to import main calc function
 # as well as all the pmf extractors
 from openquake.hazardlib.calc.disagg import *
@@ -14,17 +14,25 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-:mod:`openquake.hazardlib.calc.disagg` contains
-:func:`disaggregation` as well as several aggregation functions for
-extracting a specific PMF from the result of :func:`disaggregation`.
+:mod:`openquake.hazardlib.calc.disagg` contains :func:`disaggregation`,
+its variants for many sites :func:`disaggregation_per_site`, for many
+intensity measure types and levels :func:`disaggregation_per_level` and
+on predefined bins :func:`disaggregation_in_bins`, as well as several
+aggregation functions for extracting a specific PMF from the result of
+:func:`disaggregation`, all based on :func:`extract_pmf`.
 """
+from __future__ import division
+
 import sys
 import numpy
 import warnings
+import itertools
 import collections
 from itertools import izip
 
+from openquake.hazardlib import const
 from openquake.hazardlib.calc import filters
+from openquake.hazardlib.calc.monitor import DummyMonitor
 from openquake.hazardlib.geo.geodetic import npoints_between
 from openquake.hazardlib.geo.utils import get_longitudinal_extent
 from openquake.hazardlib.geo.utils import get_spherical_bounding_box, cross_idl
@@ -35,7 +43,8 @@ def disaggregation(
         sources, site, imt, iml, gsims, truncation_level,
         n_epsilons, mag_bin_width, dist_bin_width, coord_bin_width,
         source_site_filter=filters.source_site_noop_filter,
-        rupture_site_filter=filters.rupture_site_noop_filter):
+        rupture_site_filter=filters.rupture_site_noop_filter,
+        monitor=None):
     """
     Compute "Disaggregation" matrix representing conditional probability of an
     intensity mesaure type ``imt`` exceeding, at least once, an intensity
@@ -93,6 +102,10 @@ def disaggregation(
     :param rupture_site_filter:
         Optional rupture-site filter function. See
         :mod:`openquake.hazardlib.calc.filters`.
+    :param monitor:
+        Optional :class:`~openquake.hazardlib.calc.monitor.Monitor`,
+        recording also the stages ``rupture_distances``, ``make_contexts``,
+        ``disaggregate_poe`` and ``binning``.
 
     :returns:
         A tuple of two items. First is itself a tuple of bin edges information
@@ -104,9 +117,12 @@ def disaggregation(
         of the result tuple. The matrix can be used directly by pmf-extractor
         functions.
     """
+    if monitor is None:
+        monitor = DummyMonitor()
     bins_data = _collect_bins_data(sources, site, imt, iml, gsims,
                                    truncation_level, n_epsilons,
-                                   source_site_filter, rupture_site_filter)
+                                   source_site_filter, rupture_site_filter,
+                                   monitor)
     if all([len(x) == 0 for x in bins_data]):
         # No ruptures have contributed to the hazard level at this site.
         warnings.warn(
@@ -116,15 +132,128 @@ def disaggregation(
         )
         return None, None
 
-    bin_edges = _define_bins(bins_data, mag_bin_width, dist_bin_width,
-                             coord_bin_width, truncation_level, n_epsilons)
-    diss_matrix = _arrange_data_in_bins(bins_data, bin_edges)
+    with monitor('binning'):
+        bin_edges = _define_bins(bins_data, mag_bin_width, dist_bin_width,
+                                 coord_bin_width, truncation_level, n_epsilons)
+        diss_matrix = _arrange_data_in_bins(bins_data, bin_edges)
     return bin_edges, diss_matrix
 
 
+def disaggregation_per_site(
+        sources, sites, imt, iml, gsims, truncation_level,
+        n_epsilons, mag_bin_width, dist_bin_width, coord_bin_width,
+        source_site_filter=filters.source_site_noop_filter,
+        rupture_site_filter=filters.rupture_site_noop_filter,
+        monitor=None):
+    """
+    Compute the disaggregation matrices of many sites at once, with the same
+    results of calling :func:`disaggregation` for each site separately.
+
+    The ruptures of the sources are generated and filtered once for all the
+    sites, and the distances, the contexts and the probabilities of each
+    rupture are computed only for the sites left by the filters, so that
+    ruptures far from a site cost nothing for it.
+
+    The parameters are the same as in :func:`disaggregation`, except for
+
+    :param sites:
+        :class:`~openquake.hazardlib.site.SiteCollection` of the sites
+        of interest.
+    :param source_site_filter:
+        Optional source-site filter function. See
+        :mod:`openquake.hazardlib.calc.filters`. Sources are filtered
+        against the whole site collection.
+    :param rupture_site_filter:
+        Optional rupture-site filter function. See
+        :mod:`openquake.hazardlib.calc.filters`.
+    :returns:
+        A list with a pair ``(bin_edges, matrix)`` per site, in the same
+        order of ``sites``, as returned by :func:`disaggregation`. The pair
+        is ``(None, None)`` for the sites no ruptures have contributed to.
+    """
+    if monitor is None:
+        monitor = DummyMonitor()
+    bins_data_per_site = _collect_bins_data_per_site(
+        sources, sites, [(imt, iml)], gsims, truncation_level, n_epsilons,
+        source_site_filter, rupture_site_filter, monitor)
+    results = []
+    for sid, bins_data in enumerate(bins_data_per_site):
+        bins_data = _select_level(bins_data, 0)
+        if len(bins_data[0]) == 0:
+            warnings.warn(
+                'No ruptures have contributed to the hazard at site '
+                '%d (lon=%s, lat=%s)' % (sid, sites.lons[sid],
+                                         sites.lats[sid]),
+                RuntimeWarning
+            )
+            results.append((None, None))
+            continue
+        with monitor('binning'):
+            bin_edges = _define_bins(
+                bins_data, mag_bin_width, dist_bin_width, coord_bin_width,
+                truncation_level, n_epsilons)
+            diss_matrix = _arrange_data_in_bins(bins_data, bin_edges)
+        results.append((bin_edges, diss_matrix))
+    return results
+
+
+def disaggregation_per_level(
+        sources, site, imtls, gsims, truncation_level,
+        n_epsilons, mag_bin_width, dist_bin_width, coord_bin_width,
+        source_site_filter=filters.source_site_noop_filter,
+        rupture_site_filter=filters.rupture_site_noop_filter,
+        monitor=None):
+    """
+    Compute the disaggregation matrices of many intensity measure types and
+    levels at once, with the same results of calling :func:`disaggregation`
+    for each pair ``(imt, iml)`` separately.
+
+    The source model is processed once: the contexts, the means and the
+    standard deviations are computed once per rupture, and only the
+    partitioning in epsilon bins is done for each level. The bin edges are
+    the same for all the pairs, since they depend only on the ruptures.
+
+    The parameters are the same as in :func:`disaggregation`, except for
+
+    :param imtls:
+        Dictionary mapping intensity measure type objects to lists of
+        intensity measure levels.
+    :returns:
+        An ordered dictionary mapping each pair ``(imt, iml)`` to the pair
+        ``(bin_edges, matrix)`` returned by :func:`disaggregation`, or to
+        ``(None, None)`` if no ruptures have contributed to the hazard
+        at the site.
+    """
+    if monitor is None:
+        monitor = DummyMonitor()
+    imts_imls = [(imt, iml) for imt in imtls for iml in imtls[imt]]
+    [bins_data] = _collect_bins_data_per_site(
+        sources, SiteCollection([site]), imts_imls, gsims,
+        truncation_level, n_epsilons, source_site_filter,
+        rupture_site_filter, monitor)
+    results = collections.OrderedDict()
+    if len(bins_data[0]) == 0:
+        warnings.warn(
+            'No ruptures have contributed to the hazard at site %s' % site,
+            RuntimeWarning
+        )
+        for imt_iml in imts_imls:
+            results[imt_iml] = (None, None)
+        return results
+    with monitor('binning'):
+        bin_edges = _define_bins(bins_data, mag_bin_width, dist_bin_width,
+                                 coord_bin_width, truncation_level,
+                                 n_epsilons)
+        for i, imt_iml in enumerate(imts_imls):
+            results[imt_iml] = (bin_edges, _arrange_data_in_bins(
+                _select_level(bins_data, i), bin_edges))
+    return results
+
+
 def _collect_bins_data(sources, site, imt, iml, gsims,
                        truncation_level, n_epsilons,
-                       source_site_filter, rupture_site_filter):
+                       source_site_filter, rupture_site_filter,
+                       monitor=DummyMonitor()):
     """
     Extract values of magnitude, distance, closest point, tectonic region
     types and PoE distribution.
@@ -133,101 +262,253 @@ def _collect_bins_data(sources, site, imt, iml, gsims,
     all needed parameters to arrays. It also defines tectonic region type
     bins sequence.
     """
+    [bins_data] = _collect_bins_data_per_site(
+        sources, SiteCollection([site]), [(imt, iml)], gsims,
+        truncation_level, n_epsilons, source_site_filter,
+        rupture_site_filter, monitor)
+    return _select_level(bins_data, 0)
+
+
+def _select_level(bins_data, index):
+    """
+    Given the bins data of many pairs IMT-IML returned by
+    :func:`_collect_bins_data_per_site`, return the bins data of the pair
+    with the given index, as returned by :func:`_collect_bins_data`.
+    """
+    return bins_data[:-1] + (bins_data[-1][:, index], )
+
+
+# marker of the tectonic region types not found by a site
+_NOT_FOUND = -1
+
+
+def _collect_bins_data_per_site(sources, sites, imts_imls, gsims,
+                                truncation_level, n_epsilons,
+                                source_site_filter, rupture_site_filter,
+                                monitor):
+    """
+    Extract values of magnitude, distance, closest point, tectonic region
+    types and PoE distribution for each site of a site collection and for
+    each pair ``(imt, iml)`` in the list ``imts_imls``, as
+    :func:`_collect_bins_data` does for a single site and a single pair.
+
+    :returns:
+        A list with the bins data of each site. The PoE distribution is
+        a 3d array, where the first dimension represents the ruptures,
+        the second one the pairs ``(imt, iml)`` and the third one the
+        epsilon bins; use :func:`_select_level` to extract a pair.
+    """
+    num_sites = len(sites)
+    # the data of each pair rupture-sites left by the filters, to be split
+    # by site at the end
+    sids = []
     mags = []
     dists = []
     lons = []
     lats = []
     tect_reg_types = []
     probs_no_exceed = []
-    sitecol = SiteCollection([site])
-    sitemesh = sitecol.mesh
 
-    _next_trt_num = 0
     trt_nums = {}
-
-    sources_sites = ((source, sitecol) for source in sources)
-    # here we ignore filtered site collection because either it is the same
-    # as the original one (with one site), or the source/rupture is filtered
-    # out and doesn't show up in the filter's output
-    for src_idx, (source, s_sites) in \
-            enumerate(source_site_filter(sources_sites)):
+    # for each tectonic region type number, the index of the first source
+    # of that type found by each site (or _NOT_FOUND), used to number the
+    # tectonic region types of each site in the same way the single site
+    # calculator does
+    trt_order = []
+
+    for rupture_data in _iter_ruptures_data(
+            sources, sites, imts_imls, gsims, truncation_level, n_epsilons,
+            source_site_filter, rupture_site_filter, monitor,
+            trt_nums, trt_order):
+        for lst, data in izip((sids, mags, dists, lons, lats,
+                               tect_reg_types, probs_no_exceed),
+                              rupture_data):
+            lst.append(data)
+
+    trt_bins = [trt for (num, trt) in sorted(
+        (num, trt) for (trt, num) in trt_nums.items())]
+    if sids:
+        sids = numpy.concatenate(sids)
+        data = [numpy.concatenate(mags), numpy.concatenate(dists),
+                numpy.concatenate(lons), numpy.concatenate(lats),
+                numpy.concatenate(tect_reg_types),
+                numpy.concatenate(probs_no_exceed)]
+    else:
+        sids = numpy.zeros(0, int)
+        data = [numpy.zeros(0, float)] * 4 + [
+            numpy.zeros(0, int),
+            numpy.zeros((0, len(imts_imls), n_epsilons), float)]
+    # the data are sorted by site, keeping the order of the ruptures
+    by_site = numpy.argsort(sids, kind='mergesort')
+    bounds = numpy.searchsorted(sids[by_site], numpy.arange(num_sites + 1))
+
+    bins_data_per_site = []
+    for sid in xrange(num_sites):
+        rows = by_site[bounds[sid]:bounds[sid + 1]]
+        (site_mags, site_dists, site_lons, site_lats, site_trts,
+         site_probs_no_exceed) = [numpy.array(array[rows], dtype=array.dtype)
+                                  for array in data]
+        # number the tectonic region types found by the site in order
+        site_trt_nums = sorted((first_sources[sid], num)
+                               for num, first_sources in enumerate(trt_order)
+                               if first_sources[sid] != _NOT_FOUND)
+        local_nums = numpy.zeros(len(trt_nums), int)
+        for local_num, (_, num) in enumerate(site_trt_nums):
+            local_nums[num] = local_num
+        bins_data_per_site.append((
+            site_mags, site_dists, site_lons, site_lats,
+            local_nums[site_trts], [trt_bins[num]
+                                    for _, num in site_trt_nums],
+            site_probs_no_exceed))
+    return bins_data_per_site
+
+
+def _iter_ruptures_data(sources, sites, imts_imls, gsims,
+                        truncation_level, n_epsilons, source_site_filter,
+                        rupture_site_filter, monitor, trt_nums, trt_order):
+    """
+    Process the source model and yield, for each rupture left by the
+    filters, a tuple with the indices of the sites left by the filters
+    and their arrays of magnitudes, distances, longitudes and latitudes
+    of the closest points, tectonic region type numbers and
+    probabilities of no exceedance, the latter as a 3d array where the
+    first dimension represents the sites, the second one the pairs
+    ``(imt, iml)`` and the third one the epsilon bins.
+
+    The dictionary ``trt_nums``, mapping each tectonic region type to its
+    number, and the list ``trt_order``, with the index of the first source
+    of each type found by each site, are updated as the sources are
+    processed.
+    """
+    num_sites = len(sites)
+    sources_sites = ((source, sites) for source in sources)
+    for src_idx, (source, s_sites) in enumerate(monitor.iterate(
+            source_site_filter(sources_sites), 'source_filtering',
+            counter='sources')):
+        source_id = source.source_id
         try:
             tect_reg = source.tectonic_region_type
             gsim = gsims[tect_reg]
 
             if not tect_reg in trt_nums:
-                trt_nums[tect_reg] = _next_trt_num
-                _next_trt_num += 1
+                trt_nums[tect_reg] = len(trt_nums)
+                trt_order.append(numpy.empty(num_sites, int))
+                trt_order[-1].fill(_NOT_FOUND)
             tect_reg = trt_nums[tect_reg]
-
-            ruptures_sites = ((rupture, s_sites)
-                              for rupture in source.iter_ruptures())
-            for rupture, r_sites in rupture_site_filter(ruptures_sites):
+            first_sources = trt_order[tect_reg]
+            indices = s_sites.indices
+            first_sources[indices[first_sources[indices] == _NOT_FOUND]] = \
+                src_idx
+
+            ruptures = monitor.iterate(source.iter_ruptures(),
+                                       'iter_ruptures', source_id, 'ruptures')
+            ruptures_sites = ((rupture, s_sites) for rupture in ruptures)
+            for rupture, r_sites in monitor.iterate(
+                    rupture_site_filter(ruptures_sites), 'rupture_filtering',
+                    source_id, 'filtered_ruptures'):
+                num_r_sites = len(r_sites)
+                monitor.count('site_rupture_pairs', num_r_sites, source_id)
                 # extract rupture parameters of interest
-                mags.append(rupture.mag)
-                [jb_dist] = rupture.surface.get_joyner_boore_distance(sitemesh)
-                dists.append(jb_dist)
-                [closest_point] = rupture.surface.get_closest_points(sitemesh)
-                lons.append(closest_point.longitude)
-                lats.append(closest_point.latitude)
-                tect_reg_types.append(tect_reg)
+                with monitor('rupture_distances', source_id):
+                    mesh = r_sites.mesh
+                    dists = rupture.surface.get_joyner_boore_distance(mesh)
+                    closest_points = rupture.surface.get_closest_points(mesh)
 
                 # compute conditional probability of exceeding iml given
                 # the current rupture, and different epsilon level, that is
                 # ``P(IMT >= iml | rup, epsilon_bin)`` for each of epsilon bins
-                sctx, rctx, dctx = gsim.make_contexts(sitecol, rupture)
-                [poes_given_rup_eps] = gsim.disaggregate_poe(
-                    sctx, rctx, dctx, imt, iml, truncation_level, n_epsilons
-                )
-
-                # collect probability of a rupture causing no exceedances
-                probs_no_exceed.append(
-                    rupture.get_probability_no_exceedance(poes_given_rup_eps)
-                )
+                with monitor('make_contexts', source_id):
+                    sctx, rctx, dctx = gsim.make_contexts(r_sites, rupture)
+                with monitor('disaggregate_poe', source_id):
+                    poes_given_rup_eps = _disaggregate_poes(
+                        gsim, sctx, rctx, dctx, imts_imls, truncation_level,
+                        n_epsilons)
+
+                    # probability of a rupture causing no exceedances
+                    probs_no_exceed = rupture.get_probability_no_exceedance(
+                        poes_given_rup_eps)
+                yield (r_sites.indices,
+                       numpy.repeat(float(rupture.mag), num_r_sites),
+                       dists, closest_points.lons, closest_points.lats,
+                       numpy.repeat(tect_reg, num_r_sites), probs_no_exceed)
         except Exception, err:
             etype, err, tb = sys.exc_info()
             msg = 'An error occurred with source id=%s. Error: %s'
             msg %= (source.source_id, err.message)
             raise etype, msg, tb
 
-    mags = numpy.array(mags, float)
-    dists = numpy.array(dists, float)
-    lons = numpy.array(lons, float)
-    lats = numpy.array(lats, float)
-    tect_reg_types = numpy.array(tect_reg_types, int)
-    probs_no_exceed = numpy.array(probs_no_exceed, float)
-
-    trt_bins = [
-        trt for (num, trt) in sorted((num, trt)
-                                     for (trt, num) in trt_nums.items())
-    ]
-
-    return (mags, dists, lons, lats, tect_reg_types, trt_bins, probs_no_exceed)
 
-
-def _define_bins(bins_data, mag_bin_width, dist_bin_width,
-                 coord_bin_width, truncation_level, n_epsilons):
+def _disaggregate_poes(gsim, sctx, rctx, dctx, imts_imls, truncation_level,
+                       n_epsilons):
     """
-    Define bin edges for disaggregation histograms.
+    Disaggregate the PoEs of many pairs ``(imt, iml)`` for a rupture. The
+    means and the standard deviations are computed once for all the IMTs
+    and then only the partitioning in epsilon bins is done for each IML,
+    with :meth:`~openquake.hazardlib.gsim.base.GroundShakingIntensityModel.partition_poe`.
+    A single pair is disaggregated by calling
+    :meth:`~openquake.hazardlib.gsim.base.GroundShakingIntensityModel.disaggregate_poe`.
 
-    Given bins data as provided by :func:`_collect_bins_data`, this function
-    finds edges of histograms, taking into account maximum and minimum values
-    of magnitude, distance and coordinates as well as requested sizes/numbers
-    of bins.
+    :returns:
+        3d array of the PoEs, where the first dimension represents the sites,
+        the second one the pairs and the third one the epsilon bins.
     """
-    mags, dists, lons, lats, tect_reg_types, trt_bins, _ = bins_data
-
+    if len(imts_imls) == 1:
+        [(imt, iml)] = imts_imls
+        poes = gsim.disaggregate_poe(sctx, rctx, dctx, imt, iml,
+                                     truncation_level, n_epsilons)
+        return poes.reshape((len(poes), 1, n_epsilons))
+    if not truncation_level > 0:
+        raise ValueError('truncation level must be positive')
+    imts = []
+    for imt, _ in imts_imls:
+        if imt not in imts:
+            gsim._check_imt(imt)
+            imts.append(imt)
+    means, stddevs = gsim.get_means_and_stddevs(
+        sctx, rctx, dctx, imts, [const.StdDev.TOTAL])
+    poes = []
+    for imt, iml in imts_imls:
+        i = imts.index(imt)
+        poes.append(gsim.partition_poe(means[i], stddevs[i][0], iml,
+                                       truncation_level, n_epsilons))
+    return numpy.array(poes).transpose(1, 0, 2)
+
+
+def make_bin_edges(mag_range, dist_range, lon_range, lat_range,
+                   mag_bin_width, dist_bin_width, coord_bin_width):
+    """
+    Define the bin edges of magnitude, distance, longitude and latitude
+    covering the given ranges, in the same way :func:`disaggregation`
+    does for the ranges of the contributing ruptures. The edges are
+    multiples of the bin widths.
+
+    :param mag_range:
+        A pair ``(min_mag, max_mag)``.
+    :param dist_range:
+        A pair ``(min_dist, max_dist)`` of Joyner-Boore distances, in km.
+    :param lon_range:
+        A pair ``(west, east)`` of longitudes, in decimal degrees. The
+        range goes eastward from ``west`` to ``east`` and can cross the
+        international date line.
+    :param lat_range:
+        A pair ``(south, north)`` of latitudes, in decimal degrees.
+    :returns:
+        A tuple of the magnitude, distance, longitude and latitude
+        bin edges, as 1d arrays.
+    """
+    min_mag, max_mag = mag_range
     mag_bins = mag_bin_width * numpy.arange(
-        int(numpy.floor(mags.min() / mag_bin_width)),
-        int(numpy.ceil(mags.max() / mag_bin_width) + 1)
+        int(numpy.floor(min_mag / mag_bin_width)),
+        int(numpy.ceil(max_mag / mag_bin_width) + 1)
     )
 
+    min_dist, max_dist = dist_range
     dist_bins = dist_bin_width * numpy.arange(
-        int(numpy.floor(dists.min() / dist_bin_width)),
-        int(numpy.ceil(dists.max() / dist_bin_width) + 1)
+        int(numpy.floor(min_dist / dist_bin_width)),
+        int(numpy.ceil(max_dist / dist_bin_width) + 1)
     )
 
-    west, east, north, south = get_spherical_bounding_box(lons, lats)
+    west, east = lon_range
     west = numpy.floor(west / coord_bin_width) * coord_bin_width
     east = numpy.ceil(east / coord_bin_width) * coord_bin_width
     lon_extent = get_longitudinal_extent(west, east)
@@ -236,11 +517,33 @@ def _define_bins(bins_data, mag_bin_width, dist_bin_width,
         numpy.round(lon_extent / coord_bin_width) + 1
     )
 
+    south, north = lat_range
     lat_bins = coord_bin_width * numpy.arange(
         int(numpy.floor(south / coord_bin_width)),
         int(numpy.ceil(north / coord_bin_width) + 1)
     )
 
+    return mag_bins, dist_bins, lon_bins, lat_bins
+
+
+def _define_bins(bins_data, mag_bin_width, dist_bin_width,
+                 coord_bin_width, truncation_level, n_epsilons):
+    """
+    Define bin edges for disaggregation histograms.
+
+    Given bins data as provided by :func:`_collect_bins_data`, this function
+    finds edges of histograms, taking into account maximum and minimum values
+    of magnitude, distance and coordinates as well as requested sizes/numbers
+    of bins.
+    """
+    mags, dists, lons, lats, tect_reg_types, trt_bins, _ = bins_data
+
+    west, east, north, south = get_spherical_bounding_box(lons, lats)
+    mag_bins, dist_bins, lon_bins, lat_bins = make_bin_edges(
+        (mags.min(), mags.max()), (dists.min(), dists.max()),
+        (west, east), (south, north),
+        mag_bin_width, dist_bin_width, coord_bin_width)
+
     eps_bins = numpy.linspace(-truncation_level, truncation_level,
                               n_epsilons + 1)
 
@@ -263,54 +566,199 @@ def _arrange_data_in_bins(bins_data, bin_edges):
     shape = (dim1, dim2, dim3, dim4, len(eps_bins) - 1, len(trt_bins))
     diss_matrix = numpy.ones(shape)
 
-    # find bin indexes of rupture attributes; bins are assumed closed
-    # on the lower bound, and open on the upper bound, that is [ )
-    # longitude values need an ad-hoc method to take into account
-    # the 'international date line' issue
-    # the 'minus 1' is needed because the digitize method returns the index
-    # of the upper bound of the bin
-    mags_idx = numpy.digitize(mags, mag_bins) - 1
-    dists_idx = numpy.digitize(dists, dist_bins) - 1
-    lons_idx = _digitize_lons(lons, lon_bins)
-    lats_idx = numpy.digitize(lats, lat_bins) - 1
+    mags_idx, dists_idx, lons_idx, lats_idx = _digitize_all(
+        mags, dists, lons, lats, bin_edges)
 
-    # because of the way numpy.digitize works, values equal to the last bin
-    # edge are associated to an index equal to len(bins) which is not a valid
-    # index for the disaggregation matrix. Such values are assumed to fall
-    # in the last bin.
+    # since the bins are defined by the data, values greater than the last
+    # bin edge can only come from rounding errors in the edges, and are
+    # assumed to fall in the last bin.
     mags_idx[mags_idx == dim1] = dim1 - 1
     dists_idx[dists_idx == dim2] = dim2 - 1
     lons_idx[lons_idx == dim3] = dim3 - 1
     lats_idx[lats_idx == dim4] = dim4 - 1
 
-    for i, (i_mag, i_dist, i_lon, i_lat, i_trt) in \
-        enumerate(
-            izip(mags_idx, dists_idx, lons_idx, lats_idx, tect_reg_types)):
-
-        diss_matrix[i_mag, i_dist, i_lon, i_lat, :, i_trt] *= \
-            probs_no_exceed[i, :]
+    # multiply the probabilities of no exceedance of the ruptures falling
+    # in the same bin, whatever their order
+    numpy.multiply.at(diss_matrix, (mags_idx, dists_idx, lons_idx, lats_idx,
+                                    slice(None), tect_reg_types),
+                      probs_no_exceed)
 
     return 1 - diss_matrix
 
 
+def _digitize_all(mags, dists, lons, lats, bin_edges):
+    """
+    Return the indices of the magnitude, distance, longitude and latitude
+    bins of the given values, as :func:`_digitize` does.
+    """
+    mag_bins, dist_bins, lon_bins, lat_bins = bin_edges[:4]
+    # longitude values need an ad-hoc method to take into account
+    # the 'international date line' issue
+    return [_digitize(mags, mag_bins), _digitize(dists, dist_bins),
+            _digitize_lons(lons, lon_bins), _digitize(lats, lat_bins)]
+
+
+def _digitize(values, bins):
+    """
+    Return indices of the bins to which each value belongs. Bins are
+    assumed closed on the lower bound, and open on the upper bound, that
+    is ``[ )``, except for the last bin which includes its upper bound.
+    Values lower than the first edge have index -1, values greater than
+    the last edge have index ``len(bins) - 1``.
+    """
+    # the 'minus 1' is needed because the digitize method returns the index
+    # of the upper bound of the bin
+    idx = numpy.digitize(values, bins) - 1
+    # because of the way numpy.digitize works, values equal to the last bin
+    # edge are associated to an index equal to the number of bins, which
+    # is not a valid index for the disaggregation matrix. Such values are
+    # assumed to fall in the last bin.
+    idx[values == bins[-1]] = len(bins) - 2
+    return idx
+
+
 def _digitize_lons(lons, lon_bins):
     """
-    Return indices of the bins to which each value in lons belongs.
-    Takes into account the case in which longitude values cross the
-    international date line.
+    Return indices of the bins to which each value in lons belongs,
+    as :func:`_digitize` does. Takes into account the case in which
+    longitude values cross the international date line.
     """
+    lons = numpy.asarray(lons, dtype=float)
+    lon_bins = numpy.asarray(lon_bins, dtype=float)
     if cross_idl(lon_bins[0], lon_bins[-1]):
-        idx = []
-        for i_lon in xrange(len(lon_bins) - 1):
-            extents = get_longitudinal_extent(lons, lon_bins[i_lon + 1])
-            lon_idx = extents > 0
-            if i_lon != 0:
-                extents = get_longitudinal_extent(lon_bins[i_lon], lons)
-                lon_idx &= extents >= 0
-            idx.append(lon_idx)
-        return numpy.array(idx)
-    else:
-        return numpy.digitize(lons, lon_bins) - 1
+        # measure the longitudes eastward from the first bin edge, so
+        # that the edges are increasing
+        lons = (lons - lon_bins[0]) % 360
+        lon_bins = (lon_bins - lon_bins[0]) % 360
+    return _digitize(lons, lon_bins)
+
+
+def disaggregation_in_bins(
+        sources, site, imt, iml, gsims, truncation_level, n_epsilons,
+        mag_bins, dist_bins, lon_bins, lat_bins,
+        source_site_filter=filters.source_site_noop_filter,
+        rupture_site_filter=filters.rupture_site_noop_filter,
+        monitor=None, ruptures_per_block=10000):
+    """
+    Compute the disaggregation matrix of a site on predefined bins.
+
+    Unlike :func:`disaggregation`, which collects the data of all the
+    contributing ruptures to find their extents before defining the bins,
+    the ruptures are binned in blocks of ``ruptures_per_block`` as they are
+    produced, so that the memory used does not depend on the size of the
+    source model. Contributing ruptures falling out of the bins are
+    ignored, with a warning. The bins can be defined with
+    :func:`make_bin_edges`.
+
+    The parameters are the same as in :func:`disaggregation`, except for
+
+    :param mag_bins:
+        Magnitude bin edges, in increasing order.
+    :param dist_bins:
+        Joyner-Boore distance bin edges in km, in increasing order.
+    :param lon_bins:
+        Longitude bin edges, going eastward; they can cross the
+        international date line.
+    :param lat_bins:
+        Latitude bin edges, in increasing order.
+    :param ruptures_per_block:
+        Number of ruptures binned together.
+    :returns:
+        A pair ``(bin_edges, matrix)`` as returned by :func:`disaggregation`,
+        or ``(None, None)`` if no sources have contributed to the hazard
+        at the site.
+    """
+    if monitor is None:
+        monitor = DummyMonitor()
+    eps_bins = numpy.linspace(-truncation_level, truncation_level,
+                              n_epsilons + 1)
+    bin_edges = (numpy.asarray(mag_bins, dtype=float),
+                 numpy.asarray(dist_bins, dtype=float),
+                 numpy.asarray(lon_bins, dtype=float),
+                 numpy.asarray(lat_bins, dtype=float),
+                 eps_bins)
+    shape = tuple(len(bins) - 1 for bins in bin_edges)
+    # the tectonic region types found so far, the last axis of the matrix
+    trt_nums = {}
+    diss_matrix = numpy.ones(shape + (0, ))
+    num_out_of_bins = 0
+
+    ruptures_data = _iter_ruptures_data(
+        sources, SiteCollection([site]), [(imt, iml)], gsims,
+        truncation_level, n_epsilons, source_site_filter,
+        rupture_site_filter, monitor, trt_nums, [])
+    while True:
+        block = list(itertools.islice(ruptures_data, ruptures_per_block))
+        num_new_trts = len(trt_nums) - diss_matrix.shape[-1]
+        if num_new_trts:
+            diss_matrix = numpy.concatenate(
+                [diss_matrix, numpy.ones(shape + (num_new_trts, ))], axis=-1)
+        if not block:
+            break
+        with monitor('binning'):
+            _, mags, dists, lons, lats, trts, probs_no_exceed = [
+                numpy.concatenate(data) for data in izip(*block)]
+            probs_no_exceed = probs_no_exceed[:, 0]
+            indices = _digitize_all(mags, dists, lons, lats, bin_edges)
+            in_bins = numpy.ones(len(mags), bool)
+            for idx, dim in izip(indices, shape):
+                in_bins &= (idx >= 0) & (idx < dim)
+            num_out_of_bins += (
+                probs_no_exceed[~ in_bins] < 1).any(axis=1).sum()
+            numpy.multiply.at(diss_matrix,
+                              tuple(idx[in_bins] for idx in indices)
+                              + (slice(None), trts[in_bins]),
+                              probs_no_exceed[in_bins])
+
+    if not trt_nums:
+        warnings.warn(
+            'No ruptures have contributed to the hazard at site %s' % site,
+            RuntimeWarning
+        )
+        return None, None
+    if num_out_of_bins:
+        warnings.warn(
+            '%d contributing ruptures out of the bins have been ignored '
+            'at site %s' % (num_out_of_bins, site),
+            RuntimeWarning
+        )
+    trt_bins = sorted(trt_nums, key=trt_nums.get)
+    return bin_edges + (trt_bins, ), 1 - diss_matrix
+
+
+#: Names of the axes of the disaggregation matrix, in order
+AXES = ('Mag', 'Dist', 'Lon', 'Lat', 'Eps', 'TRT')
+
+
+def extract_pmf(matrix, axes):
+    """
+    Fold full disaggregation matrix to the PMF of any combination of its
+    axes, that is compute ``1 - prod(1 - matrix)`` over all the other axes.
+
+    :param matrix:
+        The 6d disaggregation matrix returned by :func:`disaggregation`.
+    :param axes:
+        A sequence of axes, given by name (see :data:`AXES`) or by index;
+        for instance ``('Mag', 'Dist', 'Eps')`` or ``(0, 1, 4)``.
+    :returns:
+        An array with a dimension per axis in ``axes``, in the same order.
+    :raises ValueError:
+        If an axis is unknown or repeated.
+    """
+    keep = []
+    for axis in axes:
+        if axis in AXES:
+            axis = AXES.index(axis)
+        elif axis not in range(len(AXES)):
+            raise ValueError('unknown axis %r, expected one of %s' %
+                             (axis, ', '.join(AXES)))
+        if axis in keep:
+            raise ValueError('repeated axis %r' % AXES[axis])
+        keep.append(axis)
+    folded = tuple(axis for axis in range(len(AXES)) if axis not in keep)
+    pmf = 1 - numpy.prod(1 - matrix, axis=folded)
+    # the axes kept are in increasing order after the reduction
+    return pmf.transpose(numpy.argsort(numpy.argsort(keep)))
 
 
 def mag_pmf(matrix):
@@ -320,18 +768,7 @@ def mag_pmf(matrix):
     :returns:
         1d array, a histogram representing magnitude PMF.
     """
-    nmags, ndists, nlons, nlats, neps, ntrts = matrix.shape
-    mag_pmf = numpy.zeros(nmags)
-    for i in xrange(nmags):
-        mag_pmf[i] = numpy.prod(
-            [1 - matrix[i][j][k][l][m][n]
-             for j in xrange(ndists)
-             for k in xrange(nlons)
-             for l in xrange(nlats)
-             for m in xrange(neps)
-             for n in xrange(ntrts)]
-        )
-    return 1 - mag_pmf
+    return extract_pmf(matrix, ('Mag', ))
 
 
 def dist_pmf(matrix):
@@ -341,18 +778,7 @@ def dist_pmf(matrix):
     :returns:
         1d array, a histogram representing distance PMF.
     """
-    nmags, ndists, nlons, nlats, neps, ntrts = matrix.shape
-    dist_pmf = numpy.zeros(ndists)
-    for j in xrange(ndists):
-        dist_pmf[j] = numpy.prod(
-            [1 - matrix[i][j][k][l][m][n]
-             for i in xrange(nmags)
-             for k in xrange(nlons)
-             for l in xrange(nlats)
-             for m in xrange(neps)
-             for n in xrange(ntrts)]
-        )
-    return 1 - dist_pmf
+    return extract_pmf(matrix, ('Dist', ))
 
 
 def trt_pmf(matrix):
@@ -362,18 +788,7 @@ def trt_pmf(matrix):
     :returns:
         1d array, a histogram representing tectonic region type PMF.
     """
-    nmags, ndists, nlons, nlats, neps, ntrts = matrix.shape
-    trt_pmf = numpy.zeros(ntrts)
-    for n in xrange(ntrts):
-        trt_pmf[n] = numpy.prod(
-            [1 - matrix[i][j][k][l][m][n]
-             for i in xrange(nmags)
-             for j in xrange(ndists)
-             for k in xrange(nlons)
-             for l in xrange(nlats)
-             for m in xrange(neps)]
-        )
-    return 1 - trt_pmf
+    return extract_pmf(matrix, ('TRT', ))
 
 
 def mag_dist_pmf(matrix):
@@ -384,18 +799,7 @@ def mag_dist_pmf(matrix):
         2d array. First dimension represents magnitude histogram bins,
         second one -- distance histogram bins.
     """
-    nmags, ndists, nlons, nlats, neps, ntrts = matrix.shape
-    mag_dist_pmf = numpy.zeros((nmags, ndists))
-    for i in xrange(nmags):
-        for j in xrange(ndists):
-            mag_dist_pmf[i][j] = numpy.prod(
-                [1 - matrix[i][j][k][l][m][n]
-                 for k in xrange(nlons)
-                 for l in xrange(nlats)
-                 for m in xrange(neps)
-                 for n in xrange(ntrts)]
-            )
-    return 1 - mag_dist_pmf
+    return extract_pmf(matrix, ('Mag', 'Dist'))
 
 
 def mag_dist_eps_pmf(matrix):
@@ -407,18 +811,7 @@ def mag_dist_eps_pmf(matrix):
         second one -- distance histogram bins, third one -- epsilon
         histogram bins.
     """
-    nmags, ndists, nlons, nlats, neps, ntrts = matrix.shape
-    mag_dist_eps_pmf = numpy.zeros((nmags, ndists, neps))
-    for i in xrange(nmags):
-        for j in xrange(ndists):
-            for m in xrange(neps):
-                mag_dist_eps_pmf[i][j][m] = numpy.prod(
-                    [1 - matrix[i][j][k][l][m][n]
-                     for k in xrange(nlons)
-                     for l in xrange(nlats)
-                     for n in xrange(ntrts)]
-                )
-    return 1 - mag_dist_eps_pmf
+    return extract_pmf(matrix, ('Mag', 'Dist', 'Eps'))
 
 
 def lon_lat_pmf(matrix):
@@ -429,18 +822,7 @@ def lon_lat_pmf(matrix):
         2d array. First dimension represents longitude histogram bins,
         second one -- latitude histogram bins.
     """
-    nmags, ndists, nlons, nlats, neps, ntrts = matrix.shape
-    lon_lat_pmf = numpy.zeros((nlons, nlats))
-    for k in xrange(nlons):
-        for l in xrange(nlats):
-            lon_lat_pmf[k][l] = numpy.prod(
-                [1 - matrix[i][j][k][l][m][n]
-                 for i in xrange(nmags)
-                 for j in xrange(ndists)
-                 for m in xrange(neps)
-                 for n in xrange(ntrts)]
-            )
-    return 1 - lon_lat_pmf
+    return extract_pmf(matrix, ('Lon', 'Lat'))
 
 
 def mag_lon_lat_pmf(matrix):
@@ -452,18 +834,7 @@ def mag_lon_lat_pmf(matrix):
         second one -- longitude histogram bins, third one -- latitude
         histogram bins.
     """
-    nmags, ndists, nlons, nlats, neps, ntrts = matrix.shape
-    mag_lon_lat_pmf = numpy.zeros((nmags, nlons, nlats))
-    for i in xrange(nmags):
-        for k in xrange(nlons):
-            for l in xrange(nlats):
-                mag_lon_lat_pmf[i][k][l] = numpy.prod(
-                    [1 - matrix[i][j][k][l][m][n]
-                     for j in xrange(ndists)
-                     for m in xrange(neps)
-                     for n in xrange(ntrts)]
-                )
-    return 1 - mag_lon_lat_pmf
+    return extract_pmf(matrix, ('Mag', 'Lon', 'Lat'))
 
 
 def lon_lat_trt_pmf(matrix):
@@ -475,22 +846,12 @@ def lon_lat_trt_pmf(matrix):
         3d array. Dimension represent longitude, latitude and tectonic region
         type histogram bins respectively.
     """
-    nmags, ndists, nlons, nlats, neps, ntrts = matrix.shape
-    lon_lat_trt_pmf = numpy.zeros((nlons, nlats, ntrts))
-    for k in xrange(nlons):
-        for l in xrange(nlats):
-            for n in xrange(ntrts):
-                lon_lat_trt_pmf[k][l][n] = numpy.prod(
-                    [1 - matrix[i][j][k][l][m][n]
-                     for i in xrange(nmags)
-                     for j in xrange(ndists)
-                     for m in xrange(neps)]
-                )
-    return 1 - lon_lat_trt_pmf
+    return extract_pmf(matrix, ('Lon', 'Lat', 'TRT'))
 
 
 # this dictionary is useful to extract a fixed set of
-# submatrices from the full disaggregation matrix
+# submatrices from the full disaggregation matrix; other
+# combinations of axes can be extracted with extract_pmf
 pmf_map = collections.OrderedDict([
     (('Mag', ), mag_pmf),
     (('Dist', ), dist_pmf),
@@ -54,7 +54,8 @@ filter function of each kind (see :func:`source_site_distance_filter` and
 """
 
 
-def filter_sites_by_distance_to_rupture(rupture, integration_distance, sites):
+def filter_sites_by_distance_to_rupture(rupture, integration_distance, sites,
+                                        rejected=None):
     """
     Filter out sites from the collection that are further from the rupture
     than some arbitrary threshold.
@@ -69,6 +70,11 @@ def filter_sites_by_distance_to_rupture(rupture, integration_distance, sites):
     :param sites:
         Instance of :class:`openquake.hazardlib.site.SiteCollection`
         to filter.
+    :param rejected:
+        Optional dictionary with the keys ``'bounding_circle'`` and
+        ``'distance'``, where the numbers of sites filtered out
+        respectively by the bounding circle test and by the exact
+        distance test are added.
     :returns:
         Filtered :class:`~openquake.hazardlib.site.SiteCollection`.
 
@@ -78,9 +84,26 @@ def filter_sites_by_distance_to_rupture(rupture, integration_distance, sites):
     distance from the rupture's surface projection along the great
     circle arc (this is known as Joyner-Boore distance, :meth:`
     openquake.hazardlib.geo.surface.base.BaseQuadrilateralSurface.get_joyner_boore_distance`).
+
+    Distances are computed only for the sites lying within the integration
+    distance from the :meth:`bounding circle
+    <openquake.hazardlib.geo.surface.base.BaseSurface.get_bounding_circle>`
+    of the rupture surface; those sites are found with :meth:`
+    openquake.hazardlib.site.SiteCollection.filter_by_distance`.
     """
-    jb_dist = rupture.surface.get_joyner_boore_distance(sites.mesh)
-    return sites.filter(jb_dist <= integration_distance)
+    lon, lat, radius = rupture.surface.get_bounding_circle()
+    c_sites = sites.filter_by_distance(lon, lat, radius + integration_distance)
+    if c_sites is None:
+        r_sites = None
+    else:
+        jb_dist = rupture.surface.get_joyner_boore_distance(c_sites.mesh)
+        r_sites = c_sites.filter(jb_dist <= integration_distance)
+    if rejected is not None:
+        num_c_sites = 0 if c_sites is None else len(c_sites)
+        num_r_sites = 0 if r_sites is None else len(r_sites)
+        rejected['bounding_circle'] += len(sites) - num_c_sites
+        rejected['distance'] += num_c_sites - num_r_sites
+    return r_sites
 
 
 def source_site_distance_filter(integration_distance):
@@ -111,14 +134,20 @@ def rupture_site_distance_filter(integration_distance):
         Threshold distance in km, this value gets passed straight to
         :func:`openquake.hazardlib.calc.filters.filter_sites_by_distance_to_rupture`
         which is what is actually used for filtering.
+
+    The returned filter has an attribute ``rejected``, a dictionary
+    counting the sites filtered out by the bounding circle test
+    (key ``'bounding_circle'``) and by the exact distance test
+    (key ``'distance'``) in all the calls of the filter.
     """
     def filter_func(ruptures_sites):
         for rupture, sites in ruptures_sites:
             r_sites = filter_sites_by_distance_to_rupture(
-                rupture, integration_distance, sites)
+                rupture, integration_distance, sites, filter_func.rejected)
             if r_sites is None:
                 continue
             yield rupture, r_sites
+    filter_func.rejected = {'bounding_circle': 0, 'distance': 0}
     return filter_func
 
 
@@ -15,15 +15,19 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 Module :mod:`~openquake.hazardlib.calc.gmf` exports
-:func:`ground_motion_fields`.
+:func:`ground_motion_fields` and its variant for many ruptures
+:func:`batch_ground_motion_fields`.
 """
 import collections
 
 import numpy
-import scipy.stats
+import scipy.special
 
 from openquake.hazardlib.const import StdDev
 from openquake.hazardlib.calc import filters
+from openquake.hazardlib.calc.monitor import DummyMonitor
+from openquake.hazardlib.calc.hazard_curve import (
+    _group_ruptures, _stack_contexts)
 
 
 class CorrelationButNoInterIntraStdDevs(Exception):
@@ -89,83 +93,25 @@ class GmfComputer(object):
 
     def _compute(self, seed, gsim, realizations):
         # the method doing the real stuff; use compute instead
-        if seed is not None:
-            numpy.random.seed(seed)
-        result = collections.OrderedDict()
         sctx, rctx, dctx = self.ctx
-
-        if self.truncation_level == 0:
-            assert self.correlation_model is None
-            for imt in self.imts:
-                mean, _stddevs = gsim.get_mean_and_stddevs(
-                    sctx, rctx, dctx, imt, stddev_types=[])
-                mean = gsim.to_imt_unit_values(mean)
-                mean.shape += (1, )
-                mean = mean.repeat(realizations, axis=1)
-                result[imt] = mean
-            return result
-        elif self.truncation_level is None:
-            distribution = scipy.stats.norm()
-        else:
-            assert self.truncation_level > 0
-            distribution = scipy.stats.truncnorm(
-                - self.truncation_level, self.truncation_level)
-
-        for imt in self.imts:
-            if gsim.DEFINED_FOR_STANDARD_DEVIATION_TYPES == \
-               set([StdDev.TOTAL]):
-                # If the GSIM provides only total standard deviation, we need
-                # to compute mean and total standard deviation at the sites
-                # of interest.
-                # In this case, we also assume no correlation model is used.
-                if self.correlation_model:
-                    raise CorrelationButNoInterIntraStdDevs(
-                        self.correlation_model, gsim)
-
-                mean, [stddev_total] = gsim.get_mean_and_stddevs(
-                    sctx, rctx, dctx, imt, [StdDev.TOTAL]
-                )
-                stddev_total = stddev_total.reshape(stddev_total.shape + (1, ))
-                mean = mean.reshape(mean.shape + (1, ))
-
-                total_residual = stddev_total * distribution.rvs(
-                    size=(len(self.sites), realizations)
-                )
-                gmf = gsim.to_imt_unit_values(mean + total_residual)
-            else:
-                mean, [stddev_inter, stddev_intra] = gsim.get_mean_and_stddevs(
-                    sctx, rctx, dctx, imt,
-                    [StdDev.INTER_EVENT, StdDev.INTRA_EVENT]
-                )
-                stddev_intra = stddev_intra.reshape(stddev_intra.shape + (1, ))
-                stddev_inter = stddev_inter.reshape(stddev_inter.shape + (1, ))
-                mean = mean.reshape(mean.shape + (1, ))
-
-                intra_residual = stddev_intra * distribution.rvs(
-                    size=(len(self.sites), realizations)
-                )
-
-                if self.correlation_model is not None:
-                    intra_residual = self.correlation_model.apply_correlation(
-                        self.sites, imt, intra_residual
-                    )
-
-                inter_residual = stddev_inter * distribution.rvs(
-                    size=realizations)
-
-                gmf = gsim.to_imt_unit_values(
-                    mean + intra_residual + inter_residual)
-
-            result[imt] = gmf
-
-        return result
+        stddev_types = _get_stddev_types(
+            gsim, self.truncation_level, self.correlation_model)
+        # means and standard deviations of all the IMTs are computed
+        # together; the residuals are then sampled IMT by IMT
+        means, stddevs = gsim.get_means_and_stddevs(
+            sctx, rctx, dctx, self.imts, stddev_types)
+        return _sample_gmfs(gsim, self.sites, self.imts, means, stddevs,
+                            self.truncation_level, self.correlation_model,
+                            realizations, _get_rng(seed))
 
     def compute(self, seed):
         """
         Compute the ground motion field for the given sites.
 
         :param seed:
-            the seed for the numpy random number generator
+            the seed for the numpy random number generator, or a
+            :class:`numpy.random.RandomState` instance, or ``None``
+            to use the global numpy random number generator
         :returns:
             A list of pairs
             [((gsim_name, imt_name), ground_motion_values), ...]
@@ -179,12 +125,240 @@ class GmfComputer(object):
         return gmf_by_imt
 
 
+class TruncatedNormal(object):
+    """
+    Sampler of the standard normal distribution truncated symmetrically,
+    faster than :data:`scipy.stats.truncnorm` since the bounds of the
+    cumulative distribution function are computed once and the samples are
+    drawn by inverting it on uniform draws, without the overhead of a
+    frozen distribution. The samples are the same drawn by
+    ``scipy.stats.truncnorm(-truncation_level, truncation_level).rvs``
+    from the same random number generator, up to rounding errors.
+
+    :param truncation_level:
+        Positive float, number of standard deviations for truncation,
+        or ``None``, in which case the distribution is not truncated.
+    """
+    def __init__(self, truncation_level):
+        self.truncation_level = truncation_level
+        if truncation_level is not None:
+            assert truncation_level > 0, truncation_level
+            self.lower_cdf = scipy.special.ndtr(-truncation_level)
+            self.cdf_width = (scipy.special.ndtr(truncation_level)
+                              - self.lower_cdf)
+
+    def rvs(self, size, rng=None):
+        """
+        Draw samples from the distribution.
+
+        :param size:
+            Number (or shape) of the samples.
+        :param rng:
+            :class:`numpy.random.RandomState` to draw from, or ``None``
+            to use the global numpy random number generator.
+        :returns:
+            Array of the samples.
+        """
+        if rng is None:
+            rng = numpy.random
+        if self.truncation_level is None:
+            return rng.standard_normal(size)
+        # the uniform draws are turned into the samples in place
+        samples = rng.random_sample(size)
+        samples *= self.cdf_width
+        samples += self.lower_cdf
+        return scipy.special.ndtri(samples, out=samples)
+
+
+def _get_rng(seed):
+    """
+    Return the random number generator to use for a seed: the seed itself if
+    it is a :class:`numpy.random.RandomState` instance, a new generator
+    initialized with the seed if it is an integer, or ``None``, meaning the
+    global numpy random number generator, if it is ``None``.
+
+    An integer seed gives the same numbers given by the global generator
+    after calling ``numpy.random.seed(seed)``, without changing its state.
+    """
+    if seed is None or isinstance(seed, numpy.random.RandomState):
+        return seed
+    return numpy.random.RandomState(seed)
+
+
+def _get_stddev_types(gsim, truncation_level, correlation_model):
+    """
+    Return the types of standard deviation needed to sample the ground
+    motion fields of a GSIM.
+
+    :raises CorrelationButNoInterIntraStdDevs:
+        If a correlation model is given and the GSIM defines only the
+        total standard deviation.
+    """
+    if truncation_level == 0:
+        assert correlation_model is None
+        return []
+    if gsim.DEFINED_FOR_STANDARD_DEVIATION_TYPES == set([StdDev.TOTAL]):
+        # If the GSIM provides only total standard deviation, we need
+        # to compute mean and total standard deviation at the sites
+        # of interest.
+        # In this case, we also assume no correlation model is used.
+        if correlation_model:
+            raise CorrelationButNoInterIntraStdDevs(correlation_model, gsim)
+        return [StdDev.TOTAL]
+    return [StdDev.INTER_EVENT, StdDev.INTRA_EVENT]
+
+
+def _sample_gmfs(gsim, sites, imts, means, stddevs, truncation_level,
+                 correlation_model, realizations, rng=None):
+    """
+    Sample the ground motion fields of a rupture, given the means and the
+    standard deviations of :func:`_get_stddev_types` computed by the GSIM
+    for each IMT.
+
+    The residuals of all the IMTs are drawn from the random number generator
+    ``rng`` (or from the global numpy one if ``rng`` is ``None``) with a
+    single call and then split, IMT by IMT, in the intra
+    event residuals, of shape ``(len(sites), realizations)``, and the inter
+    event residuals, of length ``realizations`` (or in the total residuals,
+    if the GSIM defines only the total standard deviation); the values are
+    the same as the ones of separate calls. The residuals are drawn with
+    :class:`TruncatedNormal`.
+
+    :returns:
+        An ordered dictionary IMT -> 2d array of ground motion values, with
+        a row per site and a column per realization.
+    """
+    result = collections.OrderedDict()
+    if truncation_level == 0:
+        for imt, mean in zip(imts, means):
+            mean = gsim.to_imt_unit_values(mean)
+            mean.shape += (1, )
+            mean = mean.repeat(realizations, axis=1)
+            result[imt] = mean
+        return result
+    distribution = TruncatedNormal(truncation_level)
+
+    num_sites = len(sites)
+    total_stddev_only = len(stddevs[0]) == 1
+    if total_stddev_only:
+        num_draws = num_sites * realizations
+    else:
+        num_draws = num_sites * realizations + realizations
+    size = num_draws * len(imts)
+    draws = distribution.rvs(size, rng)
+
+    for i, (imt, mean, imt_stddevs) in enumerate(zip(imts, means, stddevs)):
+        imt_draws = draws[i * num_draws:(i + 1) * num_draws]
+        intra_draws = imt_draws[:num_sites * realizations].reshape(
+            (num_sites, realizations))
+        mean = mean.reshape(mean.shape + (1, ))
+        if total_stddev_only:
+            [stddev_total] = imt_stddevs
+            stddev_total = stddev_total.reshape(stddev_total.shape + (1, ))
+            total_residual = stddev_total * intra_draws
+            gmf = gsim.to_imt_unit_values(mean + total_residual)
+        else:
+            [stddev_inter, stddev_intra] = imt_stddevs
+            stddev_intra = stddev_intra.reshape(stddev_intra.shape + (1, ))
+            stddev_inter = stddev_inter.reshape(stddev_inter.shape + (1, ))
+
+            intra_residual = stddev_intra * intra_draws
+
+            if correlation_model is not None:
+                intra_residual = correlation_model.apply_correlation(
+                    sites, imt, intra_residual
+                )
+
+            inter_residual = stddev_inter * imt_draws[
+                num_sites * realizations:]
+
+            gmf = gsim.to_imt_unit_values(
+                mean + intra_residual + inter_residual)
+
+        result[imt] = gmf
+
+    return result
+
+
+def batch_ground_motion_fields(ruptures_sites_seeds, imts, gsims,
+                               truncation_level, realizations=1,
+                               correlation_model=None):
+    """
+    Compute the ground motion fields of many ruptures at once, with the
+    same results of :class:`GmfComputer` for the same seeds.
+
+    The ruptures are grouped by GSIM and by the values of the rupture
+    parameters the GSIM requires; the site and distance contexts of the
+    ruptures in a group are stacked together, so that the means and the
+    standard deviations are computed with a single call of
+    :meth:`~openquake.hazardlib.gsim.base.GroundShakingIntensityModel.get_means_and_stddevs`
+    per group. The residuals of each rupture are then sampled with a
+    single call of the random number generator given by the seed of the
+    rupture.
+
+    :param ruptures_sites_seeds:
+        A list of triples ``(rupture, sites, seed)``, where ``sites``
+        is the (filtered) site collection of the rupture and ``seed``
+        the seed for the numpy random number generator, or a
+        :class:`numpy.random.RandomState` instance, or ``None`` to use
+        the global numpy random number generator.
+        A rupture can appear more than once, with different seeds.
+    :param imts:
+        List of intensity measure type objects (see
+        :mod:`openquake.hazardlib.imt`).
+    :param gsims:
+        Dictionary mapping tectonic region types (members
+        of :class:`openquake.hazardlib.const.TRT`) to
+        :class:`~openquake.hazardlib.gsim.base.GMPE` or
+        :class:`~openquake.hazardlib.gsim.base.IPE` objects.
+    :param truncation_level:
+        Float, number of standard deviations for truncation of the intensity
+        distribution, or ``None``.
+    :param realizations:
+        Integer number of GMF realizations to compute for each rupture.
+    :param correlation_model:
+        Instance of correlation model object. See
+        :mod:`openquake.hazardlib.correlation`. Can be ``None``, in which
+        case non-correlated ground motion fields are calculated.
+    :returns:
+        A list with an ordered dictionary per triple in
+        ``ruptures_sites_seeds``, in the same order, mapping the intensity
+        measure types to 2d arrays of ground motion values, with a row per
+        site of the rupture and a column per realization.
+    """
+    batch = [(rupture, sites) for rupture, sites, _ in ruptures_sites_seeds]
+    means_stddevs = [None] * len(batch)
+    for gsim, rctx, group in _group_ruptures(batch, gsims):
+        stddev_types = _get_stddev_types(
+            gsim, truncation_level, correlation_model)
+        sctx, dctx = _stack_contexts(gsim, [ctx for _, ctx in group])
+        means, stddevs = gsim.get_means_and_stddevs(
+            sctx, rctx, dctx, imts, stddev_types)
+        # split the stacked arrays by rupture
+        start = 0
+        for i, _ in group:
+            stop = start + len(batch[i][1])
+            means_stddevs[i] = (
+                gsim, [mean[start:stop] for mean in means],
+                [[stddev[start:stop] for stddev in imt_stddevs]
+                 for imt_stddevs in stddevs])
+            start = stop
+
+    results = []
+    for (rupture, sites, seed), (gsim, means, stddevs) in zip(
+            ruptures_sites_seeds, means_stddevs):
+        results.append(_sample_gmfs(
+            gsim, sites, imts, means, stddevs, truncation_level,
+            correlation_model, realizations, _get_rng(seed)))
+    return results
+
+
 # this is not used in the engine; it is still useful for usage in IPython
 # when demonstrating hazardlib capabilities
 def ground_motion_fields(rupture, sites, imts, gsim, truncation_level,
                          realizations, correlation_model=None,
                          rupture_site_filter=filters.rupture_site_noop_filter,
-                         seed=None):
+                         seed=None, monitor=None):
     """
     Given an earthquake rupture, the ground motion field calculator computes
     ground shaking over a set of sites, by randomly sampling a ground shaking
@@ -196,7 +370,8 @@ def ground_motion_fields(rupture, sites, imts, gsim, truncation_level,
     .. note::
 
      This calculator is using random numbers. In order to reproduce the
-     same results numpy random numbers generator needs to be seeded, see
+     same results either ``seed`` must be given or numpy random numbers
+     generator needs to be seeded, see
      http://docs.scipy.org/doc/numpy/reference/generated/numpy.random.seed.html
 
     :param openquake.hazardlib.source.rupture.Rupture rupture:
@@ -223,8 +398,15 @@ def ground_motion_fields(rupture, sites, imts, gsim, truncation_level,
     :param rupture_site_filter:
         Optional rupture-site filter function. See
         :mod:`openquake.hazardlib.calc.filters`.
-    :param int seed:
-        The seed used in the numpy random number generator
+    :param seed:
+        The seed used in the numpy random number generator, or a
+        :class:`numpy.random.RandomState` instance, for instance the one
+        returned by :func:`~openquake.hazardlib.calc.stochastic.random_state`
+        for the seed of the calculation and the indices of the rupture
+    :param monitor:
+        Optional :class:`~openquake.hazardlib.calc.monitor.Monitor`,
+        recording the stages ``rupture_filtering``, ``make_contexts``,
+        ``gmf_computation`` and ``expansion``.
     :returns:
         Dictionary mapping intensity measure type objects (same
         as in parameter ``imts``) to 2d numpy arrays of floats,
@@ -232,18 +414,27 @@ def ground_motion_fields(rupture, sites, imts, gsim, truncation_level,
         for all sites in the collection. First dimension represents
         sites and second one is for realizations.
     """
-    ruptures_sites = list(rupture_site_filter([(rupture, sites)]))
+    if monitor is None:
+        monitor = DummyMonitor()
+    ruptures_sites = list(monitor.iterate(
+        rupture_site_filter([(rupture, sites)]), 'rupture_filtering',
+        counter='filtered_ruptures'))
     if not ruptures_sites:
         return dict((imt, numpy.zeros((len(sites), realizations)))
                     for imt in imts)
     [(rupture, sites)] = ruptures_sites
-
-    gc = GmfComputer(rupture, sites, imts, gsim, truncation_level,
-                     correlation_model)
-    result = gc._compute(seed, gsim, realizations)
-    for imt, gmf in result.iteritems():
-        # makes sure the lenght of the arrays in output is the same as sites
-        if rupture_site_filter is not filters.rupture_site_noop_filter:
-            result[imt] = sites.expand(gmf, placeholder=0)
+    monitor.count('site_rupture_pairs', len(sites))
+
+    with monitor('make_contexts'):
+        gc = GmfComputer(rupture, sites, imts, gsim, truncation_level,
+                         correlation_model)
+    with monitor('gmf_computation'):
+        result = gc._compute(seed, gsim, realizations)
+    with monitor('expansion'):
+        for imt, gmf in result.iteritems():
+            # makes sure the lenght of the arrays in output is the same
+            # as sites
+            if rupture_site_filter is not filters.rupture_site_noop_filter:
+                result[imt] = sites.expand(gmf, placeholder=0)
 
     return result
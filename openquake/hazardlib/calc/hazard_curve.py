@@ -16,18 +16,36 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 :mod:`openquake.hazardlib.calc.hazard_curve` implements
-:func:`hazard_curves`.
+:func:`hazard_curves`, its vectorized variant :func:`batch_hazard_curves`,
+its multi-process variant :func:`parallel_hazard_curves`, its variant
+for GSIM logic trees :func:`hazard_curves_per_gsim`, its resumable
+variant :func:`incremental_hazard_curves`, the generator of the
+contributions of the sources :func:`hazard_curves_per_source` and
+:func:`hazard_curves_per_time_span`, computing the curves for several
+investigation times at once.
 """
+import os
 import sys
+import time
+import itertools
+import contextlib
+import collections
+import multiprocessing
+
 import numpy
 
 from openquake.hazardlib.calc import filters
+from openquake.hazardlib.calc.monitor import DummyMonitor
+from openquake.hazardlib.gsim.base import DistancesCache
+from openquake.hazardlib.site import FilteredSiteCollection
+from openquake.hazardlib.source.rupture import ParametricProbabilisticRupture
 
 
 def hazard_curves(
         sources, sites, imts, gsims, truncation_level,
         source_site_filter=filters.source_site_noop_filter,
-        rupture_site_filter=filters.rupture_site_noop_filter):
+        rupture_site_filter=filters.rupture_site_noop_filter,
+        monitor=None):
     """
     Compute hazard curves on a list of sites, given a set of seismic sources
     and a set of ground shaking intensity models (one per tectonic region type
@@ -75,6 +93,10 @@ def hazard_curves(
     :param rupture_site_filter:
         Optional rupture-site filter function. See
         :mod:`openquake.hazardlib.calc.filters`.
+    :param monitor:
+        Optional :class:`~openquake.hazardlib.calc.monitor.Monitor`,
+        recording also the stages ``make_contexts``, ``get_poes`` and
+        ``accumulation``.
 
     :returns:
         Dictionary mapping intensity measure type objects (same keys
@@ -84,27 +106,762 @@ def hazard_curves(
         differentiates IMLs (the order and length are the same as
         corresponding value in ``imts`` dict).
     """
+    if monitor is None:
+        monitor = DummyMonitor()
     curves = dict((imt, numpy.ones([len(sites), len(imts[imt])]))
                   for imt in imts)
+    gsims = _gsim_lists(gsims)
+    for source, s_sites in _iter_sources(sources, sites, source_site_filter,
+                                         monitor):
+        for rupture, r_sites, [poes_by_imt] in _iter_poes(
+                source, s_sites, imts, gsims, truncation_level,
+                rupture_site_filter, monitor):
+            with monitor('accumulation', source.source_id):
+                for imt in imts:
+                    pno = rupture.get_probability_no_exceedance(
+                        poes_by_imt[imt])
+                    r_sites.expand_into(curves[imt], pno)
+
+    for imt in imts:
+        curves[imt] = 1 - curves[imt]
+    return curves
+
+
+def _gsim_lists(gsims):
+    """
+    Given a dictionary mapping tectonic region types to GSIMs, return a
+    dictionary mapping them to lists with a single GSIM, as required by
+    :func:`_iter_poes`.
+    """
+    return dict((trt, [gsim]) for trt, gsim in gsims.iteritems())
+
+
+def _iter_sources(sources, sites, source_site_filter, monitor):
+    """
+    Generate the pairs (source, filtered site collection) of the sources
+    passing the source-site filter, recording the stage
+    ``source_filtering`` and the counter ``sources`` in the monitor.
+    """
     sources_sites = ((source, sites) for source in sources)
-    for source, s_sites in source_site_filter(sources_sites):
-        try:
-            ruptures_sites = ((rupture, s_sites)
-                              for rupture in source.iter_ruptures())
-            for rupture, r_sites in rupture_site_filter(ruptures_sites):
-                gsim = gsims[rupture.tectonic_region_type]
-                sctx, rctx, dctx = gsim.make_contexts(r_sites, rupture)
+    return monitor.iterate(source_site_filter(sources_sites),
+                           'source_filtering', counter='sources')
+
+
+def _iter_ruptures(source, s_sites, rupture_site_filter, monitor):
+    """
+    Generate the pairs (rupture, filtered site collection) of the
+    ruptures of a source passing the rupture-site filter, recording the
+    stages ``iter_ruptures`` and ``rupture_filtering`` and the counters
+    ``ruptures``, ``filtered_ruptures`` and ``site_rupture_pairs`` in the
+    monitor.
+    """
+    source_id = source.source_id
+    ruptures = monitor.iterate(source.iter_ruptures(), 'iter_ruptures',
+                               source_id, 'ruptures')
+    ruptures_sites = ((rupture, s_sites) for rupture in ruptures)
+    for rupture, r_sites in monitor.iterate(
+            rupture_site_filter(ruptures_sites), 'rupture_filtering',
+            source_id, 'filtered_ruptures'):
+        monitor.count('site_rupture_pairs', len(r_sites), source_id)
+        yield rupture, r_sites
+
+
+def _iter_poes(source, s_sites, imts, gsims, truncation_level,
+               rupture_site_filter, monitor, distances_cache=None):
+    """
+    Generate the triples (rupture, filtered site collection, poes) for the
+    ruptures of a source passing the rupture-site filter, where ``poes``
+    is a list with the dictionaries returned by
+    :meth:`~openquake.hazardlib.gsim.base.GroundShakingIntensityModel.get_poes_by_imt`
+    for each GSIM of the tectonic region type of the rupture. The stages
+    ``make_contexts`` and ``get_poes`` are recorded in the monitor, besides
+    the ones of :func:`_iter_ruptures`.
+
+    :param gsims:
+        Dictionary mapping tectonic region types to lists of GSIMs.
+    :param distances_cache:
+        Optional :class:`~openquake.hazardlib.gsim.base.DistancesCache`
+        passed to the GSIMs.
+    :raises:
+        The errors occurring while processing the source, with the id of
+        the source in the message.
+    """
+    source_id = source.source_id
+    with _source_errors(source):
+        for rupture, r_sites in _iter_ruptures(source, s_sites,
+                                               rupture_site_filter, monitor):
+            poes = []
+            for gsim in gsims[rupture.tectonic_region_type]:
+                with monitor('make_contexts', source_id):
+                    if distances_cache is None:
+                        sctx, rctx, dctx = gsim.make_contexts(r_sites, rupture)
+                    else:
+                        sctx, rctx, dctx = gsim.make_contexts(
+                            r_sites, rupture, distances_cache)
+                with monitor('get_poes', source_id):
+                    poes.append(gsim.get_poes_by_imt(
+                        sctx, rctx, dctx, imts, truncation_level))
+            yield rupture, r_sites, poes
+
+
+@contextlib.contextmanager
+def _source_errors(source):
+    """
+    Context manager adding the id of a source to the message of the errors
+    raised in its block.
+    """
+    try:
+        yield
+    except Exception, err:
+        etype, err, tb = sys.exc_info()
+        msg = 'An error occurred with source id=%s. Error: %s'
+        msg %= (source.source_id, err.message)
+        raise etype, msg, tb
+
+
+def batch_hazard_curves(
+        sources, sites, imts, gsims, truncation_level,
+        source_site_filter=filters.source_site_noop_filter,
+        rupture_site_filter=filters.rupture_site_noop_filter,
+        batch_size=1000, monitor=None):
+    """
+    Compute hazard curves like :func:`hazard_curves` does, but processing
+    the ruptures of each source in batches rather than one at a time.
+
+    The ruptures of a batch are grouped by GSIM and by the values of the
+    rupture parameters the GSIM requires (for instance all the ruptures of
+    an area source with the same magnitude and nodal plane). The site and
+    distance contexts of the ruptures in a group are stacked together, so
+    that :meth:`~openquake.hazardlib.gsim.base.GroundShakingIntensityModel.get_poes_by_imt`
+    is called once per group instead of once per rupture.
+    The probabilities of no exceedance of the whole batch are then
+    multiplied into the curves in a single vectorized step, preserving
+    the order of the ruptures, so that the result is exactly the same
+    as the one of :func:`hazard_curves`.
+
+    All the parameters and the return value are the same as in
+    :func:`hazard_curves`, except for
+
+    :param batch_size:
+        Maximum number of ruptures of a source processed together.
+        Bigger batches mean fewer GSIM calls and more memory.
+    """
+    if monitor is None:
+        monitor = DummyMonitor()
+    curves = dict((imt, numpy.ones([len(sites), len(imts[imt])]))
+                  for imt in imts)
+    for source, s_sites in _iter_sources(sources, sites, source_site_filter,
+                                         monitor):
+        with _source_errors(source):
+            batch = []
+            for rupture, r_sites in _iter_ruptures(
+                    source, s_sites, rupture_site_filter, monitor):
+                batch.append((rupture, r_sites))
+                if len(batch) == batch_size:
+                    _update_curves(curves, batch, imts, gsims,
+                                   truncation_level, monitor, source.source_id)
+                    batch = []
+            if batch:
+                _update_curves(curves, batch, imts, gsims, truncation_level,
+                               monitor, source.source_id)
+
+    for imt in imts:
+        curves[imt] = 1 - curves[imt]
+    return curves
+
+
+def _update_curves(curves, batch, imts, gsims, truncation_level, monitor,
+                   source_id):
+    """
+    Multiply the probabilities of no exceedance of a batch of ruptures
+    into ``curves``.
+
+    :param curves:
+        Dictionary IMT -> 2d array of probabilities of no exceedance
+        for all the sites, updated in place.
+    :param batch:
+        List of pairs (rupture, filtered site collection).
+    :param monitor:
+        Monitor recording the stages ``make_contexts``, ``get_poes`` and
+        ``accumulation`` for the source with id ``source_id``.
+    """
+    # the offsets of the rows of each rupture in the stacked arrays,
+    # in the original order of the ruptures
+    sizes = numpy.array([len(r_sites) for _, r_sites in batch])
+    stops = numpy.cumsum(sizes)
+    starts = stops - sizes
+    pnos = dict((imt, numpy.empty((stops[-1], len(imts[imt]))))
+                for imt in imts)
+
+    with monitor('make_contexts', source_id):
+        groups = _group_ruptures(batch, gsims)
+    for gsim, rctx, group in groups:
+        with monitor('make_contexts', source_id):
+            sctx, dctx = _stack_contexts(gsim, [ctx for _, ctx in group])
+        group_stops = numpy.cumsum(sizes[[i for i, _ in group]])
+        with monitor('get_poes', source_id):
+            poes_by_imt = gsim.get_poes_by_imt(sctx, rctx, dctx, imts,
+                                               truncation_level)
+        for imt in imts:
+            poes = poes_by_imt[imt]
+            start = 0
+            for (i, _), stop in zip(group, group_stops):
+                rupture = batch[i][0]
+                pnos[imt][starts[i]:stops[i]] = \
+                    rupture.get_probability_no_exceedance(poes[start:stop])
+                start = stop
+
+    # multiply the probabilities into the curves following the order
+    # of the ruptures, so that each site gets the same sequence of
+    # multiplications as in :func:`hazard_curves`; consecutive ruptures
+    # affecting the same sites are reduced in a single step
+    with monitor('accumulation', source_id):
+        first = 0
+        while first < len(batch):
+            r_sites = batch[first][1]
+            last = first + 1
+            while last < len(batch) and batch[last][1] is r_sites:
+                last += 1
+            for imt in imts:
+                block = pnos[imt][starts[first]:stops[last - 1]].reshape(
+                    (last - first, len(r_sites), len(imts[imt])))
+                idx = r_sites.indices
+                block = numpy.concatenate([curves[imt][idx][None], block])
+                curves[imt][idx] = numpy.multiply.reduce(block, axis=0)
+            first = last
+
+
+def _group_ruptures(batch, gsims):
+    """
+    Group the ruptures of a batch by GSIM and rupture context.
+
+    :returns:
+        A list of triples (gsim, rupture context, group) where group is
+        a list of pairs (index in the batch, (sctx, dctx)).
+    """
+    groups = collections.OrderedDict()
+    for i, (rupture, r_sites) in enumerate(batch):
+        gsim = gsims[rupture.tectonic_region_type]
+        sctx, rctx, dctx = gsim.make_contexts(r_sites, rupture)
+        key = (id(gsim),) + tuple(
+            getattr(rctx, param)
+            for param in sorted(gsim.REQUIRES_RUPTURE_PARAMETERS))
+        if key not in groups:
+            groups[key] = (gsim, rctx, [])
+        groups[key][2].append((i, (sctx, dctx)))
+    return groups.values()
+
+
+def _stack_contexts(gsim, contexts):
+    """
+    Concatenate the site and distance contexts of several ruptures
+    sharing the same rupture context.
+
+    :param gsim:
+        The GSIM the contexts were made for.
+    :param contexts:
+        A list of pairs (sctx, dctx).
+    :returns:
+        A pair (sctx, dctx) with the arrays of all the contexts concatenated.
+    """
+    if len(contexts) == 1:
+        return contexts[0]
+    sctx, dctx = type(contexts[0][0])(), type(contexts[0][1])()
+    for param in gsim.REQUIRES_SITES_PARAMETERS:
+        setattr(sctx, param, numpy.concatenate(
+            [getattr(ctx, param) for ctx, _ in contexts]))
+    for param in gsim.REQUIRES_DISTANCES:
+        setattr(dctx, param, numpy.concatenate(
+            [getattr(ctx, param) for _, ctx in contexts]))
+    return sctx, dctx
+
+
+def parallel_hazard_curves(
+        sources, sites, imts, gsims, truncation_level,
+        source_site_filter=filters.source_site_noop_filter,
+        rupture_site_filter=filters.rupture_site_noop_filter,
+        num_workers=None, tasks_per_worker=4, weight=None):
+    """
+    Compute hazard curves like :func:`hazard_curves` does, but distributing
+    the sources across a pool of worker processes.
+
+    The sources passing the source-site filter are split into blocks of
+    consecutive sources with roughly the same total weight. Each worker
+    computes, for every source of its block, the product of the
+    probabilities of no exceedance of the source's ruptures on the sites
+    affected by the source. The parent process multiplies those partial
+    products into the curves following the order of the sources, so that
+    the result does not depend on the number of workers nor on the way
+    the sources are split.
+
+    The site collection, the rupture-site filter, the GSIMs and the IMTs
+    are passed to the workers when the pool is created (by forking the
+    parent process), so that they do not need to be pickleable; only the
+    sources and the indices of the sites they affect are sent to the
+    workers with the tasks. For the same reason this calculator does not
+    accept a monitor: the ruptures are processed in other processes.
+
+    All the parameters and the return value are the same as in
+    :func:`hazard_curves`, except for
+
+    :param num_workers:
+        Number of worker processes, by default the number of CPUs.
+        If 1, the calculation is performed in the current process.
+    :param tasks_per_worker:
+        Number of blocks of sources per worker. More blocks mean a better
+        load balancing and more overhead.
+    :param weight:
+        Function returning the weight of a source, by default
+        :meth:`~openquake.hazardlib.source.base.BaseSeismicSource.count_ruptures`.
+    """
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    if weight is None:
+        weight = lambda source: source.count_ruptures()
+
+    curves = dict((imt, numpy.ones([len(sites), len(imts[imt])]))
+                  for imt in imts)
+    sources_indices = [
+        (source, s_sites.indices) for source, s_sites in
+        source_site_filter((source, sites) for source in sources)]
+    blocks = _split_sources(sources_indices, num_workers * tasks_per_worker,
+                            weight)
+    args = (sites, imts, gsims, truncation_level, rupture_site_filter)
+    if num_workers == 1:
+        _init_worker(*args)
+        results = itertools.imap(_source_pnos, blocks)
+    else:
+        pool = multiprocessing.Pool(num_workers, _init_worker, args)
+        results = pool.imap(_source_pnos, blocks)
+    try:
+        # ``imap`` returns the results in the order of the blocks
+        for block_pnos in results:
+            for indices, pnos in block_pnos:
+                for imt in imts:
+                    curves[imt][indices] *= pnos[imt]
+    finally:
+        if num_workers != 1:
+            pool.terminate()
+
+    for imt in imts:
+        curves[imt] = 1 - curves[imt]
+    return curves
+
+
+def _split_sources(sources_indices, num_blocks, weight):
+    """
+    Split a list of pairs (source, site indices) in at most ``num_blocks``
+    lists of consecutive pairs with similar total weight.
+    """
+    weights = [weight(source) for source, _ in sources_indices]
+    max_weight = float(sum(weights)) / num_blocks
+    blocks = []
+    block = []
+    block_weight = 0
+    for source_indices, source_weight in zip(sources_indices, weights):
+        if block and block_weight + source_weight > max_weight:
+            blocks.append(block)
+            block = []
+            block_weight = 0
+        block.append(source_indices)
+        block_weight += source_weight
+    if block:
+        blocks.append(block)
+    return blocks
+
+
+# parameters of the calculation shared by all the tasks of a worker,
+# set by :func:`_init_worker`
+_worker_args = None
+
+
+def _init_worker(sites, imts, gsims, truncation_level, rupture_site_filter):
+    """
+    Store the parameters of the calculation in the current process.
+    """
+    global _worker_args
+    _worker_args = (sites, imts, gsims, truncation_level, rupture_site_filter)
+
+
+def _source_pnos(sources_indices):
+    """
+    Compute the products of the probabilities of no exceedance
+    of the ruptures of each source.
+
+    :param sources_indices:
+        A list of pairs (source, indices of the sites affected by it).
+    :returns:
+        A list of pairs (site indices, dictionary IMT -> 2d array),
+        one per source, where the arrays contain the probabilities
+        of no exceedance for the sites affected by the source.
+    """
+    sites, imts, gsims, truncation_level, rupture_site_filter = _worker_args
+    gsims = _gsim_lists(gsims)
+    monitor = DummyMonitor()
+    result = []
+    for source, indices in sources_indices:
+        if len(indices) == len(sites):
+            s_sites = sites
+        else:
+            s_sites = FilteredSiteCollection(indices, sites)
+        # only the rows of the sites affected by the source
+        pnos = dict((imt, numpy.ones([len(indices), len(imts[imt])]))
+                    for imt in imts)
+        for rupture, r_sites, [poes_by_imt] in _iter_poes(
+                source, s_sites, imts, gsims, truncation_level,
+                rupture_site_filter, monitor):
+            if r_sites is s_sites:
+                rows = slice(None)
+            else:
+                # positions of the rupture sites among the source sites
+                rows = indices.searchsorted(r_sites.indices)
+            for imt in imts:
+                pnos[imt][rows] *= rupture.get_probability_no_exceedance(
+                    poes_by_imt[imt])
+        result.append((indices, pnos))
+    return result
+
+
+def incremental_hazard_curves(
+        sources, sites, imts, gsims, truncation_level, checkpoint,
+        source_site_filter=filters.source_site_noop_filter,
+        rupture_site_filter=filters.rupture_site_noop_filter,
+        checkpoint_interval=600, monitor=None):
+    """
+    Compute hazard curves like :func:`hazard_curves` does, periodically
+    saving the partial results in a checkpoint file, so that a calculation
+    can be resumed after a crash.
+
+    The checkpoint file contains the products of the probabilities of no
+    exceedance of the sources computed so far and the ids of those sources.
+    If the file exists when the function is called, the calculation starts
+    from the saved products and the sources already computed are skipped.
+    This also allows to update the curves of a source model with some new
+    sources without recomputing the old ones: just call the function again
+    with the complete model and the same checkpoint file. The source ids
+    must be unique.
+
+    All the parameters and the return value are the same as in
+    :func:`hazard_curves`, except for
+
+    :param checkpoint:
+        Path of the checkpoint file, a ``.npz`` archive.
+    :param checkpoint_interval:
+        Minimum number of seconds between two savings of the checkpoint
+        file. The file is also saved at the end of the calculation.
+    :raises ValueError:
+        If the checkpoint file was saved for different sites, IMTs or
+        intensity measure levels.
+    """
+    if monitor is None:
+        monitor = DummyMonitor()
+    if os.path.exists(checkpoint):
+        curves, done = _load_checkpoint(checkpoint, sites, imts)
+    else:
+        curves = dict((imt, numpy.ones([len(sites), len(imts[imt])]))
+                      for imt in imts)
+        done = set()
+    last_save = time.time()
+    gsims = _gsim_lists(gsims)
+    sources = (source for source in sources if source.source_id not in done)
+    for source, s_sites in _iter_sources(sources, sites, source_site_filter,
+                                         monitor):
+        for rupture, r_sites, [poes_by_imt] in _iter_poes(
+                source, s_sites, imts, gsims, truncation_level,
+                rupture_site_filter, monitor):
+            with monitor('accumulation', source.source_id):
                 for imt in imts:
-                    poes = gsim.get_poes(sctx, rctx, dctx, imt, imts[imt],
-                                         truncation_level)
-                    pno = rupture.get_probability_no_exceedance(poes)
-                    curves[imt] *= r_sites.expand(pno, placeholder=1)
-        except Exception, err:
-            etype, err, tb = sys.exc_info()
-            msg = 'An error occurred with source id=%s. Error: %s'
-            msg %= (source.source_id, err.message)
-            raise etype, msg, tb
+                    pno = rupture.get_probability_no_exceedance(
+                        poes_by_imt[imt])
+                    r_sites.expand_into(curves[imt], pno)
+        done.add(source.source_id)
+        if time.time() - last_save >= checkpoint_interval:
+            _save_checkpoint(checkpoint, curves, imts, done)
+            last_save = time.time()
+    _save_checkpoint(checkpoint, curves, imts, done)
 
     for imt in imts:
         curves[imt] = 1 - curves[imt]
     return curves
+
+
+def _save_checkpoint(fname, curves, imts, done):
+    """
+    Save the probabilities of no exceedance and the ids of the computed
+    sources in a checkpoint file. The file is written under a temporary
+    name and then renamed, so that a crash while saving does not corrupt
+    the previous checkpoint.
+    """
+    arrays = {'imts': numpy.array([repr(imt) for imt in sorted(imts)]),
+              'source_ids': numpy.array(sorted(done), dtype=str)}
+    for i, imt in enumerate(sorted(imts)):
+        arrays['imls_%d' % i] = numpy.array(imts[imt], dtype=float)
+        arrays['pnos_%d' % i] = curves[imt]
+    tmp = fname + '.tmp'
+    with open(tmp, 'wb') as f:
+        numpy.savez(f, **arrays)
+    os.rename(tmp, fname)
+
+
+def _load_checkpoint(fname, sites, imts):
+    """
+    Read a checkpoint file saved by :func:`_save_checkpoint`.
+
+    :returns:
+        A pair (dictionary IMT -> 2d array of probabilities of no
+        exceedance, set of the ids of the computed sources).
+    """
+    data = numpy.load(fname)
+    try:
+        if data['imts'].tolist() != [repr(imt) for imt in sorted(imts)]:
+            raise ValueError('checkpoint file %s was saved for IMTs %s' %
+                             (fname, ', '.join(data['imts'])))
+        curves = {}
+        for i, imt in enumerate(sorted(imts)):
+            if data['imls_%d' % i].tolist() != list(imts[imt]):
+                raise ValueError(
+                    'checkpoint file %s was saved for different '
+                    'levels of %s' % (fname, imt))
+            curves[imt] = data['pnos_%d' % i]
+            if len(curves[imt]) != len(sites):
+                raise ValueError(
+                    'checkpoint file %s was saved for %d sites, not %d' %
+                    (fname, len(curves[imt]), len(sites)))
+        done = set(data['source_ids'].tolist())
+    finally:
+        data.close()
+    return curves, done
+
+
+def hazard_curves_per_source(
+        sources, sites, imts, gsims, truncation_level,
+        source_site_filter=filters.source_site_noop_filter,
+        rupture_site_filter=filters.rupture_site_noop_filter,
+        curves=None, sparse=False, monitor=None):
+    """
+    Generate the contributions of the sources to the hazard curves, one
+    source at a time, so that the contributions and the total curves can
+    be computed in a single pass without keeping all the contributions
+    in memory.
+
+    The contribution of a source is the product of the probabilities of no
+    exceedance of its ruptures; the curves of the source alone are one
+    minus its contribution, and the curves of all the sources, the same
+    as computed by :func:`hazard_curves`, are one minus the product of all
+    the contributions. Sources not passing the source-site filter do not
+    contribute and are not generated.
+
+    All the parameters are the same as in :func:`hazard_curves`, except for
+
+    :param curves:
+        Optional dictionary mapping intensity measure type objects (same
+        keys as in parameter ``imts``) to 2d numpy arrays of probabilities
+        of no exceedance for all the sites, like ``numpy.ones`` arrays.
+        The arrays are multiplied in place by the contribution of each
+        source before the contribution is generated, so that the total
+        is maintained along with the contributions.
+    :param sparse:
+        If ``True`` the arrays of a contribution contain only the rows of
+        the sites affected by the source.
+
+    :returns:
+        A generator of triples ``(source_id, indices, pnos)`` where
+        ``indices`` is the array of the indices of the sites affected by
+        the source and ``pnos`` is a dictionary mapping intensity measure
+        type objects to 2d numpy arrays of probabilities of no exceedance.
+        The first dimension of the arrays differentiates all the sites,
+        or only the sites in ``indices`` if ``sparse`` is ``True``, and
+        the second one differentiates IMLs.
+    """
+    if monitor is None:
+        monitor = DummyMonitor()
+    gsims = _gsim_lists(gsims)
+    for source, s_sites in _iter_sources(sources, sites, source_site_filter,
+                                         monitor):
+        pnos = dict((imt, numpy.ones([len(s_sites), len(imts[imt])]))
+                    for imt in imts)
+        for rupture, r_sites, [poes_by_imt] in _iter_poes(
+                source, s_sites, imts, gsims, truncation_level,
+                rupture_site_filter, monitor):
+            with monitor('accumulation', source.source_id):
+                if r_sites is s_sites:
+                    rows = slice(None)
+                else:
+                    # positions of the rupture sites among the source sites
+                    rows = s_sites.indices.searchsorted(r_sites.indices)
+                for imt in imts:
+                    pnos[imt][rows] *= rupture.get_probability_no_exceedance(
+                        poes_by_imt[imt])
+        if curves is not None:
+            for imt in imts:
+                s_sites.expand_into(curves[imt], pnos[imt])
+        if not sparse:
+            for imt in imts:
+                pnos[imt] = s_sites.expand(pnos[imt], placeholder=1)
+        yield source.source_id, s_sites.indices, pnos
+
+
+def hazard_curves_per_time_span(
+        sources, sites, imts, gsims, truncation_level, time_spans,
+        source_site_filter=filters.source_site_noop_filter,
+        rupture_site_filter=filters.rupture_site_noop_filter,
+        monitor=None):
+    """
+    Compute hazard curves like :func:`hazard_curves` does, for several
+    time spans with a single pass over the sources.
+
+    For a Poissonian rupture with annual occurrence rate ``ν`` the
+    probability of no exceedance in the time span ``T`` is ::
+
+        (1 - P(rup|T)) ** P(X≥x|rup) = e ** (-ν * T * P(X≥x|rup))
+
+    so that the product over the ruptures can be computed for any time
+    span from the sum of the annual rates of exceedance ``ν * P(X≥x|rup)``.
+    The rates of the parametric ruptures are summed, ignoring the time
+    span of their temporal occurrence model, and converted into curves
+    at the end. The probabilities of no exceedance of the non-parametric
+    ruptures are multiplied as in :func:`hazard_curves`: since their
+    probabilities of occurrence are given for the time span of their
+    PMF, they enter unchanged in the curves of all the time spans.
+
+    All the parameters are the same as in :func:`hazard_curves`, except for
+
+    :param time_spans:
+        A list of time spans, in years.
+
+    :returns:
+        A list of dictionaries like the one returned by
+        :func:`hazard_curves`, one per time span in the same order as in
+        ``time_spans``.
+    """
+    if monitor is None:
+        monitor = DummyMonitor()
+    rates = dict((imt, numpy.zeros([len(sites), len(imts[imt])]))
+                 for imt in imts)
+    pnos = dict((imt, numpy.ones([len(sites), len(imts[imt])]))
+                for imt in imts)
+    gsims = _gsim_lists(gsims)
+    for source, s_sites in _iter_sources(sources, sites, source_site_filter,
+                                         monitor):
+        for rupture, r_sites, [poes_by_imt] in _iter_poes(
+                source, s_sites, imts, gsims, truncation_level,
+                rupture_site_filter, monitor):
+            parametric = isinstance(rupture, ParametricProbabilisticRupture)
+            with monitor('accumulation', source.source_id):
+                for imt in imts:
+                    if parametric:
+                        r_sites.expand_into(
+                            rates[imt],
+                            rupture.occurrence_rate * poes_by_imt[imt],
+                            numpy.add)
+                    else:
+                        r_sites.expand_into(
+                            pnos[imt], rupture.get_probability_no_exceedance(
+                                poes_by_imt[imt]))
+
+    return [dict((imt, 1 - numpy.exp(-time_span * rates[imt]) * pnos[imt])
+                 for imt in imts) for time_span in time_spans]
+
+
+def hazard_curves_per_gsim(
+        sources, sites, imts, gsims, truncation_level,
+        source_site_filter=filters.source_site_noop_filter,
+        rupture_site_filter=filters.rupture_site_noop_filter,
+        monitor=None):
+    """
+    Compute hazard curves for several GSIMs per tectonic region type,
+    like the branches of a GSIM logic tree, with a single pass over the
+    sources and their ruptures.
+
+    Every rupture is generated and filtered once, and all the GSIMs of its
+    tectonic region type are evaluated on it; the distances between the
+    rupture and the sites are computed only once (see
+    :class:`~openquake.hazardlib.gsim.base.DistancesCache`). The curves
+    computed for each GSIM are equal to the ones computed by
+    :func:`hazard_curves` for the sources of its tectonic region type.
+    Curves for the full logic tree can be obtained with
+    :func:`mean_hazard_curves`.
+
+    All the parameters are the same as in :func:`hazard_curves`, except for
+
+    :param gsims:
+        Dictionary mapping tectonic region types (members
+        of :class:`openquake.hazardlib.const.TRT`) to lists of
+        :class:`~openquake.hazardlib.gsim.base.GMPE` or
+        :class:`~openquake.hazardlib.gsim.base.IPE` objects.
+
+    :returns:
+        Dictionary mapping tectonic region types (same keys as in parameter
+        ``gsims``) to lists of curves, one per GSIM in the same order as in
+        ``gsims``. The curves are dictionaries like the ones returned by
+        :func:`hazard_curves`, computed only for the sources of that
+        tectonic region type.
+    """
+    if monitor is None:
+        monitor = DummyMonitor()
+    curves = dict(
+        (trt, [dict((imt, numpy.ones([len(sites), len(imts[imt])]))
+                    for imt in imts) for _ in gsims[trt]])
+        for trt in gsims)
+    distances_cache = DistancesCache()
+    for source, s_sites in _iter_sources(sources, sites, source_site_filter,
+                                         monitor):
+        for rupture, r_sites, poes in _iter_poes(
+                source, s_sites, imts, gsims, truncation_level,
+                rupture_site_filter, monitor, distances_cache):
+            trt_curves = curves[rupture.tectonic_region_type]
+            with monitor('accumulation', source.source_id):
+                for poes_by_imt, gsim_curves in zip(poes, trt_curves):
+                    for imt in imts:
+                        pno = rupture.get_probability_no_exceedance(
+                            poes_by_imt[imt])
+                        r_sites.expand_into(gsim_curves[imt], pno)
+
+    for trt in curves:
+        for gsim_curves in curves[trt]:
+            for imt in imts:
+                gsim_curves[imt] = 1 - gsim_curves[imt]
+    return curves
+
+
+def mean_hazard_curves(curves_per_gsim, weights):
+    """
+    Compute the weighted mean of the hazard curves of all the realizations
+    of a GSIM logic tree, where a realization takes one GSIM per tectonic
+    region type.
+
+    Since the branches of different tectonic region types are chosen
+    independently, the mean over all the realizations is computed without
+    enumerating them, as ::
+
+        P(X≥x|T) = 1 - ∏ ∑ w_ij P_ij(X<x|T)
+
+    where ``P_ij(X<x|T)`` is the probability of no exceedance computed with
+    the j-th GSIM of the i-th tectonic region type, and ``w_ij`` its weight.
+
+    :param curves_per_gsim:
+        Curves returned by :func:`hazard_curves_per_gsim`.
+    :param weights:
+        Dictionary mapping tectonic region types to lists of weights of the
+        GSIMs, in the same order as in ``curves_per_gsim``. The weights
+        of each tectonic region type must sum up to one.
+    :returns:
+        Dictionary mapping intensity measure type objects to 2d numpy arrays
+        of float, like the one returned by :func:`hazard_curves`.
+    """
+    mean_pnos = {}
+    for trt, trt_curves in curves_per_gsim.iteritems():
+        trt_weights = weights[trt]
+        if len(trt_weights) != len(trt_curves):
+            raise ValueError('%d weights given for %d GSIMs of %s' %
+                             (len(trt_weights), len(trt_curves), trt))
+        if abs(sum(trt_weights) - 1) > 1e-6:
+            raise ValueError('the weights of %s do not sum up to 1' % trt)
+        for imt in trt_curves[0]:
+            trt_pnos = sum(weight * (1 - curves[imt]) for curves, weight
+                           in zip(trt_curves, trt_weights))
+            if imt in mean_pnos:
+                mean_pnos[imt] *= trt_pnos
+            else:
+                mean_pnos[imt] = trt_pnos
+    return dict((imt, 1 - mean_pnos[imt]) for imt in mean_pnos)
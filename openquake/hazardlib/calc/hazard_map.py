@@ -0,0 +1,145 @@
+# The Hazard Library
+# Copyright (C) 2012-2014, GEM Foundation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Module :mod:`~openquake.hazardlib.calc.hazard_map` computes hazard maps
+and uniform hazard spectra from the hazard curves returned by
+:func:`~openquake.hazardlib.calc.hazard_curve.hazard_curves`.
+"""
+import numpy
+
+from openquake.hazardlib.imt import PGA, SA
+
+#: Probabilities of exceedance of the curves lower than this value are
+#: replaced by it before taking their logarithm
+MIN_POE = numpy.finfo(float).tiny
+
+
+def compute_hazard_maps(curves, imls, poes, sites_per_chunk=100000):
+    """
+    Compute the intensity measure levels with given probabilities of
+    exceedance, for all the sites at once.
+
+    The levels are found by linear interpolation of the logarithm of the
+    levels against the logarithm of the probabilities of exceedance, so
+    that the result is the same as calling :func:`numpy.interp` on the
+    logarithms of each curve. Probabilities higher than the first point
+    of a curve give the first level, probabilities lower than the last
+    point of a curve give the last level.
+
+    :param curves:
+        2d array of probabilities of exceedance, where the first dimension
+        differentiates sites and the second one the levels. The curves
+        must be non increasing.
+    :param imls:
+        The intensity measure levels of the curves, in increasing order.
+    :param poes:
+        A list of positive probabilities of exceedance.
+    :param sites_per_chunk:
+        Number of sites processed together, to bound the memory
+        used for the temporary arrays.
+    :returns:
+        2d array of intensity measure levels, where the first dimension
+        differentiates sites and the second one the values of ``poes``.
+    :raises ValueError:
+        If there are less than two levels or some of the ``poes``
+        is not positive.
+    """
+    curves = numpy.asarray(curves, dtype=float)
+    log_imls = numpy.log(numpy.asarray(imls, dtype=float))
+    poes = numpy.asarray(poes, dtype=float)
+    num_levels = len(log_imls)
+    if num_levels < 2:
+        raise ValueError('at least two intensity measure levels are needed')
+    if not (poes > 0).all():
+        raise ValueError('poes must be positive')
+    assert curves.shape[1:] == (num_levels,), (curves.shape, num_levels)
+
+    result = numpy.empty((len(curves), len(poes)))
+    for start in xrange(0, len(curves), sites_per_chunk):
+        chunk = curves[start:start + sites_per_chunk]
+        log_curves = numpy.log(numpy.maximum(chunk, MIN_POE))
+        rows = numpy.arange(len(chunk))
+        for i, poe in enumerate(poes):
+            # index of the last level with a probability not lower than
+            # poe, so that poe is between the probabilities of the levels
+            # ``lower`` and ``lower + 1``
+            last = (chunk >= poe).sum(axis=1) - 1
+            lower = numpy.clip(last, 0, num_levels - 2)
+            x0 = log_curves[rows, lower]
+            x1 = log_curves[rows, lower + 1]
+            y0 = log_imls[lower]
+            y1 = log_imls[lower + 1]
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                values = y0 + (numpy.log(poe) - x0) * (y1 - y0) / (x1 - x0)
+            values[last < 0] = log_imls[0]
+            values[last == num_levels - 1] = log_imls[-1]
+            result[start:start + len(chunk), i] = numpy.exp(values)
+    return result
+
+
+def hazard_maps(curves, imts, poes, sites_per_chunk=100000):
+    """
+    Compute the hazard maps for all the intensity measure types.
+
+    :param curves:
+        Dictionary mapping intensity measure type objects to 2d arrays
+        of probabilities of exceedance, as returned by
+        :func:`~openquake.hazardlib.calc.hazard_curve.hazard_curves`.
+    :param imts:
+        Dictionary mapping intensity measure type objects to lists of
+        intensity measure levels, the same passed to the calculator.
+    :param poes:
+        A list of positive probabilities of exceedance.
+    :param sites_per_chunk:
+        See :func:`compute_hazard_maps`.
+    :returns:
+        Dictionary mapping intensity measure type objects to the 2d
+        arrays returned by :func:`compute_hazard_maps`.
+    """
+    return dict((imt, compute_hazard_maps(curves[imt], imts[imt], poes,
+                                          sites_per_chunk))
+                for imt in curves)
+
+
+def uniform_hazard_spectra(curves, imts, poes, sites_per_chunk=100000):
+    """
+    Compute the uniform hazard spectra from the curves of the spectral
+    accelerations and of the peak ground acceleration, considered as the
+    spectral acceleration at period zero. The curves of the other
+    intensity measure types are ignored.
+
+    The parameters are the same as in :func:`hazard_maps`.
+
+    :returns:
+        A pair ``(periods, spectra)`` where ``periods`` is the array of the
+        periods in increasing order and ``spectra`` a 3d array of intensity
+        measure levels, where the first dimension differentiates sites,
+        the second one the values of ``poes`` and the third one the periods.
+    :raises ValueError:
+        If there are no curves of spectral accelerations.
+    """
+    spectral = sorted(
+        (0. if isinstance(imt, PGA) else imt.period, imt)
+        for imt in curves if isinstance(imt, (PGA, SA)))
+    if not spectral:
+        raise ValueError('no curves of spectral accelerations')
+    periods = numpy.array([period for period, _ in spectral])
+    spectra = numpy.empty((len(curves[spectral[0][1]]), len(poes),
+                           len(spectral)))
+    for i, (_, imt) in enumerate(spectral):
+        spectra[:, :, i] = compute_hazard_maps(
+            curves[imt], imts[imt], poes, sites_per_chunk)
+    return periods, spectra
@@ -0,0 +1,208 @@
+# The Hazard Library
+# Copyright (C) 2012-2014, GEM Foundation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Module :mod:`openquake.hazardlib.calc.monitor` defines :class:`Monitor`,
+recording the time spent in the stages of a calculation, and
+:class:`DummyMonitor`, used by the calculators when no monitor is given.
+"""
+import os
+import json
+import time
+
+
+def _cpu_time():
+    """
+    Return the user and system CPU time of the current process, in seconds.
+    """
+    times = os.times()
+    return times[0] + times[1]
+
+
+class Monitor(object):
+    """
+    Record the wall clock time and the CPU time spent in the stages of a
+    calculation, together with a number of counters, both in total and
+    per source. The usage is::
+
+        monitor = Monitor()
+        curves = hazard_curves(sources, sites, imts, gsims,
+                               truncation_level, monitor=monitor)
+        print monitor.to_json()
+
+    Stages can be nested and the times are exclusive: the time spent in
+    an inner stage is not counted in the outer one. This allows to measure
+    separately the generation of the ruptures of a source and their
+    filtering, even if the ruptures are generated lazily by the filter.
+
+    The calculators accepting a monitor record the stages
+    ``source_filtering``, ``iter_ruptures`` and ``rupture_filtering`` and
+    the counters ``sources`` (sources passing the source-site filter),
+    ``ruptures`` (generated ruptures), ``filtered_ruptures`` (ruptures
+    passing the rupture-site filter) and ``site_rupture_pairs``, besides
+    the stages specific to each calculator.
+    """
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.sources = {}
+        # time spent in the inner stages of the stages being measured
+        self._inner_times = []
+
+    def __call__(self, stage, source_id=None):
+        """
+        Return a context manager measuring the time spent in its block.
+
+        :param stage:
+            Name of the stage.
+        :param source_id:
+            Id of the source the time is spent for, if any.
+        """
+        return _Measure(self, stage, source_id)
+
+    def iterate(self, iterable, stage, source_id=None, counter=None):
+        """
+        Iterate over ``iterable`` measuring the time spent in generating
+        each item.
+
+        :param counter:
+            If given, the name of a counter incremented for each item.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self(stage, source_id):
+                try:
+                    item = iterator.next()
+                except StopIteration:
+                    return
+            if counter is not None:
+                self.count(counter, 1, source_id)
+            yield item
+
+    def count(self, counter, n=1, source_id=None):
+        """
+        Increment a counter by ``n``, in total and for the given source.
+        """
+        self.counters[counter] = self.counters.get(counter, 0) + n
+        if source_id is not None:
+            counters = self._source(source_id)['counters']
+            counters[counter] = counters.get(counter, 0) + n
+
+    def _source(self, source_id):
+        """
+        Return the dictionary of the stages and counters of a source.
+        """
+        try:
+            return self.sources[source_id]
+        except KeyError:
+            record = self.sources[source_id] = {'stages': {}, 'counters': {}}
+            return record
+
+    def _add_time(self, stage, source_id, wall_time, cpu_time):
+        """
+        Add the time of a call of a stage, in total and for the given source.
+        """
+        stages = [self.stages]
+        if source_id is not None:
+            stages.append(self._source(source_id)['stages'])
+        for dic in stages:
+            try:
+                record = dic[stage]
+            except KeyError:
+                record = dic[stage] = {
+                    'wall_time': 0., 'cpu_time': 0., 'calls': 0}
+            record['wall_time'] += wall_time
+            record['cpu_time'] += cpu_time
+            record['calls'] += 1
+
+    def to_dict(self):
+        """
+        Return the report as a dictionary with the keys
+
+        ``stages``
+            dictionary mapping the name of each stage to a dictionary
+            with the keys ``wall_time``, ``cpu_time`` (in seconds) and
+            ``calls``;
+        ``counters``
+            dictionary mapping the name of each counter to its value;
+        ``sources``
+            dictionary mapping the id of each source to a dictionary with
+            the keys ``stages`` and ``counters``, as above.
+        """
+        return {'stages': self.stages, 'counters': self.counters,
+                'sources': self.sources}
+
+    def to_json(self, **kwargs):
+        """
+        Return the report of :meth:`to_dict` as a JSON string. The keyword
+        arguments are passed to :func:`json.dumps`.
+        """
+        return json.dumps(self.to_dict(), **kwargs)
+
+
+class _Measure(object):
+    """
+    Context manager measuring the time spent in a stage, returned by
+    :meth:`Monitor.__call__`.
+    """
+    def __init__(self, monitor, stage, source_id):
+        self.monitor = monitor
+        self.stage = stage
+        self.source_id = source_id
+
+    def __enter__(self):
+        self.monitor._inner_times.append([0., 0.])
+        self.wall_start = time.time()
+        self.cpu_start = _cpu_time()
+        return self
+
+    def __exit__(self, etype, exc, tb):
+        wall_time = time.time() - self.wall_start
+        cpu_time = _cpu_time() - self.cpu_start
+        inner_times = self.monitor._inner_times
+        inner_wall, inner_cpu = inner_times.pop()
+        if inner_times:
+            inner_times[-1][0] += wall_time
+            inner_times[-1][1] += cpu_time
+        self.monitor._add_time(self.stage, self.source_id,
+                               wall_time - inner_wall, cpu_time - inner_cpu)
+
+
+class _NoMeasure(object):
+    """
+    Context manager doing nothing, returned by :meth:`DummyMonitor.__call__`.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, exc, tb):
+        pass
+
+
+class DummyMonitor(object):
+    """
+    A monitor with the same interface of :class:`Monitor` recording nothing,
+    with a negligible overhead.
+    """
+    _no_measure = _NoMeasure()
+
+    def __call__(self, stage, source_id=None):
+        return self._no_measure
+
+    def iterate(self, iterable, stage, source_id=None, counter=None):
+        return iterable
+
+    def count(self, counter, n=1, source_id=None):
+        pass
@@ -15,17 +15,46 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 :mod:`openquake.hazardlib.calc.stochastic` contains
-:func:`stochastic_event_set`.
+:func:`stochastic_event_set` and :func:`random_state`.
 """
 import sys
+import collections
+import hashlib
+
+import numpy
+
 from openquake.hazardlib.calc import filters
+from openquake.hazardlib.calc.monitor import DummyMonitor
+
+
+def random_state(seed, *keys):
+    """
+    Return a random numbers generator derived from a seed and a number of
+    keys, for instance a source id and the index of a rupture in the source.
+
+    The generators for different keys give independent streams of random
+    numbers, and the generator for the same seed and keys gives always the
+    same stream, without depending on the global numpy random numbers
+    generator. This allows to split a calculation in tasks, processed in any
+    order, with the same results.
+
+    :param seed:
+        Integer seed.
+    :param keys:
+        Any number of values identifying the stream, converted to strings.
+    :returns:
+        A :class:`numpy.random.RandomState` instance.
+    """
+    digest = hashlib.md5('\0'.join(map(str, (seed, ) + keys))).digest()
+    return numpy.random.RandomState(numpy.frombuffer(digest, numpy.uint32))
 
 
 def stochastic_event_set(
         sources,
         sites=None,
         source_site_filter=filters.source_site_noop_filter,
-        rupture_site_filter=filters.rupture_site_noop_filter):
+        rupture_site_filter=filters.rupture_site_noop_filter,
+        monitor=None, seed=None):
     """
     Generates a 'Stochastic Event Set' (that is a collection of earthquake
     ruptures) representing a possible *realization* of the seismicity as
@@ -38,7 +67,8 @@ def stochastic_event_set(
 
     .. note::
         This calculator is using random numbers. In order to reproduce the
-        same results numpy random numbers generator needs to be seeded, see
+        same results either ``seed`` must be given or numpy random numbers
+        generator needs to be seeded, see
         http://docs.scipy.org/doc/numpy/reference/generated/numpy.random.seed.html
 
     :param sources:
@@ -50,16 +80,33 @@ def stochastic_event_set(
         The source filter to use (only meaningful is sites is not None)
     :param source_site_filter:
         The rupture filter to use (only meaningful is sites is not None)
+    :param monitor:
+        Optional :class:`~openquake.hazardlib.calc.monitor.Monitor`,
+        recording also the stage ``sampling``. The time spent by the
+        caller in consuming the ruptures is not recorded.
+    :param seed:
+        Optional integer seed. If given, the number of occurrences of each
+        rupture is sampled with the generator returned by
+        :func:`random_state` for the seed, the source id and the index of
+        the rupture in the source (before filtering), so that the result
+        for a source does not depend on the other sources nor on the sites.
     :returns:
         Generator of :class:`~openquake.hazardlib.source.rupture.Rupture`
         objects that are contained in an event set. Some ruptures can be
         missing from it, others can appear one or more times in a row.
     """
+    if monitor is None:
+        monitor = DummyMonitor()
     if sites is None:  # no filtering
         for source in sources:
+            source_id = source.source_id
             try:
-                for rupture in source.iter_ruptures():
-                    for i in xrange(rupture.sample_number_of_occurrences()):
+                for i, rupture in enumerate(monitor.iterate(
+                        source.iter_ruptures(), 'iter_ruptures', source_id,
+                        'ruptures')):
+                    with monitor('sampling', source_id):
+                        num_occ = _sample(rupture, seed, source_id, i)
+                    for occ in xrange(num_occ):
                         yield rupture
             except Exception, err:
                 etype, err, tb = sys.exc_info()
@@ -68,16 +115,56 @@ def stochastic_event_set(
                 raise etype, msg, tb
         return
     # else apply filtering
-    sources_sites = source_site_filter((source, sites) for source in sources)
+    sources_sites = monitor.iterate(
+        source_site_filter((source, sites) for source in sources),
+        'source_filtering', counter='sources')
     for source, r_sites in sources_sites:
+        source_id = source.source_id
+        # the ruptures read from the source and not yet out of the filter,
+        # with their index in the source
+        numbered = collections.deque()
         try:
-            ruptures_sites = rupture_site_filter(
-                (rupture, r_sites) for rupture in source.iter_ruptures())
+            ruptures = monitor.iterate(source.iter_ruptures(),
+                                       'iter_ruptures', source_id, 'ruptures')
+            ruptures_sites = monitor.iterate(
+                rupture_site_filter(
+                    (rupture, r_sites)
+                    for rupture in _numbered(ruptures, numbered)),
+                'rupture_filtering', source_id, 'filtered_ruptures')
             for rupture, _sites in ruptures_sites:
-                for i in xrange(rupture.sample_number_of_occurrences()):
+                # the filter keeps the order of the ruptures, so the ones
+                # before this rupture have been filtered out
+                i, numbered_rupture = numbered.popleft()
+                while numbered_rupture is not rupture:
+                    i, numbered_rupture = numbered.popleft()
+                with monitor('sampling', source_id):
+                    num_occ = _sample(rupture, seed, source_id, i)
+                for occ in xrange(num_occ):
                     yield rupture
         except Exception, err:
             etype, err, tb = sys.exc_info()
             msg = 'An error occurred with source id=%s. Error: %s'
             msg %= (source.source_id, err.message)
             raise etype, msg, tb
+
+
+def _numbered(ruptures, numbered):
+    """
+    Yield the ruptures appending each of them to the deque ``numbered``,
+    together with its index.
+    """
+    for i, rupture in enumerate(ruptures):
+        numbered.append((i, rupture))
+        yield rupture
+
+
+def _sample(rupture, seed, source_id, index):
+    """
+    Sample the number of occurrences of a rupture, with the generator
+    derived from the seed, the source id and the index of the rupture
+    if the seed is given, otherwise with the global generator.
+    """
+    if seed is None:
+        return rupture.sample_number_of_occurrences()
+    return rupture.sample_number_of_occurrences(
+        random_state(seed, source_id, index))
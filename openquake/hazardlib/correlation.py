@@ -18,9 +18,15 @@ Module :mod:`openquake.hazardlib.correlation` defines correlation models for
 spatially-distributed ground-shaking intensities.
 """
 import abc
+import collections
+
 import numpy
+import scipy.sparse
+import scipy.sparse.linalg
+import scipy.spatial
 
 from openquake.hazardlib.imt import SA, PGA
+from openquake.hazardlib.geo import geodetic
 
 
 class BaseCorrelationModel(object):
@@ -89,11 +95,77 @@ class JB2009CorrelationModel(BaseCorrelationModel):
         Boolean value to indicate whether "Case 1" or "Case 2" from page 1700
         should be applied. ``True`` value means that Vs 30 values show or are
         expected to show clustering ("Case 2"), ``False`` means otherwise.
+    :param cache_size:
+        Maximum number of lower-triangle correlation matrices kept in memory,
+        keyed on the site collection, the indices of the sites and the IMT.
+        The least recently used matrix is discarded first.
+    :param max_cache_bytes:
+        Maximum number of bytes taken by the matrices kept in memory. The
+        least recently used matrices are discarded to make room for a new
+        one, and a matrix larger than this is not kept at all.
+    :param max_cached_sites:
+        The distance matrix of the complete site collection is computed once
+        and kept in memory, so that the distances of any filtered subset are
+        extracted from it, only if the complete collection has at most this
+        many sites (the matrix takes ``8 * max_cached_sites ** 2`` bytes).
+        Otherwise the distances are computed for each subset.
+    :param max_dense_sites:
+        Maximum number of sites for which the correlation is applied with
+        the Cholesky decomposition of the full correlation matrix. For more
+        sites the approximation of :class:`NearestNeighboursFactor` is used.
+    :param num_neighbours:
+        Number of neighbours used by :class:`NearestNeighboursFactor`: the
+        larger, the more accurate and the slower the approximation.
     """
-    def __init__(self, vs30_clustering):
+    def __init__(self, vs30_clustering, cache_size=10,
+                 max_cache_bytes=2 ** 26, max_cached_sites=2000,
+                 max_dense_sites=5000, num_neighbours=30):
         self.vs30_clustering = vs30_clustering
+        self.cache_size = cache_size
+        self.max_cache_bytes = max_cache_bytes
+        self.max_cached_sites = max_cached_sites
+        self.max_dense_sites = max_dense_sites
+        self.num_neighbours = num_neighbours
+        self._clear_cache()
         super(JB2009CorrelationModel, self).__init__()
 
+    def _clear_cache(self):
+        """
+        Discard the cached distance and correlation matrices.
+        """
+        # pair (complete site collection, its distance matrix)
+        self._distances = None
+        # (kind, id of complete site collection, indices, imt) ->
+        # (complete site collection, factor)
+        self._factors = collections.OrderedDict()
+        # number of bytes taken by the cached factors
+        self._cached_bytes = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_distances'], state['_factors'], state['_cached_bytes']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._clear_cache()
+
+    def _get_distance_matrix(self, sites):
+        """
+        Return the distance matrix of a site collection, taking it from the
+        cached distance matrix of the complete site collection if possible.
+        """
+        complete = sites.complete
+        if complete.total_sites > self.max_cached_sites:
+            return sites.mesh.get_distance_matrix()
+        if self._distances is None or self._distances[0] is not complete:
+            self._distances = (complete, complete.mesh.get_distance_matrix())
+        distances = self._distances[1]
+        if sites is complete:
+            return distances
+        indices = sites.indices
+        return distances[numpy.ix_(indices, indices)]
+
     def _get_correlation_matrix(self, sites, imt):
         """
         Calculate correlation matrix for a given sites collection.
@@ -104,7 +176,7 @@ class JB2009CorrelationModel(BaseCorrelationModel):
         Parameters are the same as for
         :meth:`BaseCorrelationModel.get_lower_triangle_correlation_matrix`.
         """
-        distances = sites.mesh.get_distance_matrix()
+        distances = self._get_distance_matrix(sites)
         return self._get_correlation_model(distances, imt)
 
     def _get_correlation_model(self, distances, imt):
@@ -142,5 +214,237 @@ class JB2009CorrelationModel(BaseCorrelationModel):
     def get_lower_triangle_correlation_matrix(self, sites, imt):
         """
         See :meth:`BaseCorrelationModel.get_lower_triangle_correlation_matrix`.
+
+        The matrices are cached, so that the decomposition is not repeated
+        when the same sites and IMT are used for many ruptures.
+        """
+        return self._get_cached(
+            'dense', sites, imt, lambda: numpy.linalg.cholesky(
+                self._get_correlation_matrix(sites, imt)))
+
+    def apply_correlation(self, sites, imt, residuals):
         """
-        return numpy.linalg.cholesky(self._get_correlation_matrix(sites, imt))
+        See :meth:`BaseCorrelationModel.apply_correlation`.
+
+        If there are more than ``max_dense_sites`` sites the correlation is
+        applied by :class:`NearestNeighboursFactor` instead of the Cholesky
+        decomposition of the full correlation matrix.
+        """
+        if len(sites) <= self.max_dense_sites:
+            return super(JB2009CorrelationModel, self).apply_correlation(
+                sites, imt, residuals)
+        factor = self._get_cached(
+            'sparse', sites, imt, lambda: NearestNeighboursFactor(
+                sites, lambda distances: self._get_correlation_model(
+                    distances, imt), self.num_neighbours))
+        return factor.apply(residuals)
+
+    def _get_cached(self, kind, sites, imt, compute):
+        """
+        Return the factor of a kind for the given sites and IMT from the
+        cache, or compute it by calling ``compute`` and store it in the cache.
+        """
+        complete = sites.complete
+        key = (kind, id(complete), sites.indices.tostring(), imt)
+        cached = self._factors.pop(key, None)
+        # the complete collection is stored along with the factor to keep
+        # it alive, so that its id cannot be reused by another collection
+        if cached is None:
+            cached = (complete, compute())
+        else:
+            self._cached_bytes -= cached[1].nbytes
+        nbytes = cached[1].nbytes
+        if self.cache_size > 0 and nbytes <= self.max_cache_bytes:
+            while self._factors and (
+                    len(self._factors) >= self.cache_size
+                    or self._cached_bytes + nbytes > self.max_cache_bytes):
+                _, (_, factor) = self._factors.popitem(last=False)
+                self._cached_bytes -= factor.nbytes
+            self._factors[key] = cached
+            self._cached_bytes += nbytes
+        return cached[1]
+
+
+class NearestNeighboursFactor(object):
+    """
+    Approximate factor of a correlation matrix, allowing to sample spatially
+    correlated residuals for a number of sites too large for the Cholesky
+    decomposition of the full matrix.
+
+    The sites are put in a fixed pseudo-random order and the residual of
+    each site is sampled conditionally on the residuals of its
+    ``num_neighbours`` nearest sites among the preceding ones, instead of
+    all of them (Vecchia approximation, see "Estimation and model
+    identification for continuous spatial processes" by A. V. Vecchia,
+    Journal of the Royal Statistical Society B 1988; 50, pages 297-312).
+    That is, the correlated residuals ``x`` are the solution of
+    ``(I - B) x = D z``, where ``z`` are the independent residuals, ``B``
+    is a sparse strictly lower triangular matrix with ``num_neighbours``
+    coefficients per row and ``D`` a diagonal matrix of the conditional
+    standard deviations. Memory and time grow linearly with the number
+    of sites.
+
+    The approximation is exact when ``num_neighbours`` is not smaller than
+    the number of sites minus one, and its error decreases quickly as
+    ``num_neighbours`` grows.
+
+    :param sites:
+        :class:`~openquake.hazardlib.site.SiteCollection` to sample the
+        residuals for.
+    :param correlation:
+        Function taking an array of distances in km and returning the array
+        of the correlation coefficients at those distances.
+    :param num_neighbours:
+        Maximum number of sites the residual of each site is conditioned on.
+
+    .. attribute:: nbytes
+
+        Approximate number of bytes taken by the factor.
+    """
+    #: Seed of the order of the sites; it does not need to be random,
+    #: but it is fixed so that the factor does not depend on the state
+    #: of the global random number generator
+    ORDER_SEED = 42
+
+    #: Number added to the diagonal of the correlation matrices of the
+    #: neighbours, so that they are invertible even if some sites coincide
+    NUGGET = 1e-10
+
+    #: Number of sites whose coefficients are computed together, to bound
+    #: the memory used for the temporary arrays
+    SITES_PER_CHUNK = 10000
+
+    def __init__(self, sites, correlation, num_neighbours):
+        num_sites = len(sites)
+        self.order = numpy.random.RandomState(self.ORDER_SEED).permutation(
+            num_sites)
+        points = sites.xyz[self.order]
+        neighbours = _get_preceding_neighbours(points, num_neighbours)
+        num_neighbours = neighbours.shape[1]
+
+        coeffs = numpy.zeros(neighbours.shape)
+        self.stddevs = numpy.ones(num_sites)
+        for start in xrange(0, num_sites, self.SITES_PER_CHUNK):
+            stop = min(start + self.SITES_PER_CHUNK, num_sites)
+            nbrs = neighbours[start:stop]
+            valid = nbrs >= 0
+            # missing neighbours are replaced by the site itself, with
+            # zero correlation to anything else
+            nbrs = numpy.where(valid, nbrs, numpy.arange(start, stop)[:, None])
+            nbr_points = points[nbrs]
+            cross = correlation(_chord_to_distance(
+                ((points[start:stop, None] - nbr_points) ** 2).sum(axis=-1)))
+            cross[~valid] = 0
+            among = correlation(_chord_to_distance(
+                2 * geodetic.EARTH_RADIUS ** 2 - 2 * numpy.einsum(
+                    'ijk,ilk->ijl', nbr_points, nbr_points)))
+            among[~(valid[:, :, None] & valid[:, None, :])] = 0
+            diagonal = numpy.arange(num_neighbours)
+            among[:, diagonal, diagonal] = 1 + self.NUGGET
+            # coefficients of the conditional mean and conditional variance
+            # of the residual of each site given its neighbours
+            chunk_coeffs = numpy.linalg.solve(among, cross[:, :, None])[..., 0]
+            coeffs[start:stop] = chunk_coeffs
+            variances = 1 - (chunk_coeffs * cross).sum(axis=1)
+            self.stddevs[start:stop] = numpy.sqrt(variances.clip(0, 1))
+
+        rows = numpy.repeat(numpy.arange(num_sites), num_neighbours)
+        valid = neighbours.ravel() >= 0
+        matrix = scipy.sparse.csc_matrix(
+            (numpy.concatenate([numpy.ones(num_sites),
+                                -coeffs.ravel()[valid]]),
+             (numpy.concatenate([numpy.arange(num_sites), rows[valid]]),
+              numpy.concatenate([numpy.arange(num_sites),
+                                 neighbours.ravel()[valid]]))),
+            shape=(num_sites, num_sites))
+        # the matrix is lower triangular, so that with the natural order and
+        # no pivoting its LU decomposition does not add any nonzero element
+        self.lu = scipy.sparse.linalg.splu(
+            matrix, permc_spec='NATURAL', diag_pivot_thresh=0,
+            options=dict(SymmetricMode=True))
+        # the L factor has the nonzero elements of the matrix and the U
+        # factor those of its diagonal
+        self.nbytes = (
+            self.order.nbytes + self.stddevs.nbytes
+            + matrix.data.nbytes + matrix.indices.nbytes
+            + 2 * matrix.indptr.nbytes
+            + num_sites * (matrix.data.itemsize + matrix.indices.itemsize))
+
+    def apply(self, residuals):
+        """
+        Apply correlation to randomly sampled residuals.
+
+        :param residuals:
+            2d numpy array of independent residuals, where first dimension
+            represents sites and second one represents different realizations.
+        :returns:
+            Array of the same structure and semantics as ``residuals``
+            but with correlations applied.
+        """
+        residuals = numpy.asarray(residuals, dtype=float)
+        correlated = numpy.empty_like(residuals)
+        correlated[self.order] = self.lu.solve(
+            self.stddevs[:, None] * residuals[self.order])
+        return correlated
+
+
+def _chord_to_distance(squared_chords):
+    """
+    Convert the squared lengths of the chords between points on the Earth
+    surface, in km squared, to the geodetic distances between the points,
+    in km.
+    """
+    return (2 * geodetic.EARTH_RADIUS) * numpy.arcsin((
+        numpy.sqrt(squared_chords.clip(0, None))
+        / (2 * geodetic.EARTH_RADIUS)).clip(0, 1))
+
+
+def _get_preceding_neighbours(points, num_neighbours):
+    """
+    Find the nearest neighbours of each point among the preceding points.
+
+    :param points:
+        2d array of the cartesian coordinates of the points.
+    :param num_neighbours:
+        Maximum number of neighbours of a point.
+    :returns:
+        2d array of integers with a row per point containing the indices of
+        its neighbours, from the nearest one. The points with at most
+        ``num_neighbours`` preceding points have all of them as neighbours,
+        in their order, and their rows are padded with -1.
+        The number of columns is ``num_neighbours``, or the number of
+        points minus one if smaller.
+    """
+    num_points = len(points)
+    num_neighbours = max(min(num_neighbours, num_points - 1), 0)
+    neighbours = numpy.empty((num_points, num_neighbours), dtype=int)
+    neighbours.fill(-1)
+    if num_neighbours == 0:
+        return neighbours
+    # the first points are conditioned on all the preceding ones
+    start = min(num_neighbours + 1, num_points)
+    for i in xrange(1, start):
+        neighbours[i, :i] = numpy.arange(i)
+    # the points from ``start`` to ``2 * start`` are searched in a tree
+    # of the first ``2 * start`` points, so that at least half of the
+    # points in the tree precede any of the points searched
+    while start < num_points:
+        stop = min(2 * start, num_points)
+        tree = scipy.spatial.cKDTree(points[:stop])
+        todo = numpy.arange(start, stop)
+        k = min(3 * num_neighbours, stop)
+        while len(todo):
+            _, indices = tree.query(points[todo], k)
+            preceding = indices < todo[:, None]
+            found = preceding.sum(axis=1)
+            # move the preceding points before the others, keeping the order
+            columns = numpy.argsort(~preceding, axis=1, kind='mergesort')
+            rows = numpy.arange(len(todo))[:, None]
+            nearest = indices[rows, columns[:, :num_neighbours]]
+            nearest[~preceding[rows, columns[:, :num_neighbours]]] = -1
+            done = (found >= num_neighbours) | (k == stop)
+            neighbours[todo[done]] = nearest[done]
+            todo = todo[~done]
+            k = min(2 * k, stop)
+        start = stop
+    return neighbours
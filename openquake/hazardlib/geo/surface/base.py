@@ -30,6 +30,10 @@ class BaseSurface(object):
     """
     __metaclass__ = abc.ABCMeta
 
+    #: Circle enclosing the surface projection, computed
+    #: by :meth:`get_bounding_circle` when first needed
+    _bounding_circle = None
+
     @abc.abstractmethod
     def get_min_distance(self, mesh):
         """
@@ -170,6 +174,37 @@ class BaseSurface(object):
             representing surface middle point.
         """
 
+    def get_bounding_circle(self):
+        """
+        Compute a circle on the Earth surface enclosing the surface
+        projection.
+
+        The circle is computed by :meth:`_get_bounding_circle` the first
+        time this method is called and then cached, so it can be used
+        for cheap distance checks (see :func:`
+        openquake.hazardlib.calc.filters.filter_sites_by_distance_to_rupture`).
+
+        :return:
+            A tuple of three items: longitude and latitude of the center
+            of the circle, in decimal degrees, and its radius, in km.
+        """
+        if self._bounding_circle is None:
+            self._bounding_circle = self._get_bounding_circle()
+        return self._bounding_circle
+
+    def _get_bounding_circle(self):
+        """
+        Compute the circle enclosing the surface :meth:`bounding box
+        <get_bounding_box>` by calling
+        :func:`openquake.hazardlib.geo.utils.get_bounding_circle`.
+
+        Subclasses may override this method in order to return
+        a smaller circle.
+        """
+        west, east, north, south = self.get_bounding_box()
+        return utils.get_bounding_circle([west, east, east, west],
+                                         [north, north, south, south])
+
 
 class BaseQuadrilateralSurface(BaseSurface):
     """
@@ -380,6 +415,16 @@ class BaseQuadrilateralSurface(BaseSurface):
 
         return mesh.get_middle_point()
 
+    def _get_bounding_circle(self):
+        """
+        Compute the circle enclosing the points of the surface mesh.
+        Calls :meth:`openquake.hazardlib.geo.utils.get_bounding_circle`
+        """
+        mesh = self.get_mesh()
+
+        return utils.get_bounding_circle(mesh.lons.flatten(),
+                                         mesh.lats.flatten())
+
     @abc.abstractmethod
     def _create_mesh(self):
         """
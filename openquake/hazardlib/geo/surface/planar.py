@@ -581,6 +581,14 @@ class PlanarSurface(BaseQuadrilateralSurface):
         return geo_utils.get_spherical_bounding_box(self.corner_lons,
                                                     self.corner_lats)
 
+    def _get_bounding_circle(self):
+        """
+        Compute the circle enclosing the plane's corners. Calls
+        :meth:`openquake.hazardlib.geo.utils.get_bounding_circle`
+        """
+        return geo_utils.get_bounding_circle(self.corner_lons,
+                                             self.corner_lats)
+
     def get_middle_point(self):
         """
         Compute middle point from surface's corners coordinates. Calls
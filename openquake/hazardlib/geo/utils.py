@@ -247,6 +247,31 @@ def get_middle_point(lon1, lat1, lon2, lat2):
     return geodetic.point_at(lon1, lat1, azimuth, dist / 2.0)
 
 
+def get_bounding_circle(lons, lats):
+    """
+    Find a circle on the Earth surface enclosing a collection of points.
+
+    The center of the circle is the middle point of the spherical bounding
+    box of the points, that is the projection center chosen by
+    :func:`get_orthographic_projection`, and the radius is the maximum
+    great circle distance between the center and the points. A circle
+    is convex in the orthographic projection centered on it, so it also
+    encloses any polygon having the points as vertices (like the ones of
+    :class:`~openquake.hazardlib.geo.polygon.Polygon`).
+
+    Parameters define longitudes and latitudes of a point collection
+    respectively in a form of lists or numpy arrays.
+
+    :returns:
+        A tuple of three items: longitude and latitude of the center,
+        in decimal degrees, and radius, in km.
+    """
+    west, east, north, south = get_spherical_bounding_box(lons, lats)
+    lon, lat = get_middle_point(west, north, east, south)
+    radius = numpy.max(geodetic.geodetic_distance(lon, lat, lons, lats))
+    return lon, lat, radius
+
+
 def spherical_to_cartesian(lons, lats, depths):
     """
     Return the position vectors (in Cartesian coordinates) of list of spherical
@@ -25,7 +25,6 @@ import math
 import warnings
 import functools
 
-import scipy.stats
 from scipy.special import ndtr
 import numpy
 
@@ -195,6 +194,35 @@ class GroundShakingIntensityModel(object):
         compute interim steps).
         """
 
+    def get_means_and_stddevs(self, sites, rup, dists, imts, stddev_types):
+        """
+        Calculate and return mean values of intensity distribution and
+        standard deviations for several intensity measure types at once.
+
+        Parameters are the same as for :meth:`get_mean_and_stddevs`,
+        with the difference that ``imts`` is a list of intensity measure
+        type objects.
+
+        :returns:
+            A tuple of two numpy arrays: the means, of shape
+            ``(len(imts), num_sites)``, and the standard deviations, of shape
+            ``(len(imts), len(stddev_types), num_sites)``, both following
+            the order of ``imts``.
+
+        The default implementation just calls :meth:`get_mean_and_stddevs`
+        for each IMT. GSIMs sharing expensive intermediate calculations
+        between different IMTs can override it in order to perform those
+        calculations only once.
+        """
+        means = []
+        stddevs = []
+        for imt in imts:
+            mean, imt_stddevs = self.get_mean_and_stddevs(
+                sites, rup, dists, imt, stddev_types)
+            means.append(mean)
+            stddevs.append(imt_stddevs)
+        return numpy.array(means), numpy.array(stddevs)
+
     def get_poes(self, sctx, rctx, dctx, imt, imls, truncation_level):
         """
         Calculate and return probabilities of exceedance (PoEs) of one or more
@@ -256,25 +284,74 @@ class GroundShakingIntensityModel(object):
         self._check_imt(imt)
 
         if truncation_level == 0:
-            # zero truncation mode, just compare imls to mean
-            imls = self.to_distribution_values(imls)
+            # zero truncation mode, standard deviation is not needed
             mean, _ = self.get_mean_and_stddevs(sctx, rctx, dctx, imt, [])
-            mean = mean.reshape(mean.shape + (1, ))
-            return (imls <= mean).astype(float)
+            return self._get_poes(mean, None, imls, truncation_level)
         else:
             # use real normal distribution
             assert (const.StdDev.TOTAL
                     in self.DEFINED_FOR_STANDARD_DEVIATION_TYPES)
-            imls = self.to_distribution_values(imls)
             mean, [stddev] = self.get_mean_and_stddevs(sctx, rctx, dctx, imt,
                                                        [const.StdDev.TOTAL])
-            mean = mean.reshape(mean.shape + (1, ))
-            stddev = stddev.reshape(stddev.shape + (1, ))
-            values = (imls - mean) / stddev
-            if truncation_level is None:
-                return _norm_sf(values)
-            else:
-                return _truncnorm_sf(truncation_level, values)
+            return self._get_poes(mean, stddev, imls, truncation_level)
+
+    def get_poes_by_imt(self, sctx, rctx, dctx, imts, truncation_level):
+        """
+        Calculate and return probabilities of exceedance (PoEs) of the
+        intensity measure levels of several intensity measure types
+        for one or more pairs "site -- rupture".
+
+        Parameters are the same as for :meth:`get_poes`, with the difference
+        that ``imts`` is a dictionary mapping intensity measure type objects
+        to lists of intensity measure levels.
+
+        :returns:
+            A dictionary with the same keys as ``imts``, where each value is
+            the 2d array that :meth:`get_poes` returns for that IMT.
+
+        Means and standard deviations of all the IMTs are computed with
+        a single call to :meth:`get_means_and_stddevs`.
+        """
+        if truncation_level is not None and truncation_level < 0:
+            raise ValueError('truncation level must be zero, positive number '
+                             'or None')
+        for imt in imts:
+            self._check_imt(imt)
+
+        if truncation_level == 0:
+            # zero truncation mode, standard deviation is not needed
+            stddev_types = []
+        else:
+            assert (const.StdDev.TOTAL
+                    in self.DEFINED_FOR_STANDARD_DEVIATION_TYPES)
+            stddev_types = [const.StdDev.TOTAL]
+        imt_list = list(imts)
+        means, stddevs = self.get_means_and_stddevs(sctx, rctx, dctx,
+                                                    imt_list, stddev_types)
+        poes = {}
+        for i, imt in enumerate(imt_list):
+            stddev = stddevs[i][0] if stddev_types else None
+            poes[imt] = self._get_poes(means[i], stddev, imts[imt],
+                                       truncation_level)
+        return poes
+
+    def _get_poes(self, mean, stddev, imls, truncation_level):
+        """
+        Compute the PoEs of ``imls`` given the mean and the total standard
+        deviation of the intensity distribution (the latter being ignored
+        if ``truncation_level`` is zero). See :meth:`get_poes`.
+        """
+        imls = self.to_distribution_values(imls)
+        mean = mean.reshape(mean.shape + (1, ))
+        if truncation_level == 0:
+            # zero truncation mode, just compare imls to mean
+            return (imls <= mean).astype(float)
+        stddev = stddev.reshape(stddev.shape + (1, ))
+        values = (imls - mean) / stddev
+        if truncation_level is None:
+            return _norm_sf(values)
+        else:
+            return _truncnorm_sf(truncation_level, values)
 
     def disaggregate_poe(self, sctx, rctx, dctx, imt, iml,
                          truncation_level, n_epsilons):
@@ -304,50 +381,43 @@ class GroundShakingIntensityModel(object):
         # compute mean and standard deviations
         mean, [stddev] = self.get_mean_and_stddevs(sctx, rctx, dctx, imt,
                                                    [const.StdDev.TOTAL])
+        return self.partition_poe(mean, stddev, iml, truncation_level,
+                                  n_epsilons)
 
+    def partition_poe(self, mean, stddev, iml, truncation_level, n_epsilons):
+        """
+        Disaggregate the PoE of ``iml`` in the contributions of
+        ``n_epsilons`` distribution bins, as :meth:`disaggregate_poe` does,
+        given the mean and the total standard deviation of the intensity
+        distribution at each site. This allows to disaggregate the PoEs of
+        many levels computing the means and the standard deviations once.
+
+        :param mean:
+            1d array of the means of the intensity distribution (as returned
+            by :meth:`get_mean_and_stddevs`), one per site.
+        :param stddev:
+            1d array of the total standard deviations, one per site.
+        :param truncation_level:
+            Positive float, number of standard deviations for truncation
+            of the intensity distribution.
+
+        Other parameters and the result are the same as for
+        :meth:`disaggregate_poe`.
+        """
         # compute iml value with respect to standard (mean=0, std=1)
         # normal distributions
         iml = self.to_distribution_values(iml)
         standard_imls = (iml - mean) / stddev
 
-        distribution = scipy.stats.truncnorm(- truncation_level,
-                                             truncation_level)
-        epsilons = numpy.linspace(- truncation_level, truncation_level,
-                                  n_epsilons + 1)
-        # compute epsilon bins contributions
-        contribution_by_bands = (distribution.cdf(epsilons[1:]) -
-                                 distribution.cdf(epsilons[:-1]))
-
-        # take the minimum epsilon larger than standard_iml
-        iml_bin_indices = numpy.searchsorted(epsilons, standard_imls)
-
-        return numpy.array([
-            # take full disaggregated distribution for the case of
-            # ``iml <= mean - truncation_level * stddev``
-            contribution_by_bands
-            if idx == 0 else
-
-            # take zeros if ``iml >= mean + truncation_level * stddev``
-            numpy.zeros(n_epsilons)
-            if idx >= n_epsilons + 1 else
-
-            # for other cases (when ``iml`` falls somewhere in the
-            # histogram):
-            numpy.concatenate((
-                # take zeros for bins that are on the left hand side
-                # from the bin ``iml`` falls into,
-                numpy.zeros(idx - 1),
-                # ... area of the portion of the bin containing ``iml``
-                # (the portion is limited on the left hand side by
-                # ``iml`` and on the right hand side by the bin edge),
-                [distribution.sf(standard_imls[i])
-                 - contribution_by_bands[idx:].sum()],
-                # ... and all bins on the right go unchanged.
-                contribution_by_bands[idx:]
-            ))
-
-            for i, idx in enumerate(iml_bin_indices)
-        ])
+        lower, upper, cdf_upper, z = _epsilon_bands(truncation_level,
+                                                    n_epsilons)
+        # the contribution of a bin is the probability of the portion of
+        # the bin above ``iml``: the whole bin if ``iml`` is on its left,
+        # nothing if ``iml`` is on its right, and the part between ``iml``
+        # and the right edge if ``iml`` falls into the bin. Clipping
+        # ``iml`` to the edges of each bin covers the three cases at once
+        clipped = numpy.clip(standard_imls[:, numpy.newaxis], lower, upper)
+        return (cdf_upper - ndtr(clipped)) / z
 
     @abc.abstractmethod
     def to_distribution_values(self, values):
@@ -372,7 +442,7 @@ class GroundShakingIntensityModel(object):
         so there is no need to override it in actual GSIM implementations.
         """
 
-    def make_contexts(self, site_collection, rupture):
+    def make_contexts(self, site_collection, rupture, distances_cache=None):
         """
         Create context objects for given site collection and rupture.
 
@@ -385,6 +455,11 @@ class GroundShakingIntensityModel(object):
             subclass of
             :class:`~openquake.hazardlib.source.rupture.BaseProbabilisticRupture`).
 
+        :param distances_cache:
+            Optional instance of :class:`DistancesCache`. Passing the same
+            instance to the calls for several GSIMs computes each distance
+            measure between ``rupture`` and ``site_collection`` only once.
+
         :returns:
             Tuple of three items: sites context, rupture context and
             distances context, that is, instances of
@@ -397,27 +472,15 @@ class GroundShakingIntensityModel(object):
             If any of declared required parameters (that includes site, rupture
             and distance parameters) is unknown.
         """
+        if distances_cache is None:
+            distances_cache = DistancesCache()
         dctx = DistancesContext()
         for param in self.REQUIRES_DISTANCES:
-            if param == 'rrup':
-                dist = rupture.surface.get_min_distance(site_collection.mesh)
-            elif param == 'rx':
-                dist = rupture.surface.get_rx_distance(site_collection.mesh)
-            elif param == 'rjb':
-                dist = rupture.surface.get_joyner_boore_distance(
-                    site_collection.mesh
-                )
-            elif param == 'rhypo':
-                dist = rupture.hypocenter.distance_to_mesh(
-                    site_collection.mesh
-                )
-            elif param == 'repi':
-                dist = rupture.hypocenter.distance_to_mesh(
-                    site_collection.mesh, with_depths=False
-                )
-            else:
+            if param not in DistancesContext.__slots__:
                 raise ValueError('%s requires unknown distance measure %r' %
                                  (type(self).__name__, param))
+            dist = distances_cache.get_distance(rupture, site_collection,
+                                                param)
             setattr(dctx, param, dist)
 
         sctx = SitesContext()
@@ -526,6 +589,43 @@ def _truncnorm_sf(truncation_level, values):
     return ((phi_b - ndtr(values)) / z).clip(0.0, 1.0)
 
 
+#: Cache of the epsilon bins of :func:`_epsilon_bands`, keyed by
+#: truncation level and number of bins
+_EPSILON_BANDS = {}
+
+
+def _epsilon_bands(truncation_level, n_epsilons):
+    """
+    Return the epsilon bins used to disaggregate a PoE, computing them
+    only the first time they are requested for the given truncation level
+    and number of bins.
+
+    :returns:
+        A tuple ``(lower, upper, cdf_upper, z)`` where ``lower`` and
+        ``upper`` are the arrays of the left and right edges of the
+        ``n_epsilons`` bins evenly dividing the interval from
+        ``- truncation_level`` to ``truncation_level``, ``cdf_upper``
+        the CDF of the non truncated standard normal distribution at the
+        right edges and ``z`` the probability of the truncation interval,
+        so that ``(cdf_upper - CDF(x)) / z`` is the probability of the
+        truncated distribution between ``x`` and the right edges.
+    """
+    key = (truncation_level, n_epsilons)
+    try:
+        return _EPSILON_BANDS[key]
+    except KeyError:
+        pass
+    epsilons = numpy.linspace(- truncation_level, truncation_level,
+                              n_epsilons + 1)
+    cdf = ndtr(epsilons)
+    bands = (epsilons[:-1], epsilons[1:], cdf[1:], cdf[-1] - cdf[0])
+    for array in bands[:3]:
+        # the arrays are shared by all the callers
+        array.setflags(write=False)
+    _EPSILON_BANDS[key] = bands
+    return bands
+
+
 def _norm_sf(values):
     """
     Survival function for normal distribution.
@@ -644,6 +744,86 @@ class DistancesContext(BaseContext):
     __slots__ = ('rrup', 'rx', 'rjb', 'rhypo', 'repi')
 
 
+class DistancesCache(object):
+    """
+    Cache of the distances between a rupture and a site collection.
+
+    The same instance can be passed to
+    :meth:`GroundShakingIntensityModel.make_contexts` of several GSIMs
+    (for instance of the branches of a logic tree for the same tectonic
+    region type), so that every distance measure listed in
+    :attr:`~GroundShakingIntensityModel.REQUIRES_DISTANCES` is computed
+    only once. Only the distances for the last rupture and site collection
+    are kept: they are discarded when a different rupture or a collection
+    with different site indices is given.
+
+    Distance arrays are shared among the distance contexts, so they are
+    made read-only: a GSIM modifying them in place would corrupt the
+    distances seen by the following GSIMs.
+    """
+    def __init__(self):
+        self.rupture = None
+        self.sites = None
+        self.distances = {}
+
+    def get_distance(self, rupture, sites, param):
+        """
+        Return the distances of a given type between a rupture and the sites
+        of a collection, computing them if they are not in the cache.
+
+        :param rupture:
+            Instance of :class:`~openquake.hazardlib.source.rupture.Rupture`.
+        :param sites:
+            Instance of :class:`openquake.hazardlib.site.SiteCollection`
+            or :class:`openquake.hazardlib.site.FilteredSiteCollection`.
+        :param param:
+            Name of the distance measure, one of the attributes
+            of :class:`DistancesContext`.
+        :returns:
+            Numpy array of distances in km.
+        """
+        if not self._is_valid(rupture, sites):
+            self.rupture = rupture
+            self.sites = sites
+            self.distances = {}
+        if param not in self.distances:
+            distances = self._compute(rupture, sites.mesh, param)
+            # protect the array shared by all the GSIMs from being changed
+            distances.flags.writeable = False
+            self.distances[param] = distances
+        return self.distances[param]
+
+    def _is_valid(self, rupture, sites):
+        """
+        Return True if the cached distances refer to the given rupture
+        and to the same sites.
+        """
+        if rupture is not self.rupture:
+            return False
+        if sites is self.sites:
+            return True
+        return (sites.complete is self.sites.complete
+                and numpy.array_equal(sites.indices, self.sites.indices))
+
+    def _compute(self, rupture, mesh, param):
+        """
+        Compute the distances of a given type between a rupture and
+        the points of a mesh.
+        """
+        if param == 'rrup':
+            return rupture.surface.get_min_distance(mesh)
+        elif param == 'rx':
+            return rupture.surface.get_rx_distance(mesh)
+        elif param == 'rjb':
+            return rupture.surface.get_joyner_boore_distance(mesh)
+        elif param == 'rhypo':
+            return rupture.hypocenter.distance_to_mesh(mesh)
+        elif param == 'repi':
+            return rupture.hypocenter.distance_to_mesh(mesh,
+                                                       with_depths=False)
+        raise ValueError('unknown distance measure %r' % param)
+
+
 class RuptureContext(BaseContext):
     """
     Rupture calculation context for ground shaking intensity models.
@@ -766,6 +946,13 @@ class CoeffsTable(object):
     Traceback (most recent call last):
         ...
     KeyError: SA(period=0.01, damping=5)
+
+    Coefficients for several IMTs can be retrieved at once as a structured
+    numpy array, with one field per coefficient and one row per IMT:
+
+    >>> coeffs = ct.get_coeffs([imt.PGA(), imt.SA(period=0.1, damping=5)])
+    >>> coeffs['b'].tolist()
+    [2.4, 20.0]
     """
     def __init__(self, **kwargs):
         if not 'table' in kwargs:
@@ -801,13 +988,25 @@ class CoeffsTable(object):
                 imt = imt_module.SA(sa_period, sa_damping)
                 self.sa_coeffs[imt] = imt_coeffs
 
+        # coefficients for SA, sorted by period, used for interpolation
+        self.dtype = numpy.dtype([(name, float) for name in coeff_names])
+        sa_imts = sorted(self.sa_coeffs, key=lambda imt: imt.period)
+        self.sa_damping = sa_damping
+        self.sa_periods = numpy.array([imt.period for imt in sa_imts])
+        self.sa_array = numpy.array(
+            [tuple(self.sa_coeffs[imt][name] for name in coeff_names)
+             for imt in sa_imts], dtype=self.dtype)
+        # interpolated coefficients, computed when first requested
+        self._interpolated_coeffs = {}
+
     def __getitem__(self, imt):
         """
         Return a dictionary of coefficients corresponding to ``imt``
         from this table (if there is a line for requested IMT in it),
         or the dictionary of interpolated coefficients, if ``imt`` is
         of type :class:`~openquake.hazardlib.imt.SA` and interpolation
-        is possible.
+        is possible. Interpolated coefficients are computed only the
+        first time they are requested.
 
         :raises KeyError:
             If ``imt`` is not available in the table and no interpolation
@@ -821,27 +1020,50 @@ class CoeffsTable(object):
         except KeyError:
             pass
 
-        max_below = min_above = None
-        for unscaled_imt in self.sa_coeffs.keys():
-            if unscaled_imt.damping != imt.damping:
-                continue
-            if unscaled_imt.period > imt.period:
-                if min_above is None or unscaled_imt.period < min_above.period:
-                    min_above = unscaled_imt
-            elif unscaled_imt.period < imt.period:
-                if max_below is None or unscaled_imt.period > max_below.period:
-                    max_below = unscaled_imt
-        if max_below is None or min_above is None:
+        try:
+            return self._interpolated_coeffs[imt]
+        except KeyError:
+            coeffs = self._interpolated_coeffs[imt] = self._interpolate(imt)
+            return coeffs
+
+    def _interpolate(self, imt):
+        """
+        Interpolate the coefficients for an SA period between the ones for
+        closest higher and closest lower periods of the table.
+        """
+        if imt.damping != self.sa_damping:
             raise KeyError(imt)
+        idx = self.sa_periods.searchsorted(imt.period)
+        if idx == 0 or idx == len(self.sa_periods):
+            raise KeyError(imt)
+        max_below = self.sa_periods[idx - 1]
+        min_above = self.sa_periods[idx]
 
         # ratio tends to 1 when target period tends to a minimum
         # known period above and to 0 if target period is close
         # to maximum period below.
-        ratio = ((math.log(imt.period) - math.log(max_below.period))
-                 / (math.log(min_above.period) - math.log(max_below.period)))
-        max_below = self.sa_coeffs[max_below]
-        min_above = self.sa_coeffs[min_above]
+        ratio = ((math.log(imt.period) - math.log(max_below))
+                 / (math.log(min_above) - math.log(max_below)))
+        max_below = dict(zip(self.dtype.names, self.sa_array[idx - 1].item()))
+        min_above = dict(zip(self.dtype.names, self.sa_array[idx].item()))
         return dict(
             (co, (min_above[co] - max_below[co]) * ratio + max_below[co])
-            for co in max_below.keys()
+            for co in self.dtype.names
         )
+
+    def get_coeffs(self, imts):
+        """
+        Return the coefficients corresponding to a sequence of IMTs.
+
+        :param imts:
+            A sequence of intensity measure type objects; coefficients
+            are found or interpolated like in :meth:`__getitem__`.
+        :returns:
+            A structured numpy array with one field per coefficient
+            and one row per IMT, in the same order as ``imts``.
+        """
+        coeffs = numpy.zeros(len(imts), self.dtype)
+        for i, imt in enumerate(imts):
+            imt_coeffs = self[imt]
+            coeffs[i] = tuple(imt_coeffs[name] for name in self.dtype.names)
+        return coeffs
@@ -87,15 +87,45 @@ class BooreEtAl2014(GMPE):
         <.base.GroundShakingIntensityModel.get_mean_and_stddevs>`
         for spec of input and result values.
         """
+        pga_rock = self._get_pga_on_rock(self.COEFFS[PGA()], rup, dists)
+        return self._get_mean_and_stddevs(sites, rup, dists, imt,
+                                          stddev_types, pga_rock)
+
+    def get_means_and_stddevs(self, sites, rup, dists, imts, stddev_types):
+        """
+        See :meth:`superclass method
+        <.base.GroundShakingIntensityModel.get_means_and_stddevs>`
+        for spec of input and result values.
+
+        The median PGA on rock is computed only once; the coefficients of
+        all the IMTs are stacked in a column, so that the other terms are
+        computed for all the IMTs at once as arrays of shape
+        ``(len(imts), num_sites)``.
+        """
+        pga_rock = self._get_pga_on_rock(self.COEFFS[PGA()], rup, dists)
+        C = self.COEFFS.get_coeffs(imts)[:, np.newaxis]
+        imt_per = np.array([imt.period if isinstance(imt, SA) else 0.0
+                            for imt in imts])[:, np.newaxis]
+        mean = (self._get_magnitude_scaling_term(C, rup) +
+                self._get_path_scaling(C, dists, rup.mag) +
+                self._get_site_scaling(C, pga_rock, sites, imt_per, dists.rjb))
+        stddevs = self._get_stddevs(C, rup, dists, sites, stddev_types)
+        stddevs = np.array(stddevs).reshape((len(stddev_types), ) + mean.shape)
+        return mean, stddevs.swapaxes(0, 1)
+
+    def _get_mean_and_stddevs(self, sites, rup, dists, imt, stddev_types,
+                              pga_rock):
+        """
+        Compute mean and standard deviations for a single IMT, given
+        the median PGA on rock.
+        """
         # extracting dictionary of coefficients specific to required
         # intensity measure type.
         C = self.COEFFS[imt]
-        C_PGA = self.COEFFS[PGA()]
         if isinstance(imt, (PGA, PGV)):
             imt_per = 0.0
         else:
             imt_per = imt.period
-        pga_rock = self._get_pga_on_rock(C_PGA, rup, dists)
         mean = (self._get_magnitude_scaling_term(C, rup) +
                 self._get_path_scaling(C, dists, rup.mag) +
                 self._get_site_scaling(C, pga_rock, sites, imt_per, dists.rjb))
@@ -115,10 +145,9 @@ class BooreEtAl2014(GMPE):
         Returns the magnitude scling term defined in equation (2)
         """
         dmag = rup.mag - C["Mh"]
-        if rup.mag <= C["Mh"]:
-            mag_term = (C["e4"] * dmag) + (C["e5"] * (dmag ** 2.0))
-        else:
-            mag_term = C["e6"] * dmag
+        mag_term = np.where(rup.mag <= C["Mh"],
+                            (C["e4"] * dmag) + (C["e5"] * (dmag ** 2.0)),
+                            C["e6"] * dmag)
         return self._get_style_of_faulting_term(C, rup) + mag_term
 
     def _get_style_of_faulting_term(self, C, rup):
@@ -165,8 +194,7 @@ class BooreEtAl2014(GMPE):
         """
         Returns the linear site scaling term (equation 6)
         """
-        flin = vs30 / self.CONSTS["Vref"]
-        flin[vs30 > C["Vc"]] = C["Vc"] / self.CONSTS["Vref"]
+        flin = np.where(vs30 > C["Vc"], C["Vc"], vs30) / self.CONSTS["Vref"]
         return C["c"] * np.log(flin)
 
     def _get_nonlinear_site_term(self, C, vs30, pga_rock):
@@ -233,25 +261,27 @@ class BooreEtAl2014(GMPE):
         base_vals = np.zeros(num_sites)
         # Magnitude Dependent phi (Equation 17)
         if mag <= 4.5:
-            base_vals += C["f1"]
+            base_vals = base_vals + C["f1"]
         elif mag >= 5.5:
-            base_vals += C["f2"]
+            base_vals = base_vals + C["f2"]
         else:
-            base_vals += (C["f1"] + (C["f2"] - C["f1"]) * (mag - 4.5))
-        # Distance dependent phi (Equation 16)
-        idx1 = rjb > C["R2"]
-        base_vals[idx1] += C["DfR"]
-        idx2 = np.logical_and(rjb > C["R1"], rjb <= C["R2"])
-        base_vals[idx2] += (C["DfR"] * (np.log(rjb[idx2] / C["R1"]) /
-                                        np.log(C["R2"] / C["R1"])))
+            base_vals = base_vals + (C["f1"] + (C["f2"] - C["f1"]) *
+                                     (mag - 4.5))
+        # Distance dependent phi (Equation 16), zero up to R1 and DfR
+        # from R2 on
+        base_vals = base_vals + (
+            C["DfR"] * (np.log(np.clip(rjb, C["R1"], C["R2"]) / C["R1"]) /
+                        np.log(C["R2"] / C["R1"])))
         # Site-dependent phi (Equation 15)
         idx1 = vs30 <= self.CONSTS["v1"]
-        base_vals[idx1] -= C["DfV"]
+        base_vals = base_vals - np.where(idx1, C["DfV"], 0.)
         idx2 = np.logical_and(vs30 >= self.CONSTS["v1"],
                               vs30 <= self.CONSTS["v2"])
-        base_vals[idx2] -= (
-            C["DfV"] * (np.log(self.CONSTS["v2"] / vs30[idx2]) /
-                        np.log(self.CONSTS["v2"] / self.CONSTS["v1"])))
+        base_vals = base_vals - np.where(
+            idx2,
+            C["DfV"] * (np.log(self.CONSTS["v2"] / vs30) /
+                        np.log(self.CONSTS["v2"] / self.CONSTS["v1"])),
+            0.)
         return base_vals
 
     COEFFS = CoeffsTable(sa_damping=5, table="""\
@@ -640,15 +670,10 @@ class BooreEtAl2014CaliforniaBasin(BooreEtAl2014):
         In the case of the base model the basin depth term is switched off.
         Therefore we return an array of zeros.
         """
-        if period < 0.65:
-            f_dz1 = np.zeros(len(sites.vs30), dtype=float)
-        else:
-            f_dz1 = C["f7"] + np.zeros(len(sites.vs30), dtype=float)
-            f_ratio = C["f7"] / C["f6"]
-            dz1 = (sites.z1pt0 / 1000.0) - california_basin_model(sites.vs30)
-            idx = dz1 <= f_ratio
-            f_dz1[idx] = C["f6"] * dz1[idx]
-        return f_dz1
+        f_ratio = C["f7"] / C["f6"]
+        dz1 = (sites.z1pt0 / 1000.0) - california_basin_model(sites.vs30)
+        f_dz1 = np.where(dz1 <= f_ratio, C["f6"] * dz1, C["f7"])
+        return np.where(period < 0.65, 0., f_dz1)
 
 
 class BooreEtAl2014HighQCaliforniaBasin(BooreEtAl2014HighQ):
@@ -666,15 +691,10 @@ class BooreEtAl2014HighQCaliforniaBasin(BooreEtAl2014HighQ):
         In the case of the base model the basin depth term is switched off.
         Therefore we return an array of zeros.
         """
-        if period < 0.65:
-            f_dz1 = np.zeros(len(sites.vs30), dtype=float)
-        else:
-            f_dz1 = C["f7"] + np.zeros(len(sites.vs30), dtype=float)
-            f_ratio = C["f7"] / C["f6"]
-            dz1 = (sites.z1pt0 / 1000.0) - california_basin_model(sites.vs30)
-            idx = dz1 <= f_ratio
-            f_dz1[idx] = C["f6"] * dz1[idx]
-        return f_dz1
+        f_ratio = C["f7"] / C["f6"]
+        dz1 = (sites.z1pt0 / 1000.0) - california_basin_model(sites.vs30)
+        f_dz1 = np.where(dz1 <= f_ratio, C["f6"] * dz1, C["f7"])
+        return np.where(period < 0.65, 0., f_dz1)
 
 
 class BooreEtAl2014LowQCaliforniaBasin(BooreEtAl2014LowQ):
@@ -692,15 +712,10 @@ class BooreEtAl2014LowQCaliforniaBasin(BooreEtAl2014LowQ):
         In the case of the base model the basin depth term is switched off.
         Therefore we return an array of zeros.
         """
-        if period < 0.65:
-            f_dz1 = np.zeros(len(sites.vs30), dtype=float)
-        else:
-            f_dz1 = C["f7"] + np.zeros(len(sites.vs30), dtype=float)
-            f_ratio = C["f7"] / C["f6"]
-            dz1 = (sites.z1pt0 / 1000.0) - california_basin_model(sites.vs30)
-            idx = dz1 <= f_ratio
-            f_dz1[idx] = C["f6"] * dz1[idx]
-        return f_dz1
+        f_ratio = C["f7"] / C["f6"]
+        dz1 = (sites.z1pt0 / 1000.0) - california_basin_model(sites.vs30)
+        f_dz1 = np.where(dz1 <= f_ratio, C["f6"] * dz1, C["f7"])
+        return np.where(period < 0.65, 0., f_dz1)
 
 
 def japan_basin_model(vs30):
@@ -730,15 +745,10 @@ class BooreEtAl2014JapanBasin(BooreEtAl2014):
         In the case of the base model the basin depth term is switched off.
         Therefore we return an array of zeros.
         """
-        if period < 0.65:
-            f_dz1 = np.zeros(len(sites.vs30), dtype=float)
-        else:
-            f_dz1 = C["f7"] + np.zeros(len(sites.vs30), dtype=float)
-            f_ratio = C["f7"] / C["f6"]
-            dz1 = (sites.z1pt0 / 1000.0) - japan_basin_model(sites.vs30)
-            idx = dz1 <= f_ratio
-            f_dz1[idx] = C["f6"] * dz1[idx]
-        return f_dz1
+        f_ratio = C["f7"] / C["f6"]
+        dz1 = (sites.z1pt0 / 1000.0) - japan_basin_model(sites.vs30)
+        f_dz1 = np.where(dz1 <= f_ratio, C["f6"] * dz1, C["f7"])
+        return np.where(period < 0.65, 0., f_dz1)
 
 
 class BooreEtAl2014HighQJapanBasin(BooreEtAl2014HighQ):
@@ -756,15 +766,10 @@ class BooreEtAl2014HighQJapanBasin(BooreEtAl2014HighQ):
         In the case of the base model the basin depth term is switched off.
         Therefore we return an array of zeros.
         """
-        if period < 0.65:
-            f_dz1 = np.zeros(len(sites.vs30), dtype=float)
-        else:
-            f_dz1 = C["f7"] + np.zeros(len(sites.vs30), dtype=float)
-            f_ratio = C["f7"] / C["f6"]
-            dz1 = (sites.z1pt0 / 1000.0) - japan_basin_model(sites.vs30)
-            idx = dz1 <= f_ratio
-            f_dz1[idx] = C["f6"] * dz1[idx]
-        return f_dz1
+        f_ratio = C["f7"] / C["f6"]
+        dz1 = (sites.z1pt0 / 1000.0) - japan_basin_model(sites.vs30)
+        f_dz1 = np.where(dz1 <= f_ratio, C["f6"] * dz1, C["f7"])
+        return np.where(period < 0.65, 0., f_dz1)
 
 
 class BooreEtAl2014LowQJapanBasin(BooreEtAl2014LowQ):
@@ -782,15 +787,10 @@ class BooreEtAl2014LowQJapanBasin(BooreEtAl2014LowQ):
         In the case of the base model the basin depth term is switched off.
         Therefore we return an array of zeros.
         """
-        if period < 0.65:
-            f_dz1 = np.zeros(len(sites.vs30), dtype=float)
-        else:
-            f_dz1 = C["f7"] + np.zeros(len(sites.vs30), dtype=float)
-            f_ratio = C["f7"] / C["f6"]
-            dz1 = (sites.z1pt0 / 1000.0) - japan_basin_model(sites.vs30)
-            idx = dz1 <= f_ratio
-            f_dz1[idx] = C["f6"] * dz1[idx]
-        return f_dz1
+        f_ratio = C["f7"] / C["f6"]
+        dz1 = (sites.z1pt0 / 1000.0) - japan_basin_model(sites.vs30)
+        f_dz1 = np.where(dz1 <= f_ratio, C["f6"] * dz1, C["f7"])
+        return np.where(period < 0.65, 0., f_dz1)
 
 
 class BooreEtAl2014NoSOF(BooreEtAl2014):
@@ -854,15 +854,10 @@ class BooreEtAl2014CaliforniaBasinNoSOF(BooreEtAl2014NoSOF):
         In the case of the base model the basin depth term is switched off.
         Therefore we return an array of zeros.
         """
-        if period < 0.65:
-            f_dz1 = np.zeros(len(sites.vs30), dtype=float)
-        else:
-            f_dz1 = C["f7"] + np.zeros(len(sites.vs30), dtype=float)
-            f_ratio = C["f7"] / C["f6"]
-            dz1 = (sites.z1pt0 / 1000.0) - california_basin_model(sites.vs30)
-            idx = dz1 <= f_ratio
-            f_dz1[idx] = C["f6"] * dz1[idx]
-        return f_dz1
+        f_ratio = C["f7"] / C["f6"]
+        dz1 = (sites.z1pt0 / 1000.0) - california_basin_model(sites.vs30)
+        f_dz1 = np.where(dz1 <= f_ratio, C["f6"] * dz1, C["f7"])
+        return np.where(period < 0.65, 0., f_dz1)
 
 
 class BooreEtAl2014HighQCaliforniaBasinNoSOF(BooreEtAl2014HighQNoSOF):
@@ -880,15 +875,10 @@ class BooreEtAl2014HighQCaliforniaBasinNoSOF(BooreEtAl2014HighQNoSOF):
         In the case of the base model the basin depth term is switched off.
         Therefore we return an array of zeros.
         """
-        if period < 0.65:
-            f_dz1 = np.zeros(len(sites.vs30), dtype=float)
-        else:
-            f_dz1 = C["f7"] + np.zeros(len(sites.vs30), dtype=float)
-            f_ratio = C["f7"] / C["f6"]
-            dz1 = (sites.z1pt0 / 1000.0) - california_basin_model(sites.vs30)
-            idx = dz1 <= f_ratio
-            f_dz1[idx] = C["f6"] * dz1[idx]
-        return f_dz1
+        f_ratio = C["f7"] / C["f6"]
+        dz1 = (sites.z1pt0 / 1000.0) - california_basin_model(sites.vs30)
+        f_dz1 = np.where(dz1 <= f_ratio, C["f6"] * dz1, C["f7"])
+        return np.where(period < 0.65, 0., f_dz1)
 
 
 class BooreEtAl2014LowQCaliforniaBasinNoSOF(BooreEtAl2014LowQNoSOF):
@@ -906,15 +896,10 @@ class BooreEtAl2014LowQCaliforniaBasinNoSOF(BooreEtAl2014LowQNoSOF):
         In the case of the base model the basin depth term is switched off.
         Therefore we return an array of zeros.
         """
-        if period < 0.65:
-            f_dz1 = np.zeros(len(sites.vs30), dtype=float)
-        else:
-            f_dz1 = C["f7"] + np.zeros(len(sites.vs30), dtype=float)
-            f_ratio = C["f7"] / C["f6"]
-            dz1 = (sites.z1pt0 / 1000.0) - california_basin_model(sites.vs30)
-            idx = dz1 <= f_ratio
-            f_dz1[idx] = C["f6"] * dz1[idx]
-        return f_dz1
+        f_ratio = C["f7"] / C["f6"]
+        dz1 = (sites.z1pt0 / 1000.0) - california_basin_model(sites.vs30)
+        f_dz1 = np.where(dz1 <= f_ratio, C["f6"] * dz1, C["f7"])
+        return np.where(period < 0.65, 0., f_dz1)
 
 
 class BooreEtAl2014JapanBasinNoSOF(BooreEtAl2014NoSOF):
@@ -932,15 +917,10 @@ class BooreEtAl2014JapanBasinNoSOF(BooreEtAl2014NoSOF):
         In the case of the base model the basin depth term is switched off.
         Therefore we return an array of zeros.
         """
-        if period < 0.65:
-            f_dz1 = np.zeros(len(sites.vs30), dtype=float)
-        else:
-            f_dz1 = C["f7"] + np.zeros(len(sites.vs30), dtype=float)
-            f_ratio = C["f7"] / C["f6"]
-            dz1 = (sites.z1pt0 / 1000.0) - japan_basin_model(sites.vs30)
-            idx = dz1 <= f_ratio
-            f_dz1[idx] = C["f6"] * dz1[idx]
-        return f_dz1
+        f_ratio = C["f7"] / C["f6"]
+        dz1 = (sites.z1pt0 / 1000.0) - japan_basin_model(sites.vs30)
+        f_dz1 = np.where(dz1 <= f_ratio, C["f6"] * dz1, C["f7"])
+        return np.where(period < 0.65, 0., f_dz1)
 
 
 class BooreEtAl2014HighQJapanBasinNoSOF(BooreEtAl2014HighQNoSOF):
@@ -958,15 +938,10 @@ class BooreEtAl2014HighQJapanBasinNoSOF(BooreEtAl2014HighQNoSOF):
         In the case of the base model the basin depth term is switched off.
         Therefore we return an array of zeros.
         """
-        if period < 0.65:
-            f_dz1 = np.zeros(len(sites.vs30), dtype=float)
-        else:
-            f_dz1 = C["f7"] + np.zeros(len(sites.vs30), dtype=float)
-            f_ratio = C["f7"] / C["f6"]
-            dz1 = (sites.z1pt0 / 1000.0) - japan_basin_model(sites.vs30)
-            idx = dz1 <= f_ratio
-            f_dz1[idx] = C["f6"] * dz1[idx]
-        return f_dz1
+        f_ratio = C["f7"] / C["f6"]
+        dz1 = (sites.z1pt0 / 1000.0) - japan_basin_model(sites.vs30)
+        f_dz1 = np.where(dz1 <= f_ratio, C["f6"] * dz1, C["f7"])
+        return np.where(period < 0.65, 0., f_dz1)
 
 
 class BooreEtAl2014LowQJapanBasinNoSOF(BooreEtAl2014LowQNoSOF):
@@ -984,12 +959,7 @@ class BooreEtAl2014LowQJapanBasinNoSOF(BooreEtAl2014LowQNoSOF):
         In the case of the base model the basin depth term is switched off.
         Therefore we return an array of zeros.
         """
-        if period < 0.65:
-            f_dz1 = np.zeros(len(sites.vs30), dtype=float)
-        else:
-            f_dz1 = C["f7"] + np.zeros(len(sites.vs30), dtype=float)
-            f_ratio = C["f7"] / C["f6"]
-            dz1 = (sites.z1pt0 / 1000.0) - japan_basin_model(sites.vs30)
-            idx = dz1 <= f_ratio
-            f_dz1[idx] = C["f6"] * dz1[idx]
-        return f_dz1
+        f_ratio = C["f7"] / C["f6"]
+        dz1 = (sites.z1pt0 / 1000.0) - japan_basin_model(sites.vs30)
+        f_dz1 = np.where(dz1 <= f_ratio, C["f6"] * dz1, C["f7"])
+        return np.where(period < 0.65, 0., f_dz1)
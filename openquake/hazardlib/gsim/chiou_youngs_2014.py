@@ -73,23 +73,58 @@ class ChiouYoungs2014(GMPE):
         <.base.GroundShakingIntensityModel.get_mean_and_stddevs>`
         for spec of input and result values.
         """
+        rupture_terms = self._get_rupture_terms(rup, dists)
+        centered_z1pt0 = self._get_centered_z1pt0(sites)
         # extracting dictionary of coefficients specific to required
         # intensity measure type.
         C = self.COEFFS[imt]
+        return self._get_mean_and_stddevs(sites, rup, dists, C,
+                                          stddev_types, rupture_terms,
+                                          centered_z1pt0)
+
+    def get_means_and_stddevs(self, sites, rup, dists, imts, stddev_types):
+        """
+        See :meth:`superclass method
+        <.base.GroundShakingIntensityModel.get_means_and_stddevs>`
+        for spec of input and result values.
+
+        The terms not depending on the coefficients (faulting style
+        and hanging wall flags, centered ztor and z1pt0) are computed
+        once; the coefficients of all the IMTs are stacked in a column,
+        so that the other terms are computed for all the IMTs at once as
+        arrays of shape ``(len(imts), num_sites)``.
+        """
+        rupture_terms = self._get_rupture_terms(rup, dists)
+        centered_z1pt0 = self._get_centered_z1pt0(sites)
+        C = self.COEFFS.get_coeffs(imts)[:, np.newaxis]
+        mean, stddevs = self._get_mean_and_stddevs(
+            sites, rup, dists, C, stddev_types, rupture_terms,
+            centered_z1pt0)
+        stddevs = np.array(stddevs).reshape((len(stddev_types), ) + mean.shape)
+        return mean, stddevs.swapaxes(0, 1)
+
+    def _get_mean_and_stddevs(self, sites, rup, dists, C, stddev_types,
+                              rupture_terms, centered_z1pt0):
+        """
+        Compute mean and standard deviations given the coefficients, of a
+        single IMT or stacked in a column for many IMTs, and the terms
+        returned by :meth:`_get_rupture_terms` and
+        :meth:`_get_centered_z1pt0`.
+        """
         # intensity on a reference soil is used for both mean
         # and stddev calculations.
-        ln_y_ref = self._get_ln_y_ref(rup, dists, C)
+        ln_y_ref = self._get_ln_y_ref(rup, dists, C, rupture_terms)
         # exp1 and exp2 are parts of eq. 12 and eq. 13,
         # calculate it once for both.
         exp1 = np.exp(C['phi3'] * (sites.vs30.clip(-np.inf, 1130) - 360))
         exp2 = np.exp(C['phi3'] * (1130 - 360))
-        mean = self._get_mean(sites, C, ln_y_ref, exp1, exp2)
+        mean = self._get_mean(sites, C, ln_y_ref, exp1, exp2, centered_z1pt0)
         stddevs = self._get_stddevs(sites, rup, C, stddev_types,
                                     ln_y_ref, exp1, exp2)
 
         return mean, stddevs
 
-    def _get_mean(self, sites, C, ln_y_ref, exp1, exp2):
+    def _get_mean(self, sites, C, ln_y_ref, exp1, exp2, centered_z1pt0):
         """
         Add site effects to an intensity.
 
@@ -97,8 +132,6 @@ class ChiouYoungs2014(GMPE):
         """
         # we do not support estimating of basin depth and instead
         # rely on it being available (since we require it).
-        # centered_z1pt0
-        centered_z1pt0 = self._get_centered_z1pt0(sites)
         # we consider random variables being zero since we want
         # to find the exact mean value.
         eta = epsilon = 0.
@@ -158,11 +191,12 @@ class ChiouYoungs2014(GMPE):
                 ret.append(np.abs((1 + NL) * tau))
         return ret
 
-    def _get_ln_y_ref(self, rup, dists, C):
+    def _get_rupture_terms(self, rup, dists):
         """
-        Get an intensity on a reference soil.
-
-        Implements eq. 13a.
+        Get the terms of eq. 13a not depending on the coefficients, that is
+        the reverse and normal faulting flags, the hanging wall flag,
+        the magnitude term of eq. 11, the centered ztor and the hanging wall
+        taper depending on distances.
         """
         # reverse faulting flag
         Frv = 1. if 30 <= rup.rake <= 150 else 0.
@@ -177,11 +211,24 @@ class ChiouYoungs2014(GMPE):
         # a part in eq. 11
         mag_test1 = np.cosh(2. * max(rup.mag - 4.5, 0))
 
-        # centered DPP
-        centered_dpp = 0.
         # centered_ztor
         centered_ztor = self._get_centered_ztor(rup, Frv)
-        #
+
+        hw_taper = (1 - np.sqrt(dists.rjb ** 2 + rup.ztor ** 2)
+                    / (dists.rrup + 1.0))
+
+        return Frv, Fnm, Fhw, mag_test1, centered_ztor, hw_taper
+
+    def _get_ln_y_ref(self, rup, dists, C, rupture_terms):
+        """
+        Get an intensity on a reference soil.
+
+        Implements eq. 13a.
+        """
+        Frv, Fnm, Fhw, mag_test1, centered_ztor, hw_taper = rupture_terms
+
+        # centered DPP
+        centered_dpp = 0.
 
         ln_y_ref = (
             # first part of eq. 11
@@ -198,23 +245,23 @@ class ChiouYoungs2014(GMPE):
             # third part
             + C['c4']
             * np.log(dists.rrup + C['c5']
-                     * np.cosh(C['c6'] * max(rup.mag - C['chm'], 0)))
+                     * np.cosh(C['c6'] * np.maximum(rup.mag - C['chm'], 0)))
             + (C['c4a'] - C['c4'])
             * np.log(np.sqrt(dists.rrup ** 2 + C['crb'] ** 2))
             # forth part
-            + (C['cg1'] + C['cg2'] / (np.cosh(max(rup.mag - C['cg3'], 0))))
+            + (C['cg1'] + C['cg2'] /
+               (np.cosh(np.maximum(rup.mag - C['cg3'], 0))))
             * dists.rrup
-            # fifth part
-            + C['c8'] * np.amax(1 - (np.amax(dists.rrup - 40,
-                                np.zeros_like(dists)) / 30.),
-                                np.zeros_like(dists))
+            # fifth part; the maxima are taken element-wise with zero
+            # (``numpy.amax`` was called here with an array as axis)
+            + C['c8'] * np.maximum(1 - (np.maximum(dists.rrup - 40, 0.)
+                                        / 30.), 0.)
             * min(max(rup.mag - 5.5, 0) / 0.8, 1.0)
             * np.exp(-1 * C['c8a'] * (rup.mag - C['c8b'] ** 2)) * centered_dpp
             # sixth part
             + C['c9'] * Fhw * np.cos(math.radians(rup.dip)) *
             (C['c9a'] + (1 - C['c9a']) * np.tanh(dists.rx / C['c9b']))
-            * (1 - np.sqrt(dists.rjb ** 2 + rup.ztor ** 2)
-               / (dists.rrup + 1.0))
+            * hw_taper
         )
 
         return ln_y_ref
@@ -339,7 +339,7 @@ class ZhaoEtAl2006SSlab(ZhaoEtAl2006Asc):
 
         # to avoid singularity at 0.0 (in the calculation of the
         # slab correction term), replace 0 values with 0.1
-        d = dists.rrup
+        d = dists.rrup.copy()
         d[d == 0.0] = 0.1
 
         # mean value as given by equation 1, p. 901, without considering the
@@ -17,8 +17,11 @@
 Module :mod:`openquake.hazardlib.site` defines :class:`Site`.
 """
 import numpy
+import scipy.spatial
 
 from openquake.hazardlib.geo.mesh import Mesh
+from openquake.hazardlib.geo.geodetic import EARTH_RADIUS
+from openquake.hazardlib.geo.utils import spherical_to_cartesian
 from openquake.hazardlib.slots import with_slots
 
 
@@ -94,12 +97,32 @@ Vs30=760.0000, Vs30Measured=True, Depth1.0km=100.0000, Depth2.5km=5.0000>'
         return self.__str__()
 
 
+#: Record type of the structured arrays storing the parameters of the
+#: sites, see :meth:`SiteCollection.from_array`
+site_param_dt = numpy.dtype([
+    ('sids', int),
+    ('lons', float),
+    ('lats', float),
+    ('vs30', float),
+    ('vs30measured', bool),
+    ('z1pt0', float),
+    ('z2pt5', float),
+])
+
+
 class SiteCollection(object):
     """
     A collection of :class:`sites <Site>`.
 
     Instances of this class are intended to represent a large collection
-    of sites in a most efficient way in terms of memory usage.
+    of sites in a most efficient way in terms of memory usage. The site
+    parameters are stored in a single structured array of type
+    :data:`site_param_dt`, available as :attr:`array` (which is ``None``
+    for collections built with :meth:`from_points`), and the arrays
+    ``sids``, ``lons``, ``lats``, ``vs30``, ``vs30measured``, ``z1pt0``
+    and ``z2pt5`` are views of its fields. Large collections can be
+    built directly from such an array, possibly memory-mapped from a
+    file, with :meth:`from_array` and :meth:`from_file`.
 
     .. note::
 
@@ -143,27 +166,86 @@ class SiteCollection(object):
         self._vs30measured = sitemodel.reference_vs30_type == 'measured'
         self._z1pt0 = sitemodel.reference_depth_to_1pt0km_per_sec
         self._z2pt5 = sitemodel.reference_depth_to_2pt5km_per_sec
+        self.array = None
+        self._clear_cache()
         return self
 
+    @classmethod
+    def from_array(cls, array):
+        """
+        Build the site collection from a structured array, without
+        looping on the sites.
+
+        :param array:
+            A one-dimensional structured array with the fields of
+            :data:`site_param_dt`. If the array has exactly that dtype
+            the collection keeps a reference to it and no data is copied,
+            so that the array can be a :class:`numpy.memmap`; otherwise
+            it is converted field by field into a new array.
+        :raises ValueError:
+            If any field is missing or if any of ``vs30``, ``z1pt0``
+            or ``z2pt5`` is zero or negative.
+        """
+        names = array.dtype.names or ()
+        missing = [name for name in site_param_dt.names if name not in names]
+        if missing:
+            raise ValueError(
+                'missing site parameters: %s' % ', '.join(missing))
+        if array.dtype != site_param_dt:
+            converted = numpy.zeros(len(array), site_param_dt)
+            for name in site_param_dt.names:
+                converted[name] = array[name]
+            array = converted
+        for name in ('vs30', 'z1pt0', 'z2pt5'):
+            if not (array[name] > 0).all():
+                raise ValueError('%s must be positive' % name)
+        self = cls.__new__(cls)
+        self._set_array(array)
+        return self
+
+    @classmethod
+    def from_file(cls, fname, mmap_mode='r'):
+        """
+        Build the site collection from a file memory-mapped with the
+        given mode, so that the site parameters are read from the disk
+        only when needed.
+
+        :param fname:
+            Path to a ``.npy`` file, as written by :func:`numpy.save` with
+            the :attr:`array` of a site collection, or to a binary file
+            containing the raw records of type :data:`site_param_dt`.
+        :param mmap_mode:
+            The mode of :class:`numpy.memmap`, read-only by default.
+        """
+        if fname.endswith('.npy'):
+            array = numpy.load(fname, mmap_mode=mmap_mode)
+        else:
+            array = numpy.memmap(fname, site_param_dt, mmap_mode)
+        return cls.from_array(array)
+
     def __init__(self, sites):
+        array = numpy.array(
+            [(site.id, site.location.longitude, site.location.latitude,
+              site.vs30, site.vs30measured, site.z1pt0, site.z2pt5)
+             for site in sites], site_param_dt)
+        self._set_array(array)
+
+    def _set_array(self, array):
+        """
+        Store the structured array and set the parameter arrays
+        as views of its fields.
+        """
         self.complete = self
-        self.total_sites = n = len(sites)
-        self.sids = numpy.zeros(n, dtype=int)
-        self.lons = numpy.zeros(n, dtype=float)
-        self.lats = numpy.zeros(n, dtype=float)
-        self._vs30 = numpy.zeros(n, dtype=float)
-        self._vs30measured = numpy.zeros(n, dtype=bool)
-        self._z1pt0 = numpy.zeros(n, dtype=float)
-        self._z2pt5 = numpy.zeros(n, dtype=float)
-
-        for i in xrange(n):
-            self.sids[i] = sites[i].id
-            self.lons[i] = sites[i].location.longitude
-            self.lats[i] = sites[i].location.latitude
-            self._vs30[i] = sites[i].vs30
-            self._vs30measured[i] = sites[i].vs30measured
-            self._z1pt0[i] = sites[i].z1pt0
-            self._z2pt5[i] = sites[i].z2pt5
+        self.total_sites = len(array)
+        self.array = array
+        self.sids = array['sids']
+        self.lons = array['lons']
+        self.lats = array['lats']
+        self._vs30 = array['vs30']
+        self._vs30measured = array['vs30measured']
+        self._z1pt0 = array['z1pt0']
+        self._z2pt5 = array['z2pt5']
+        self._clear_cache()
 
         # protect arrays from being accidentally changed. it is useful
         # because we pass these arrays directly to a GMPE through
@@ -175,16 +257,66 @@ class SiteCollection(object):
                     self.lons, self.lats, self.sids):
             arr.flags.writeable = False
 
+    def _clear_cache(self):
+        """
+        Reset the arrays and the objects derived from the positions of the
+        sites, which are computed on first access.
+        """
+        self._mesh = None
+        self._xyz = None
+        self._kdtree = None
+
     @property
     def mesh(self):
-        """Return a mesh with the given lons and lats"""
-        return Mesh(self.lons, self.lats, depths=None)
+        """Return a mesh with the given lons and lats, built only once"""
+        if self._mesh is None:
+            self._mesh = Mesh(self.lons, self.lats, depths=None)
+        return self._mesh
+
+    @property
+    def xyz(self):
+        """
+        The positions of the sites in 3d Cartesian space, as returned by
+        :func:`~openquake.hazardlib.geo.utils.spherical_to_cartesian`,
+        computed on first access and then cached.
+        """
+        if self._xyz is None:
+            self._xyz = spherical_to_cartesian(self.lons, self.lats, None)
+        return self._xyz
 
     @property
     def indices(self):
         """The full set of indices from 0 to total_sites - 1"""
         return numpy.arange(0, self.total_sites)
 
+    @property
+    def kdtree(self):
+        """
+        A :class:`scipy.spatial.cKDTree` of the positions of the sites
+        in 3d Cartesian space, built on first access and then cached.
+        """
+        if self._kdtree is None:
+            self._kdtree = scipy.spatial.cKDTree(self.xyz)
+        return self._kdtree
+
+    def __getstate__(self):
+        # the spatial index and the other derived objects are not pickled,
+        # they are rebuilt when needed; the parameter arrays are views of
+        # the structured array and are not pickled twice
+        state = self.__dict__.copy()
+        state['_mesh'] = state['_xyz'] = state['_kdtree'] = None
+        if state.get('array') is not None:
+            for name in 'sids lons lats _vs30 _vs30measured _z1pt0 _z2pt5' \
+                    .split():
+                del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self._clear_cache()
+        if state.get('array') is not None:
+            self._set_array(state.pop('array'))
+        self.__dict__.update(state)
+
     def __iter__(self):
         """
         Iterate through all :class:`sites <Site>` in the collection, yielding
@@ -229,6 +361,33 @@ class SiteCollection(object):
         [indices] = mask.nonzero()
         return FilteredSiteCollection(indices, self)
 
+    def filter_by_distance(self, lon, lat, distance):
+        """
+        Create a FilteredSiteCollection with only the sites of this
+        collection lying within a given great circle distance from a point.
+
+        Sites are looked up in the spatial index :attr:`kdtree`, so the
+        cost of this method depends on the number of sites found rather
+        than on the total number of sites. The comparison has a tolerance
+        of a few millimeters in favour of inclusion, which makes it
+        suitable as a conservative prefilter for exact distance checks.
+
+        :param lon:
+            Longitude of the point, in decimal degrees.
+        :param lat:
+            Latitude of the point, in decimal degrees.
+        :param distance:
+            Distance from the point, in km.
+        :returns:
+            Same as :meth:`filter`.
+        """
+        indices = _get_close_indices(self, lon, lat, distance)
+        if len(indices) == len(self):
+            return self
+        if not len(indices):
+            return None
+        return FilteredSiteCollection(indices, self)
+
     def expand(self, data, placeholder):
         """
         For non-filtered site collections just checks that data
@@ -238,6 +397,16 @@ class SiteCollection(object):
         assert len(data) == len(self), (len(data), len(self))
         return data
 
+    def expand_into(self, target, data, ufunc=numpy.multiply):
+        """
+        Combine in place the values of ``target`` with the ones in
+        ``data``, with a binary numpy ufunc. For non-filtered site
+        collections this is just ``ufunc(target, data, out=target)``.
+        See :meth:`FilteredSiteCollection.expand_into`.
+        """
+        assert len(data) == len(self), (len(data), len(self))
+        ufunc(target, data, out=target)
+
     def __len__(self):
         """
         Return the number of sites in the collection.
@@ -275,6 +444,12 @@ class FilteredSiteCollection(object):
     Notice that if you filter a FilteredSiteCollection `fsc`, you will
     get a different FilteredSiteCollection referring to the complete
     SiteCollection `fsc.complete`, not to the filtered collection `fsc`.
+
+    The arrays of the site parameters are extracted from the complete
+    collection on each access. When the indices are a contiguous range,
+    as it happens for instance when filtering a grid of sites by rows,
+    they are views on the arrays of the complete collection and no data
+    is copied.
     """
     __slots__ = 'indices complete'.split()
 
@@ -292,6 +467,25 @@ class FilteredSiteCollection(object):
         """Return a mesh with the given lons and lats"""
         return Mesh(self.lons, self.lats, depths=None)
 
+    @property
+    def xyz(self):
+        """
+        The positions of the sites in 3d Cartesian space, extracted from
+        the cached positions of the complete collection.
+        """
+        return self._extract(self.complete.xyz)
+
+    def _extract(self, array):
+        """
+        Extract the elements of the filtered sites from an array
+        referring to the complete collection: if the indices are a
+        contiguous range a view is returned, otherwise a copy.
+        """
+        indices = self.indices
+        if len(indices) and indices[-1] - indices[0] + 1 == len(indices):
+            return array[indices[0]:indices[-1] + 1]
+        return array.take(indices, axis=0)
+
     def filter(self, mask):
         """
         Create a FilteredSiteCollection with only a subset of sites
@@ -319,6 +513,24 @@ class FilteredSiteCollection(object):
         indices = self.indices.take(mask.nonzero()[0])
         return FilteredSiteCollection(indices, self.complete)
 
+    def filter_by_distance(self, lon, lat, distance):
+        """
+        Create a FilteredSiteCollection with only the sites of this
+        collection lying within a given great circle distance from a point.
+
+        The spatial index of the complete site collection is used,
+        see :meth:`SiteCollection.filter_by_distance`.
+        """
+        indices = _get_close_indices(self.complete, lon, lat, distance)
+        # keep only the sites belonging to this collection
+        pos = self.indices.searchsorted(indices)
+        indices = indices[self.indices.take(pos, mode='clip') == indices]
+        if len(indices) == len(self):
+            return self
+        if not len(indices):
+            return None
+        return FilteredSiteCollection(indices, self.complete)
+
     def expand(self, data, placeholder):
         """
         Expand a short array `data` over a filtered site collection of the
@@ -364,22 +576,44 @@ class FilteredSiteCollection(object):
         assert self.indices[-1] < self.total_sites, (
             self.indices[-1], self.total_sites)
 
-        if data.ndim == 1:
-            # single-dimensional array
-            result = numpy.empty(self.total_sites)
-            result.fill(placeholder)
-            result.put(self.indices, data)
-            return result
-
-        assert data.ndim == 2
-        # two-dimensional array
-        num_values = data.shape[1]
-        result = numpy.empty((self.total_sites, num_values))
+        assert data.ndim in (1, 2), data.ndim
+        result = numpy.empty((self.total_sites,) + data.shape[1:])
         result.fill(placeholder)
-        for i in xrange(num_values):
-            result[:, i].put(self.indices, data[:, i])
+        result[self.indices] = data
         return result
 
+    def expand_into(self, target, data, ufunc=numpy.multiply):
+        """
+        Combine in place the values of ``target`` for the filtered sites
+        with the ones in ``data``, with a binary numpy ufunc.
+
+        This is equivalent to ``target[:] = ufunc(target, expand(data,
+        placeholder))`` where ``placeholder`` is the identity of the
+        ufunc, for instance 1 for :data:`numpy.multiply` and 0 for
+        :data:`numpy.add`, but only the elements of the filtered sites
+        are touched, so that the cost does not depend on the total
+        number of sites.
+
+        :param target:
+            1d or 2d numpy array with first dimension of length
+            ``total_sites``, updated in place.
+        :param data:
+            1d or 2d numpy array with first dimension representing values
+            computed for site from this collection.
+        :param ufunc:
+            A binary numpy ufunc, by default :data:`numpy.multiply`.
+        """
+        assert len(data) == len(self), (len(data), len(self))
+        assert len(target) == self.total_sites, (
+            len(target), self.total_sites)
+        indices = self.indices
+        if indices[-1] - indices[0] + 1 == len(indices):
+            # contiguous indices, update a view of the target
+            view = target[indices[0]:indices[-1] + 1]
+            ufunc(view, data, out=view)
+        else:
+            target[indices] = ufunc(target[indices], data)
+
     def __len__(self):
         """Return the number of filtered sites"""
         return len(self.indices)
@@ -388,9 +622,24 @@ class FilteredSiteCollection(object):
         return '<FilteredSiteCollection with %d of %d sites>' % (
             len(self.indices), self.total_sites)
 
+
+def _get_close_indices(sites, lon, lat, distance):
+    """
+    Return the sorted array of the indices of the sites of a complete
+    collection lying within ``distance`` km from the point ``lon, lat``.
+    """
+    # the great circle distance is converted into the length of the chord
+    # used by the index, and slightly increased to absorb rounding errors
+    angle = min(distance / EARTH_RADIUS, numpy.pi)
+    chord = 2 * EARTH_RADIUS * numpy.sin(angle / 2) + 1e-6
+    point = spherical_to_cartesian(lon, lat, None)
+    indices = sites.kdtree.query_ball_point(point, chord)
+    return numpy.array(sorted(indices), dtype=int)
+
+
 # attach a number of properties filtering the arrays
 for name in 'vs30 vs30measured z1pt0 z2pt5 lons lats sids'.split():
     prop = property(
-        lambda fsc, name=name: getattr(fsc.complete, name).take(fsc.indices),
+        lambda fsc, name=name: fsc._extract(getattr(fsc.complete, name)),
         doc='Extract %s array from FilteredSiteCollection' % name)
     setattr(FilteredSiteCollection, name, prop)
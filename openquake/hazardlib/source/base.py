@@ -18,6 +18,7 @@ Module :mod:`openquake.hazardlib.source.base` defines a base class for
 seismic sources.
 """
 import abc
+from openquake.hazardlib.geo.utils import get_bounding_circle
 from openquake.hazardlib.slots import with_slots
 
 
@@ -124,8 +125,17 @@ class BaseSeismicSource(object):
         If short-circuits are taken, false positives are generally better than
         false negatives (it's better not to filter a site out if there is some
         uncertainty about its distance).
+
+        Only the sites lying inside a circle enclosing the polygon (see
+        :func:`~openquake.hazardlib.geo.utils.get_bounding_circle`) are
+        checked for containment.
         """
         rup_enc_poly = self.get_rupture_enclosing_polygon(integration_distance)
+        lon, lat, radius = get_bounding_circle(rup_enc_poly.lons,
+                                               rup_enc_poly.lats)
+        sites = sites.filter_by_distance(lon, lat, radius)
+        if sites is None:
+            return None
         return sites.filter(rup_enc_poly.intersects(sites.mesh))
 
 
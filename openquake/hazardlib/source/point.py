@@ -137,6 +137,10 @@ class PointSource(ParametricSeismicSource):
         """
         radius = self._get_max_rupture_projection_radius()
         radius += integration_distance
+        sites = sites.filter_by_distance(self.location.longitude,
+                                         self.location.latitude, radius)
+        if sites is None:
+            return None
         return sites.filter(self.location.closer_than(sites.mesh, radius))
 
     def iter_ruptures(self):
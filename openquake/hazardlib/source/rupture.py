@@ -107,16 +107,21 @@ class BaseProbabilisticRupture(Rupture):
         """
 
     @abc.abstractmethod
-    def sample_number_of_occurrences(self):
+    def sample_number_of_occurrences(self, rng=None):
         """
         Randomly sample number of occurrences from temporal occurrence model
         probability distribution.
 
         .. note::
             This method is using random numbers. In order to reproduce the
-            same results numpy random numbers generator needs to be seeded, see
+            same results either ``rng`` must be given or numpy random
+            numbers generator needs to be seeded, see
             http://docs.scipy.org/doc/numpy/reference/generated/numpy.random.seed.html
 
+        :param rng:
+            Optional :class:`numpy.random.RandomState` to draw the sample
+            from, instead of the global numpy random numbers generator.
+            See :func:`openquake.hazardlib.calc.stochastic.random_state`.
         :returns:
             int, Number of rupture occurrences
         """
@@ -184,7 +189,7 @@ class NonParametricProbabilisticRupture(BaseProbabilisticRupture):
 
         return prob_no_exceed
 
-    def sample_number_of_occurrences(self):
+    def sample_number_of_occurrences(self, rng=None):
         """
         See :meth:`superclass method
         <.rupture.BaseProbabilisticRupture.sample_number_of_occurrences>`
@@ -195,7 +200,9 @@ class NonParametricProbabilisticRupture(BaseProbabilisticRupture):
         # compute cdf from pmf
         cdf = numpy.cumsum([float(p) for p, _ in self.pmf.data])
 
-        rn = numpy.random.random()
+        if rng is None:
+            rng = numpy.random
+        rn = rng.random_sample()
         [n_occ] = numpy.digitize([rn], cdf)
 
         return n_occ
@@ -251,7 +258,7 @@ class ParametricProbabilisticRupture(BaseProbabilisticRupture):
         rate = self.occurrence_rate
         return tom.get_probability_one_occurrence(rate)
 
-    def sample_number_of_occurrences(self):
+    def sample_number_of_occurrences(self, rng=None):
         """
         Draw a random sample from the distribution and return a number
         of events to occur.
@@ -261,7 +268,7 @@ class ParametricProbabilisticRupture(BaseProbabilisticRupture):
         of an assigned temporal occurrence model.
         """
         return self.temporal_occurrence_model.sample_number_of_occurrences(
-            self.occurrence_rate
+            self.occurrence_rate, rng
         )
 
     def get_probability_no_exceedance(self, poes):
@@ -33,7 +33,8 @@ from openquake.hazardlib.geo import NodalPlane, RectangularMesh, \
     SimpleFaultSurface, Point
 from openquake.hazardlib.scalerel import PeerMSR, PointMSR
 from openquake.hazardlib.gsim.sadigh_1997 import SadighEtAl1997
-from openquake.hazardlib.calc import hazard_curves
+from openquake.hazardlib.calc import hazard_curves, batch_hazard_curves
+from openquake.hazardlib.calc import filters
 from openquake.hazardlib.tom import PoissonTOM
 
 from openquake.hazardlib.tests.acceptance import _peer_test_data as test_data
@@ -259,3 +260,96 @@ class Set1TestCase(unittest.TestCase):
                                atol=1e-3, rtol=1e-5)
         assert_hazard_curve_is(self, s7hc, test_data.SET1_CASE2_SITE7_POES,
                                atol=2e-5, rtol=1e-5)
+
+
+class BatchHazardCurvesTestCase(unittest.TestCase):
+    # the batched calculator must give exactly the same numbers
+    # as the rupture-by-rupture one
+    def _assert_same_curves(self, sources, sites, imts, **kwargs):
+        gsims = {const.TRT.ACTIVE_SHALLOW_CRUST: SadighEtAl1997()}
+        for truncation_level in (0, 3):
+            expected = hazard_curves(sources, sites, imts, gsims,
+                                     truncation_level, **kwargs)
+            for batch_size in (7, 1000):
+                actual = batch_hazard_curves(
+                    sources, sites, imts, gsims, truncation_level,
+                    batch_size=batch_size, **kwargs)
+                for imt in imts:
+                    numpy.testing.assert_array_equal(actual[imt],
+                                                     expected[imt])
+
+    def test_area_source(self):
+        sources = [AreaSource(source_id='area', name='area',
+            tectonic_region_type=const.TRT.ACTIVE_SHALLOW_CRUST,
+            mfd=test_data.SET1_CASE11_MFD,
+            nodal_plane_distribution=PMF([(1, NodalPlane(0.0, 90.0, 0.0))]),
+            hypocenter_distribution=PMF([
+                (Decimal('0.5'), 5.0), (Decimal('0.5'), 10.0)]),
+            upper_seismogenic_depth=0.0,
+            lower_seismogenic_depth=10.0,
+            magnitude_scaling_relationship = PointMSR(),
+            rupture_aspect_ratio=test_data.SET1_RUPTURE_ASPECT_RATIO,
+            temporal_occurrence_model=PoissonTOM(1.),
+            polygon=test_data.SET1_CASE11_SOURCE_POLYGON,
+            area_discretization=25.0,
+            rupture_mesh_spacing=10.0
+        )]
+        sites = SiteCollection([
+            test_data.SET1_CASE11_SITE1, test_data.SET1_CASE11_SITE2,
+            test_data.SET1_CASE11_SITE3, test_data.SET1_CASE11_SITE4
+        ])
+        imts = {test_data.IMT: test_data.SET1_CASE11_IMLS}
+        self._assert_same_curves(sources, sites, imts)
+        self._assert_same_curves(
+            sources, sites, imts,
+            source_site_filter=filters.source_site_distance_filter(50),
+            rupture_site_filter=filters.rupture_site_distance_filter(50))
+
+    def test_simple_fault_source(self):
+        sources = [SimpleFaultSource(source_id='fault1', name='fault1',
+            tectonic_region_type=const.TRT.ACTIVE_SHALLOW_CRUST,
+            mfd=test_data.SET1_CASE5_MFD,
+            rupture_mesh_spacing=2.0,
+            magnitude_scaling_relationship=PeerMSR(),
+            rupture_aspect_ratio=test_data.SET1_RUPTURE_ASPECT_RATIO,
+            temporal_occurrence_model=PoissonTOM(1.),
+            upper_seismogenic_depth=test_data.SET1_CASE1TO9_UPPER_SEISMOGENIC_DEPTH,
+            lower_seismogenic_depth=test_data.SET1_CASE1TO9_LOWER_SEISMOGENIC_DEPTH,
+            fault_trace=test_data.SET1_CASE1TO9_FAULT_TRACE,
+            dip=test_data.SET1_CASE1TO9_DIP,
+            rake=test_data.SET1_CASE1TO9_RAKE
+        )]
+        sites = SiteCollection([
+            test_data.SET1_CASE1TO9_SITE1, test_data.SET1_CASE1TO9_SITE2,
+            test_data.SET1_CASE1TO9_SITE3, test_data.SET1_CASE1TO9_SITE4,
+            test_data.SET1_CASE1TO9_SITE5, test_data.SET1_CASE1TO9_SITE6,
+            test_data.SET1_CASE1TO9_SITE7
+        ])
+        imts = {test_data.IMT: test_data.SET1_CASE5_IMLS}
+        self._assert_same_curves(
+            sources, sites, imts,
+            rupture_site_filter=filters.rupture_site_distance_filter(30))
+
+    def test_non_parametric_source(self):
+        data = test_data.SET1_CASE2_SOURCE_DATA
+        ruptures = []
+        for i in range(data['num_rups_dip']):
+            for j in range(data['num_rups_strike']):
+                mesh = RectangularMesh(data['lons'], data['lats'][j],
+                                       data['depths'][i])
+                hypo = Point(data['hypo_lons'][i, j],
+                             data['hypo_lats'][i, j],
+                             data['hypo_depths'][i, j])
+                rup = Rupture(data['mag'], data['rake'],
+                              data['tectonic_region_type'], hypo,
+                              SimpleFaultSurface(mesh),
+                              data['source_typology'])
+                ruptures.append((rup, data['pmf']))
+        npss = NonParametricSeismicSource(
+            'id', 'name', data['tectonic_region_type'], ruptures)
+        sites = SiteCollection([
+            test_data.SET1_CASE1TO9_SITE1, test_data.SET1_CASE1TO9_SITE2,
+            test_data.SET1_CASE1TO9_SITE3, test_data.SET1_CASE1TO9_SITE4
+        ])
+        imts = {test_data.IMT: test_data.SET1_CASE2_IMLS}
+        self._assert_same_curves([npss], sites, imts)
@@ -19,11 +19,20 @@ import warnings
 
 import numpy
 
+from openquake.hazardlib import const
 from openquake.hazardlib.calc import disagg
 from openquake.hazardlib.calc import filters
+from openquake.hazardlib.calc.monitor import Monitor
 from openquake.hazardlib.tom import PoissonTOM
-from openquake.hazardlib.geo import Point, Mesh
-from openquake.hazardlib.site import Site
+from openquake.hazardlib.geo import Point, Mesh, NodalPlane
+from openquake.hazardlib.gsim.boore_atkinson_2008 import BooreAtkinson2008
+from openquake.hazardlib.gsim.sadigh_1997 import SadighEtAl1997
+from openquake.hazardlib.imt import PGA, SA
+from openquake.hazardlib.mfd import EvenlyDiscretizedMFD
+from openquake.hazardlib.pmf import PMF
+from openquake.hazardlib.scalerel import PeerMSR
+from openquake.hazardlib.site import Site, SiteCollection
+from openquake.hazardlib.source import PointSource
 
 
 class _BaseDisaggTestCase(unittest.TestCase):
@@ -251,6 +260,17 @@ class DefineBinsTestCase(unittest.TestCase):
         self.assertIs(trt_bins, trt_bins_)
 
 
+class DigitizeLonsTestCase(unittest.TestCase):
+    def test(self):
+        idx = disagg._digitize_lons([9.5, 10, 10.5, 11, 12], [10, 10.5, 11])
+        numpy.testing.assert_array_equal(idx, [-1, 0, 1, 1, 2])
+
+    def test_cross_idl(self):
+        lons = [179.5, -179.5, 180, -180, -179, 178, -178.5]
+        idx = disagg._digitize_lons(lons, [179, -180, -179])
+        numpy.testing.assert_array_equal(idx, [0, 1, 1, 1, 1, 2, 2])
+
+
 class ArangeDataInBinsTestCase(unittest.TestCase):
     def test(self):
         mags = numpy.array([5, 5], float)
@@ -325,6 +345,23 @@ class DisaggregateTestCase(_BaseDisaggTestCase):
 
         self.assertEqual(matrix.sum(), 0)
 
+    def test_monitor(self):
+        self.gsim.truncation_level = self.truncation_level = 1
+        monitor = Monitor()
+        _, matrix = disagg.disaggregation(
+            self.sources, self.site, self.imt, self.iml, self.gsims,
+            self.truncation_level, n_epsilons=3,
+            mag_bin_width=3, dist_bin_width=4, coord_bin_width=2.4,
+            monitor=monitor
+        )
+        self.assertEqual(sorted(monitor.stages), [
+            'binning', 'disaggregate_poe', 'iter_ruptures', 'make_contexts',
+            'rupture_distances', 'rupture_filtering', 'source_filtering'])
+        self.assertEqual(monitor.counters['sources'], 2)
+        self.assertEqual(monitor.counters['ruptures'], 13)
+        self.assertEqual(monitor.sources[2]['counters']['ruptures'], 2)
+        self.assertEqual(monitor.stages['disaggregate_poe']['calls'], 13)
+
     def test_cross_idl(self):
         # test disaggregation with source generating ruptures crossing
         # internation date line
@@ -429,6 +466,183 @@ class DisaggregateTestCase(_BaseDisaggTestCase):
                 self.assertEqual(expected_warning_msg, warning.message.message)
 
 
+class DisaggregationPerSiteTestCase(unittest.TestCase):
+    def setUp(self):
+        trts = [const.TRT.ACTIVE_SHALLOW_CRUST, const.TRT.STABLE_CONTINENTAL]
+        self.sources = [
+            PointSource(
+                source_id='point%d' % i, name='point%d' % i,
+                tectonic_region_type=trts[i % 2],
+                mfd=EvenlyDiscretizedMFD(
+                    min_mag=5, bin_width=1, occurrence_rates=[0.2, 0.1]),
+                nodal_plane_distribution=PMF([
+                    (1, NodalPlane(strike=0.0, dip=90.0, rake=0.0))]),
+                hypocenter_distribution=PMF([(1, 10)]),
+                upper_seismogenic_depth=0.0,
+                lower_seismogenic_depth=10.0,
+                magnitude_scaling_relationship=PeerMSR(),
+                rupture_aspect_ratio=2,
+                temporal_occurrence_model=PoissonTOM(50.),
+                rupture_mesh_spacing=1.0,
+                location=Point(10, 10 + 0.3 * i)
+            ) for i in range(3)]
+        self.gsims = {const.TRT.ACTIVE_SHALLOW_CRUST: BooreAtkinson2008(),
+                      const.TRT.STABLE_CONTINENTAL: SadighEtAl1997()}
+        # the third site is reached only by the second and third source,
+        # the fourth one by no source
+        self.site_list = [
+            Site(Point(10.1, 10), 760, True, 100, 5),
+            Site(Point(10, 10.2), 400, False, 100, 5),
+            Site(Point(10, 11), 760, True, 100, 5),
+            Site(Point(12, 12), 600, True, 100, 5)]
+        self.sites = SiteCollection(self.site_list)
+        self.source_site_filter = filters.source_site_distance_filter(100)
+        self.rupture_site_filter = filters.rupture_site_distance_filter(100)
+
+    def _disaggregate(self, function, sites, monitor=None):
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            result = function(
+                self.sources, sites, PGA(), 0.1, self.gsims,
+                truncation_level=3, n_epsilons=4, mag_bin_width=0.5,
+                dist_bin_width=10, coord_bin_width=0.2,
+                source_site_filter=self.source_site_filter,
+                rupture_site_filter=self.rupture_site_filter,
+                monitor=monitor)
+        return result, w
+
+    def test_same_as_single_site(self):
+        monitor = Monitor()
+        results, w = self._disaggregate(disagg.disaggregation_per_site,
+                                        self.sites, monitor)
+        self.assertEqual(len(results), 4)
+        for site, (bin_edges, matrix) in zip(self.site_list, results):
+            (expected_bin_edges, expected_matrix), _ = self._disaggregate(
+                disagg.disaggregation, site)
+            if expected_matrix is None:
+                self.assertIsNone(bin_edges)
+                self.assertIsNone(matrix)
+                continue
+            for edges, expected_edges in zip(bin_edges[:5],
+                                             expected_bin_edges[:5]):
+                numpy.testing.assert_array_equal(edges, expected_edges)
+            self.assertEqual(bin_edges[5], expected_bin_edges[5])
+            numpy.testing.assert_array_almost_equal(matrix, expected_matrix)
+        self.assertEqual(results[2][0][5], [const.TRT.STABLE_CONTINENTAL,
+                                            const.TRT.ACTIVE_SHALLOW_CRUST])
+        self.assertEqual([matrix is None for _, matrix in results],
+                         [False, False, False, True])
+        [warning] = w
+        self.assertEqual(
+            str(warning.message),
+            'No ruptures have contributed to the hazard at site 3 '
+            '(lon=12.0, lat=12.0)')
+        # the ruptures are generated once for all the sites
+        self.assertEqual(monitor.counters['ruptures'], 6)
+        self.assertEqual(monitor.stages['disaggregate_poe']['calls'],
+                         monitor.counters['filtered_ruptures'])
+
+
+    def test_per_level(self):
+        imtls = {PGA(): [0.05, 0.1, 0.3], SA(0.2, 5): [0.1, 0.5]}
+        kwargs = dict(truncation_level=3, n_epsilons=4, mag_bin_width=0.5,
+                      dist_bin_width=10, coord_bin_width=0.2,
+                      source_site_filter=self.source_site_filter,
+                      rupture_site_filter=self.rupture_site_filter)
+        monitor = Monitor()
+        site = self.site_list[1]
+        results = disagg.disaggregation_per_level(
+            self.sources, site, imtls, self.gsims, monitor=monitor, **kwargs)
+        self.assertEqual(
+            list(results), [(imt, iml) for imt in imtls for iml in imtls[imt]])
+        for (imt, iml), (bin_edges, matrix) in results.iteritems():
+            expected_bin_edges, expected_matrix = disagg.disaggregation(
+                self.sources, site, imt, iml, self.gsims, **kwargs)
+            for edges, expected_edges in zip(bin_edges[:5],
+                                             expected_bin_edges[:5]):
+                numpy.testing.assert_array_equal(edges, expected_edges)
+            self.assertEqual(bin_edges[5], expected_bin_edges[5])
+            numpy.testing.assert_array_almost_equal(matrix, expected_matrix)
+            self.assertGreater(matrix.sum(), 0)
+        # the ruptures are processed once for all the levels
+        self.assertEqual(monitor.counters['ruptures'], 6)
+        self.assertEqual(monitor.stages['make_contexts']['calls'],
+                         monitor.counters['filtered_ruptures'])
+
+    def test_per_level_no_contributions(self):
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            results = disagg.disaggregation_per_level(
+                self.sources, self.site_list[3], {PGA(): [0.1, 0.2]},
+                self.gsims, truncation_level=3, n_epsilons=4,
+                mag_bin_width=0.5, dist_bin_width=10, coord_bin_width=0.2,
+                source_site_filter=self.source_site_filter)
+        self.assertEqual(results, {(PGA(), 0.1): (None, None),
+                                   (PGA(), 0.2): (None, None)})
+        self.assertEqual(len(w), 1)
+
+
+    def _disaggregate_in_bins(self, site, bins, **kwargs):
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            result = disagg.disaggregation_in_bins(
+                self.sources, site, PGA(), 0.1, self.gsims,
+                3, 4, *bins, source_site_filter=self.source_site_filter,
+                rupture_site_filter=self.rupture_site_filter, **kwargs)
+        return result, w
+
+    def test_in_bins_same_as_disaggregation(self):
+        for site in self.site_list[:3]:
+            (expected_bin_edges, expected_matrix), _ = self._disaggregate(
+                disagg.disaggregation, site)
+            monitor = Monitor()
+            (bin_edges, matrix), w = self._disaggregate_in_bins(
+                site, expected_bin_edges[:4], monitor=monitor,
+                ruptures_per_block=2)
+            self.assertEqual(w, [])
+            for edges, expected_edges in zip(bin_edges[:5],
+                                             expected_bin_edges[:5]):
+                numpy.testing.assert_array_almost_equal(edges, expected_edges)
+            self.assertEqual(bin_edges[5], expected_bin_edges[5])
+            numpy.testing.assert_array_almost_equal(matrix, expected_matrix)
+            self.assertEqual(monitor.stages['binning']['calls'],
+                             (monitor.counters['filtered_ruptures'] + 1) // 2)
+
+    def test_in_bins_out_of_bins(self):
+        site = self.site_list[0]
+        (expected_bin_edges, expected_matrix), _ = self._disaggregate(
+            disagg.disaggregation, site)
+        # only the first magnitude bin
+        bins = (expected_bin_edges[0][:2], ) + expected_bin_edges[1:4]
+        (bin_edges, matrix), [warning] = self._disaggregate_in_bins(
+            site, bins)
+        self.assertEqual(
+            str(warning.message),
+            '3 contributing ruptures out of the bins have been ignored '
+            'at site <Location=<Latitude=10.000000, Longitude=10.100000, '
+            'Depth=0.0000>, Vs30=760.0000, Vs30Measured=True, '
+            'Depth1.0km=100.0000, Depth2.5km=5.0000>')
+        numpy.testing.assert_array_almost_equal(matrix, expected_matrix[:1])
+
+    def test_in_bins_no_contributions(self):
+        (bin_edges, matrix), [warning] = self._disaggregate_in_bins(
+            self.site_list[3], ([5, 6], [0, 10], [10, 11], [10, 11]))
+        self.assertIsNone(bin_edges)
+        self.assertIsNone(matrix)
+
+    def test_make_bin_edges(self):
+        aaae = numpy.testing.assert_array_almost_equal
+        mag_bins, dist_bins, lon_bins, lat_bins = disagg.make_bin_edges(
+            (5.1, 6.5), (3, 27), (9.9, 10.3), (9.75, 10.2), 0.5, 10, 0.2)
+        aaae(mag_bins, [5, 5.5, 6, 6.5])
+        aaae(dist_bins, [0, 10, 20, 30])
+        aaae(lon_bins, [9.8, 10, 10.2, 10.4])
+        aaae(lat_bins, [9.6, 9.8, 10, 10.2])
+        _, _, lon_bins, _ = disagg.make_bin_edges(
+            (5, 6), (0, 10), (179.5, -179.5), (0, 1), 1, 10, 1)
+        aaae(lon_bins, [179, -180, -179])
+
+
 class PMFExtractorsTestCase(unittest.TestCase):
     def setUp(self):
         super(PMFExtractorsTestCase, self).setUp()
@@ -559,3 +773,31 @@ class PMFExtractorsTestCase(unittest.TestCase):
                         [0.999998665328, 0.999969082487, 0.999980380612]],
                        [[0.999447922645, 0.999996344798, 0.999999678475],
                         [0.999981572755, 0.999464007617, 0.999983196102]]])
+
+    def test_extract_pmf_any_axes(self):
+        # the result is the same as folding the matrix cell by cell
+        def fold(keep):
+            pmf = numpy.ones([self.matrix.shape[axis] for axis in keep])
+            for index in numpy.ndindex(*self.matrix.shape):
+                pmf[tuple(index[axis] for axis in keep)] *= (
+                    1 - self.matrix[index])
+            return 1 - pmf
+        for keep in [(0, ), (4, ), (5, 0), (4, 1, 0), (2, 3, 4, 5),
+                     (0, 1, 2, 3, 4, 5)]:
+            self.aae(disagg.extract_pmf(self.matrix, keep), fold(keep))
+        self.aae(disagg.extract_pmf(self.matrix, ('Eps', 'TRT')),
+                 fold((4, 5)))
+        self.aae(disagg.extract_pmf(self.matrix, ('TRT', 'Mag')),
+                 disagg.extract_pmf(self.matrix, ('Mag', 'TRT')).T)
+        self.aae(disagg.extract_pmf(self.matrix, ()), fold(()))
+
+    def test_extract_pmf_wrong_axes(self):
+        with self.assertRaises(ValueError) as ctx:
+            disagg.extract_pmf(self.matrix, ('Mag', 'Depth'))
+        self.assertEqual(
+            str(ctx.exception),
+            "unknown axis 'Depth', expected one of Mag, Dist, Lon, Lat, "
+            "Eps, TRT")
+        with self.assertRaises(ValueError) as ctx:
+            disagg.extract_pmf(self.matrix, ('Mag', 0))
+        self.assertEqual(str(ctx.exception), "repeated axis 'Mag'")
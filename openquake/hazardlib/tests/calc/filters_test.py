@@ -56,7 +56,8 @@ class SourceSiteDistanceFilterTestCase(unittest.TestCase):
 
 class RuptureSiteDistanceFilterTestCase(unittest.TestCase):
     def test(self):
-        def fake_filter(rupture, integration_distance, sites):
+        def fake_filter(rupture, integration_distance, sites, rejected):
+            assert rejected == {'bounding_circle': 0, 'distance': 0}
             if rupture == 1:
                 return None  # all filtered out
             elif rupture == 2:  # partial filtering
@@ -16,14 +16,25 @@
 import unittest
 
 import numpy
+import scipy.stats
 from numpy.testing import assert_allclose, assert_array_equal
 
 from openquake.hazardlib import const
-from openquake.hazardlib.imt import SA, PGV
+from openquake.hazardlib.imt import SA, PGA, PGV
 from openquake.hazardlib.site import Site, SiteCollection
-from openquake.hazardlib.geo import Point
+from openquake.hazardlib.geo import Point, NodalPlane
+from openquake.hazardlib.mfd import EvenlyDiscretizedMFD
+from openquake.hazardlib.pmf import PMF
+from openquake.hazardlib.scalerel import PeerMSR
+from openquake.hazardlib.source import PointSource
+from openquake.hazardlib.tom import PoissonTOM
+from openquake.hazardlib.gsim.sadigh_1997 import SadighEtAl1997
+from openquake.hazardlib.gsim.boore_atkinson_2008 import BooreAtkinson2008
+from openquake.hazardlib.calc import filters
 from openquake.hazardlib.calc.gmf import (
-    ground_motion_fields, CorrelationButNoInterIntraStdDevs)
+    ground_motion_fields, batch_ground_motion_fields, GmfComputer,
+    CorrelationButNoInterIntraStdDevs, TruncatedNormal)
+from openquake.hazardlib.calc.monitor import Monitor
 from openquake.hazardlib.correlation import JB2009CorrelationModel
 
 
@@ -41,6 +52,14 @@ class BaseFakeGSIM(object):
                              stddev_types):
         raise NotImplementedError
 
+    def get_means_and_stddevs(gsim, mean, std_inter, std_intra, imts,
+                              stddev_types):
+        means_stddevs = [gsim.get_mean_and_stddevs(mean, std_inter, std_intra,
+                                                   imt, stddev_types)
+                         for imt in imts]
+        return (numpy.array([m for m, _ in means_stddevs]),
+                numpy.array([s for _, s in means_stddevs]))
+
     def to_imt_unit_values(gsim, intensities):
         return intensities - 10.
 
@@ -307,6 +326,41 @@ class GMFCalcNoCorrelationTestCase(BaseGMFCalcTestCase):
                 (intensity[self.sites.vs30measured.nonzero()] == 0).any()
             )
 
+    def test_monitor(self):
+        self.gsim.expect_same_sitecol = False
+        monitor = Monitor()
+        gmfs = ground_motion_fields(
+            self.rupture, self.sites, [self.imt1, self.imt2],
+            self.gsim, truncation_level=None, realizations=5,
+            rupture_site_filter=self.rupture_site_filter, seed=17,
+            monitor=monitor)
+        self.assertEqual(gmfs[self.imt1].shape, (7, 5))
+        self.assertEqual(sorted(monitor.stages), [
+            'expansion', 'gmf_computation', 'make_contexts',
+            'rupture_filtering'])
+        self.assertEqual(monitor.counters, {
+            'filtered_ruptures': 1,
+            'site_rupture_pairs': self.sites.vs30measured.sum()})
+
+    def test_random_state(self):
+        def compute(seed):
+            return ground_motion_fields(
+                self.rupture, self.sites, [self.imt1, self.imt2], self.gsim,
+                truncation_level=2, realizations=5, seed=seed)
+        numpy.random.seed(17)
+        expected = compute(None)
+        # an integer seed gives the same values without changing the state
+        # of the global generator
+        state = numpy.random.get_state()
+        gmfs = compute(17)
+        self.assertEqual(numpy.random.get_state()[1].tolist(),
+                         state[1].tolist())
+        for imt in expected:
+            assert_array_equal(gmfs[imt], expected[imt])
+        gmfs = compute(numpy.random.RandomState(17))
+        for imt in expected:
+            assert_array_equal(gmfs[imt], expected[imt])
+
     def test_filtered_zero_truncation(self):
         self.gsim.expect_stddevs = False
         self.gsim.expect_same_sitecol = False
@@ -440,3 +494,100 @@ class GMFCalcCorrelatedTestCase(BaseGMFCalcTestCase):
         s1gmf, s2gmf = gmfs[self.imt1]
         numpy.testing.assert_array_equal(s2gmf, 0)
         numpy.testing.assert_array_almost_equal(s1gmf, 11.1852253)
+
+
+class BatchGroundMotionFieldsTestCase(unittest.TestCase):
+    def setUp(self):
+        trts = [const.TRT.ACTIVE_SHALLOW_CRUST, const.TRT.STABLE_CONTINENTAL]
+        sources = [
+            PointSource(
+                source_id='point%d' % i, name='point%d' % i,
+                tectonic_region_type=trts[i % 2],
+                mfd=EvenlyDiscretizedMFD(
+                    min_mag=5, bin_width=1, occurrence_rates=[2, 1]),
+                nodal_plane_distribution=PMF([
+                    (1, NodalPlane(strike=0.0, dip=90.0, rake=0.0))]),
+                hypocenter_distribution=PMF([(1, 10)]),
+                upper_seismogenic_depth=0.0,
+                lower_seismogenic_depth=10.0,
+                magnitude_scaling_relationship=PeerMSR(),
+                rupture_aspect_ratio=2,
+                temporal_occurrence_model=PoissonTOM(1.),
+                rupture_mesh_spacing=1.0,
+                location=Point(10, 10 + 0.1 * i)
+            ) for i in range(3)]
+        self.sites = SiteCollection([
+            Site(Point(10.1, 10), 760, True, 100, 5),
+            Site(Point(10, 10.2), 400, False, 100, 5),
+            Site(Point(10, 10.5), 760, True, 100, 5),
+            Site(Point(10.3, 10.3), 600, True, 100, 5)])
+        rupture_site_filter = filters.rupture_site_distance_filter(30)
+        ruptures_sites = list(rupture_site_filter(
+            (rupture, self.sites) for source in sources
+            for rupture in source.iter_ruptures()))
+        # each rupture occurs twice
+        self.ruptures_sites_seeds = [
+            (rupture, sites, 42 + i) for i, (rupture, sites) in
+            enumerate(ruptures_sites + ruptures_sites)]
+        self.imts = [PGA(), SA(0.2), SA(1.0)]
+
+    def _check(self, gsims, truncation_level, correlation_model=None):
+        gmfs = batch_ground_motion_fields(
+            self.ruptures_sites_seeds, self.imts, gsims, truncation_level,
+            realizations=3, correlation_model=correlation_model)
+        self.assertEqual(len(gmfs), len(self.ruptures_sites_seeds))
+        for (rupture, sites, seed), gmf in zip(self.ruptures_sites_seeds,
+                                               gmfs):
+            gsim = gsims[rupture.tectonic_region_type]
+            expected = GmfComputer(
+                rupture, sites, self.imts, gsim, truncation_level,
+                correlation_model)._compute(seed, gsim, 3)
+            self.assertEqual(list(gmf), self.imts)
+            for imt in self.imts:
+                self.assertEqual(gmf[imt].shape, (len(sites), 3))
+                assert_array_equal(gmf[imt], expected[imt])
+
+    def test_inter_intra_stddevs(self):
+        gsim = BooreAtkinson2008()
+        gsims = {const.TRT.ACTIVE_SHALLOW_CRUST: gsim,
+                 const.TRT.STABLE_CONTINENTAL: gsim}
+        self._check(gsims, None)
+        self._check(gsims, 3)
+        self._check(gsims, 0)
+        self._check(gsims, None, JB2009CorrelationModel(False))
+
+    def test_total_stddev(self):
+        gsims = {const.TRT.ACTIVE_SHALLOW_CRUST: SadighEtAl1997(),
+                 const.TRT.STABLE_CONTINENTAL: BooreAtkinson2008()}
+        self._check(gsims, 2)
+        with self.assertRaises(CorrelationButNoInterIntraStdDevs):
+            self._check(gsims, 2, JB2009CorrelationModel(False))
+
+
+class TruncatedNormalTestCase(unittest.TestCase):
+    def test_same_as_truncnorm(self):
+        for truncation_level in (0.5, 2, 3.5):
+            expected = scipy.stats.truncnorm(
+                -truncation_level, truncation_level).rvs(
+                size=1000, random_state=numpy.random.RandomState(42))
+            samples = TruncatedNormal(truncation_level).rvs(
+                1000, numpy.random.RandomState(42))
+            assert_allclose(samples, expected, rtol=1e-9, atol=1e-12)
+
+    def test_not_truncated(self):
+        expected = scipy.stats.norm().rvs(
+            size=1000, random_state=numpy.random.RandomState(42))
+        samples = TruncatedNormal(None).rvs(1000, numpy.random.RandomState(42))
+        assert_array_equal(samples, expected)
+
+    def test_distribution(self):
+        truncation_level = 2.5
+        samples = TruncatedNormal(truncation_level).rvs(
+            100000, numpy.random.RandomState(13))
+        self.assertLessEqual(abs(samples).max(), truncation_level)
+        distribution = scipy.stats.truncnorm(-truncation_level,
+                                             truncation_level)
+        _, pvalue = scipy.stats.kstest(samples, distribution.cdf)
+        self.assertGreater(pvalue, 0.01)
+        self.assertAlmostEqual(samples.mean(), 0, delta=0.01)
+        self.assertAlmostEqual(samples.std(), distribution.std(), delta=0.01)
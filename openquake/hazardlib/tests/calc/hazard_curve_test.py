@@ -13,7 +13,11 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import shutil
+import tempfile
 import unittest
+from decimal import Decimal
 
 import numpy
 
@@ -22,8 +26,29 @@ from openquake.hazardlib import const
 from openquake.hazardlib import imt
 from openquake.hazardlib.site import Site, SiteCollection
 from openquake.hazardlib.geo import Point
+from openquake.hazardlib.geo.surface.planar import PlanarSurface
+from openquake.hazardlib.pmf import PMF
+from openquake.hazardlib.source.non_parametric import \
+    NonParametricSeismicSource
+from openquake.hazardlib.source.rupture import Rupture
 from openquake.hazardlib.tom import PoissonTOM
 from openquake.hazardlib.calc.hazard_curve import hazard_curves
+from openquake.hazardlib.calc.hazard_curve import batch_hazard_curves
+from openquake.hazardlib.calc.hazard_curve import parallel_hazard_curves
+from openquake.hazardlib.calc.hazard_curve import _init_worker, _source_pnos
+from openquake.hazardlib.calc.hazard_curve import hazard_curves_per_gsim
+from openquake.hazardlib.calc.hazard_curve import mean_hazard_curves
+from openquake.hazardlib.calc.hazard_curve import incremental_hazard_curves
+from openquake.hazardlib.calc.hazard_curve import hazard_curves_per_source
+from openquake.hazardlib.calc.hazard_curve import \
+    hazard_curves_per_time_span
+from openquake.hazardlib.calc import filters
+from openquake.hazardlib.calc.monitor import Monitor
+from openquake.hazardlib.gsim.sadigh_1997 import SadighEtAl1997
+from openquake.hazardlib.gsim.boore_atkinson_2008 import BooreAtkinson2008
+from openquake.hazardlib.gsim.berge_thierry_2003 import \
+    BergeThierryEtAl2003SIGMA
+from openquake.hazardlib.gsim.cauzzi_faccioli_2008 import CauzziFaccioli2008
 
 
 class HazardCurvesTestCase(unittest.TestCase):
@@ -64,6 +89,11 @@ class HazardCurvesTestCase(unittest.TestCase):
             return numpy.array([self.poes[(epicenter.latitude, rctx, imt)]
                                 for epicenter in sctx.mesh])
 
+        def get_poes_by_imt(self, sctx, rctx, dctx, imts, truncation_level):
+            return dict((imt, self.get_poes(sctx, rctx, dctx, imt, imts[imt],
+                                            truncation_level))
+                        for imt in imts)
+
     def setUp(self):
         self.truncation_level = 3.4
         self.imts = {imt.PGA(): [1, 2, 3], imt.PGD(): [2, 4]}
@@ -272,3 +302,435 @@ class HazardCurvesFiltersTestCase(unittest.TestCase):
                          [('point2', [1, 3, 4])])
         self.assertEqual(rupture_site_filter.counts,
                          [(6, [4]), (8, [3, 4])])
+
+
+def _point_sources(num_sources, trts=(const.TRT.ACTIVE_SHALLOW_CRUST, )):
+    """
+    Return a list of point sources along a meridian, 0.1 degrees apart,
+    with the tectonic region types in ``trts`` taken in turn.
+    """
+    return [
+        openquake.hazardlib.source.PointSource(
+            source_id='point%d' % i, name='point%d' % i,
+            tectonic_region_type=trts[i % len(trts)],
+            mfd=openquake.hazardlib.mfd.EvenlyDiscretizedMFD(
+                min_mag=4, bin_width=1, occurrence_rates=[5, 2, 1]
+            ),
+            nodal_plane_distribution=openquake.hazardlib.pmf.PMF([
+                (1, openquake.hazardlib.geo.NodalPlane(strike=0.0,
+                                                       dip=90.0,
+                                                       rake=0.0))
+            ]),
+            hypocenter_distribution=openquake.hazardlib.pmf.PMF(
+                [(1, 10)]),
+            upper_seismogenic_depth=0.0,
+            lower_seismogenic_depth=10.0,
+            magnitude_scaling_relationship=
+            openquake.hazardlib.scalerel.PeerMSR(),
+            rupture_aspect_ratio=2,
+            temporal_occurrence_model=PoissonTOM(1.),
+            rupture_mesh_spacing=1.0,
+            location=Point(10, 10 + 0.1 * i)
+        ) for i in range(num_sources)]
+
+
+class _PointSourcesMixin(object):
+    """
+    Sources, sites, GSIMs and IMTs shared by the test cases of the
+    variants of :func:`hazard_curves`.
+    """
+    def setUp(self):
+        self.sources = _point_sources(7)
+        self.sites = SiteCollection([
+            Site(Point(10.1, 10), 760, True, 100, 5),
+            Site(Point(10, 10.5), 760, True, 100, 5),
+            Site(Point(10, 11), 760, True, 100, 5),
+            Site(Point(12, 10), 760, True, 100, 5)])
+        self.gsims = {const.TRT.ACTIVE_SHALLOW_CRUST: SadighEtAl1997()}
+        self.imts = {imt.PGA(): [0.01, 0.1, 0.5],
+                     imt.SA(0.2, 5): [0.01, 0.1]}
+
+
+class ParallelHazardCurvesTestCase(_PointSourcesMixin, unittest.TestCase):
+    def test_same_as_hazard_curves(self):
+        source_site_filter = filters.source_site_distance_filter(60)
+        rupture_site_filter = filters.rupture_site_distance_filter(60)
+        expected = hazard_curves(
+            self.sources, self.sites, self.imts, self.gsims, 3,
+            source_site_filter, rupture_site_filter)
+        reference = parallel_hazard_curves(
+            self.sources, self.sites, self.imts, self.gsims, 3,
+            source_site_filter, rupture_site_filter, num_workers=1)
+        for imt in self.imts:
+            numpy.testing.assert_allclose(reference[imt], expected[imt])
+            # the last site is too far from all the sources
+            self.assertEqual(reference[imt][3].tolist(),
+                             [0] * len(self.imts[imt]))
+
+        # the result does not depend on how the sources are split
+        for num_workers, tasks_per_worker in [(2, 1), (3, 4)]:
+            curves = parallel_hazard_curves(
+                self.sources, self.sites, self.imts, self.gsims, 3,
+                source_site_filter, rupture_site_filter,
+                num_workers=num_workers, tasks_per_worker=tasks_per_worker)
+            for imt in self.imts:
+                numpy.testing.assert_array_equal(curves[imt], reference[imt])
+
+    def test_source_pnos_sparse(self):
+        # the products of a source are computed only for its sites
+        rupture_site_filter = filters.rupture_site_distance_filter(60)
+        sources_indices = [
+            (source, s_sites.indices) for source, s_sites in
+            filters.source_site_distance_filter(60)(
+                (source, self.sites) for source in self.sources)]
+        _init_worker(self.sites, self.imts, self.gsims, 3,
+                     rupture_site_filter)
+        for (indices, pnos), (source, _) in zip(
+                _source_pnos(sources_indices), sources_indices):
+            expected = hazard_curves(
+                [source], self.sites, self.imts, self.gsims, 3,
+                filters.source_site_distance_filter(60), rupture_site_filter)
+            self.assertLess(len(indices), len(self.sites))
+            for imt in self.imts:
+                self.assertEqual(pnos[imt].shape,
+                                 (len(indices), len(self.imts[imt])))
+                numpy.testing.assert_allclose(1 - pnos[imt],
+                                              expected[imt][indices])
+
+    def test_source_errors(self):
+        self.sources[3].mfd = None
+        with self.assertRaises(AttributeError) as ae:
+            parallel_hazard_curves(
+                self.sources, self.sites, self.imts, self.gsims, 3,
+                num_workers=2, weight=lambda source: 1)
+        self.assertTrue(ae.exception.message.startswith(
+            'An error occurred with source id=point3. Error:'),
+            ae.exception.message)
+
+
+class HazardCurvesMonitorTestCase(_PointSourcesMixin, unittest.TestCase):
+    def setUp(self):
+        super(HazardCurvesMonitorTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _hazard_curves(self, monitor=None):
+        return hazard_curves(
+            self.sources, self.sites, self.imts, self.gsims, 3,
+            filters.source_site_distance_filter(60),
+            filters.rupture_site_distance_filter(60), monitor=monitor)
+
+    def test_hazard_curves(self):
+        monitor = Monitor()
+        curves = self._hazard_curves(monitor)
+        expected = self._hazard_curves()
+        for imt in self.imts:
+            numpy.testing.assert_array_equal(curves[imt], expected[imt])
+        self.assertEqual(sorted(monitor.stages), [
+            'accumulation', 'get_poes', 'iter_ruptures', 'make_contexts',
+            'rupture_filtering', 'source_filtering'])
+        self.assertEqual(monitor.counters['sources'], 7)
+        self.assertEqual(monitor.counters['ruptures'], 21)
+        self.assertEqual(sorted(monitor.sources),
+                         ['point%d' % i for i in range(7)])
+        num_ruptures = monitor.counters['filtered_ruptures']
+        self.assertEqual(monitor.stages['make_contexts']['calls'],
+                         num_ruptures)
+        self.assertEqual(
+            sum(source['counters']['filtered_ruptures']
+                for source in monitor.sources.itervalues()), num_ruptures)
+        self.assertGreaterEqual(monitor.counters['site_rupture_pairs'],
+                                num_ruptures)
+
+    def test_other_calculators(self):
+        expected = Monitor()
+        self._hazard_curves(expected)
+        args = (self.sources, self.sites, self.imts, self.gsims, 3)
+        kwargs = dict(
+            source_site_filter=filters.source_site_distance_filter(60),
+            rupture_site_filter=filters.rupture_site_distance_filter(60))
+        asc = const.TRT.ACTIVE_SHALLOW_CRUST
+        fname = os.path.join(self.tmpdir, 'curves.npz')
+        calculators = [
+            lambda **kw: batch_hazard_curves(*args, batch_size=2, **kw),
+            lambda **kw: incremental_hazard_curves(*args + (fname, ), **kw),
+            lambda **kw: list(hazard_curves_per_source(*args, **kw)),
+            lambda **kw: hazard_curves_per_time_span(*args + ([1, 2], ),
+                                                     **kw),
+            lambda **kw: hazard_curves_per_gsim(
+                self.sources, self.sites, self.imts,
+                {asc: [SadighEtAl1997()]}, 3, **kw)]
+        for calculator in calculators:
+            monitor = Monitor()
+            calculator(monitor=monitor, **kwargs)
+            self.assertEqual(monitor.counters, expected.counters)
+            self.assertEqual(sorted(monitor.stages), sorted(expected.stages))
+            self.assertEqual(sorted(monitor.sources),
+                             sorted(expected.sources))
+
+
+class IncrementalHazardCurvesTestCase(_PointSourcesMixin,
+                                      unittest.TestCase):
+    def _hazard_curves(self, sources, fname, **kwargs):
+        return incremental_hazard_curves(
+            sources, self.sites, self.imts, self.gsims, 3, fname,
+            filters.source_site_distance_filter(60),
+            filters.rupture_site_distance_filter(60), **kwargs)
+
+    def _assert_same_as_hazard_curves(self, curves):
+        expected = hazard_curves(
+            self.sources, self.sites, self.imts, self.gsims, 3,
+            filters.source_site_distance_filter(60),
+            filters.rupture_site_distance_filter(60))
+        for imt in self.imts:
+            numpy.testing.assert_allclose(curves[imt], expected[imt])
+
+    def setUp(self):
+        super(IncrementalHazardCurvesTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmpdir, 'curves.npz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _saved_source_ids(self):
+        data = numpy.load(self.fname)
+        try:
+            return data['source_ids'].tolist()
+        finally:
+            data.close()
+
+    def test_same_as_hazard_curves(self):
+        curves = self._hazard_curves(self.sources, self.fname)
+        self._assert_same_as_hazard_curves(curves)
+        self.assertEqual(self._saved_source_ids(),
+                         ['point%d' % i for i in range(7)])
+        self.assertFalse(os.path.exists(self.fname + '.tmp'))
+
+    def test_resume(self):
+        mfd = self.sources[3].mfd
+        self.sources[3].mfd = None
+        with self.assertRaises(AttributeError):
+            self._hazard_curves(self.sources, self.fname,
+                                checkpoint_interval=0)
+        self.assertEqual(self._saved_source_ids(),
+                         ['point0', 'point1', 'point2'])
+        self.sources[3].mfd = mfd
+        # the sources already computed are skipped
+        for source in self.sources[:3]:
+            source.mfd = None
+        curves = self._hazard_curves(self.sources, self.fname)
+        for source in self.sources[:3]:
+            source.mfd = mfd
+        self._assert_same_as_hazard_curves(curves)
+
+    def test_new_sources(self):
+        self._hazard_curves(self.sources[:4], self.fname)
+        curves = self._hazard_curves(self.sources, self.fname)
+        self._assert_same_as_hazard_curves(curves)
+
+    def test_wrong_checkpoint(self):
+        self._hazard_curves(self.sources[:1], self.fname)
+        self.imts[imt.PGA()] = [0.01, 0.1]
+        with self.assertRaises(ValueError) as ve:
+            self._hazard_curves(self.sources, self.fname)
+        self.assertEqual(
+            str(ve.exception), 'checkpoint file %s was saved for different '
+            'levels of PGA' % self.fname)
+
+
+class HazardCurvesPerSourceTestCase(_PointSourcesMixin, unittest.TestCase):
+    def setUp(self):
+        super(HazardCurvesPerSourceTestCase, self).setUp()
+        self.source_site_filter = filters.source_site_distance_filter(60)
+        self.rupture_site_filter = filters.rupture_site_distance_filter(60)
+        # a source can be repeated
+        self.sources.append(self.sources[0])
+
+    def _contributions(self, **kwargs):
+        return list(hazard_curves_per_source(
+            self.sources, self.sites, self.imts, self.gsims, 3,
+            self.source_site_filter, self.rupture_site_filter, **kwargs))
+
+    def test_same_as_hazard_curves(self):
+        curves = dict((imt, numpy.ones([4, len(self.imts[imt])]))
+                      for imt in self.imts)
+        contributions = self._contributions(curves=curves)
+        self.assertEqual([source_id for source_id, _, _ in contributions],
+                         ['point%d' % i for i in range(7)] + ['point0'])
+        expected = hazard_curves(
+            self.sources, self.sites, self.imts, self.gsims, 3,
+            self.source_site_filter, self.rupture_site_filter)
+        for imt in self.imts:
+            numpy.testing.assert_allclose(1 - curves[imt], expected[imt])
+            product = numpy.prod(
+                [pnos[imt] for _, _, pnos in contributions], axis=0)
+            numpy.testing.assert_allclose(1 - product, expected[imt])
+
+    def test_single_source(self):
+        for i, (source_id, indices, pnos) in enumerate(
+                self._contributions()):
+            expected = hazard_curves(
+                [self.sources[i]], self.sites, self.imts, self.gsims, 3,
+                self.source_site_filter, self.rupture_site_filter)
+            for imt in self.imts:
+                numpy.testing.assert_allclose(1 - pnos[imt], expected[imt])
+
+    def test_sparse(self):
+        dense = self._contributions()
+        sparse = self._contributions(sparse=True)
+        # the last two sites are too far from the first source
+        self.assertEqual(sparse[0][1].tolist(), [0, 1])
+        for (_, indices, pnos), (_, _, full_pnos) in zip(sparse, dense):
+            for imt in self.imts:
+                self.assertEqual(len(pnos[imt]), len(indices))
+                numpy.testing.assert_allclose(
+                    pnos[imt], full_pnos[imt][indices])
+                numpy.testing.assert_allclose(
+                    numpy.delete(full_pnos[imt], indices, axis=0), 1)
+
+
+class HazardCurvesPerTimeSpanTestCase(_PointSourcesMixin,
+                                      unittest.TestCase):
+    def _hazard_curves(self, sources, time_span=None):
+        if time_span is not None:
+            for source in sources:
+                source.temporal_occurrence_model = PoissonTOM(time_span)
+        return hazard_curves(
+            sources, self.sites, self.imts, self.gsims, 3,
+            filters.source_site_distance_filter(60),
+            filters.rupture_site_distance_filter(60))
+
+    def test_same_as_hazard_curves(self):
+        curves = hazard_curves_per_time_span(
+            self.sources, self.sites, self.imts, self.gsims, 3, [1, 0.5, 2],
+            filters.source_site_distance_filter(60),
+            filters.rupture_site_distance_filter(60))
+        self.assertEqual(len(curves), 3)
+        for time_span, ts_curves in zip([1, 0.5, 2], curves):
+            expected = self._hazard_curves(self.sources, time_span)
+            for imt in self.imts:
+                numpy.testing.assert_allclose(ts_curves[imt], expected[imt])
+
+    def test_non_parametric(self):
+        surface = PlanarSurface(
+            mesh_spacing=2., strike=0, dip=90,
+            top_left=Point(10., 9.9, 0.), top_right=Point(10., 10.1, 0.),
+            bottom_right=Point(10., 10.1, 10.),
+            bottom_left=Point(10., 9.9, 10.))
+        rupture = Rupture(
+            mag=6., rake=0., tectonic_region_type='ASC',
+            hypocenter=Point(10., 10., 5.), surface=surface,
+            source_typology=None)
+        npss = NonParametricSeismicSource(
+            source_id='np', name='np',
+            tectonic_region_type=const.TRT.ACTIVE_SHALLOW_CRUST,
+            data=[(rupture, PMF([(Decimal('0.8'), 0), (Decimal('0.2'), 1)]))])
+        curves = hazard_curves_per_time_span(
+            self.sources + [npss], self.sites, self.imts, self.gsims, 3,
+            [1, 2], filters.source_site_distance_filter(60),
+            filters.rupture_site_distance_filter(60))
+        np_curves = self._hazard_curves([npss])
+        for time_span, ts_curves in zip([1, 2], curves):
+            expected = self._hazard_curves(self.sources, time_span)
+            for imt in self.imts:
+                # the non-parametric probabilities do not depend
+                # on the time span
+                numpy.testing.assert_allclose(
+                    ts_curves[imt],
+                    1 - (1 - expected[imt]) * (1 - np_curves[imt]))
+                self.assertTrue((np_curves[imt][0] > 0).all())
+
+
+class HazardCurvesPerGsimTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sources = _point_sources(5, [const.TRT.ACTIVE_SHALLOW_CRUST,
+                                          const.TRT.STABLE_CONTINENTAL])
+        self.sites = SiteCollection([
+            Site(Point(10.1, 10), 760, True, 100, 5),
+            Site(Point(10, 10.5), 400, True, 100, 5),
+            Site(Point(12, 10), 760, True, 100, 5)])
+        self.gsims = {
+            const.TRT.ACTIVE_SHALLOW_CRUST: [SadighEtAl1997(),
+                                             BooreAtkinson2008()],
+            const.TRT.STABLE_CONTINENTAL: [BooreAtkinson2008()]}
+        self.imts = {imt.PGA(): [0.01, 0.1, 0.5],
+                     imt.SA(0.2, 5): [0.01, 0.1]}
+
+    def _hazard_curves(self, gsim_indices):
+        # curves computed by hazard_curves for a logic tree realization
+        gsims = dict((trt, self.gsims[trt][gsim_indices[trt]])
+                     for trt in self.gsims)
+        return hazard_curves(
+            self.sources, self.sites, self.imts, gsims, 3,
+            filters.source_site_distance_filter(60),
+            filters.rupture_site_distance_filter(60))
+
+    def test_same_as_hazard_curves(self):
+        curves = hazard_curves_per_gsim(
+            self.sources, self.sites, self.imts, self.gsims, 3,
+            filters.source_site_distance_filter(60),
+            filters.rupture_site_distance_filter(60))
+        self.assertEqual(sorted(curves), sorted(self.gsims))
+        asc = const.TRT.ACTIVE_SHALLOW_CRUST
+        scr = const.TRT.STABLE_CONTINENTAL
+        for i in range(2):
+            expected = self._hazard_curves({asc: i, scr: 0})
+            for imt in self.imts:
+                # the sources of different tectonic region types
+                # are independent
+                numpy.testing.assert_allclose(
+                    1 - (1 - curves[asc][i][imt]) * (1 - curves[scr][0][imt]),
+                    expected[imt])
+                # the last site is too far from all the sources
+                self.assertEqual(curves[asc][i][imt][2].tolist(),
+                                 [0] * len(self.imts[imt]))
+
+    def test_shared_distances(self):
+        # CauzziFaccioli2008 clips the hypocentral distances it shares
+        # with BergeThierryEtAl2003SIGMA
+        asc = const.TRT.ACTIVE_SHALLOW_CRUST
+        sources = [source for source in self.sources
+                   if source.tectonic_region_type == asc]
+        gsims = {asc: [CauzziFaccioli2008(), BergeThierryEtAl2003SIGMA()]}
+        curves = hazard_curves_per_gsim(
+            sources, self.sites, self.imts, gsims, 3,
+            filters.source_site_distance_filter(60),
+            filters.rupture_site_distance_filter(60))
+        for gsim, gsim_curves in zip(gsims[asc], curves[asc]):
+            expected = hazard_curves(
+                sources, self.sites, self.imts, {asc: gsim}, 3,
+                filters.source_site_distance_filter(60),
+                filters.rupture_site_distance_filter(60))
+            for imt in self.imts:
+                numpy.testing.assert_allclose(gsim_curves[imt],
+                                              expected[imt])
+                self.assertTrue((gsim_curves[imt][0] > 0).all())
+
+    def test_mean_hazard_curves(self):
+        curves = hazard_curves_per_gsim(
+            self.sources, self.sites, self.imts, self.gsims, 3,
+            filters.source_site_distance_filter(60),
+            filters.rupture_site_distance_filter(60))
+        asc = const.TRT.ACTIVE_SHALLOW_CRUST
+        scr = const.TRT.STABLE_CONTINENTAL
+        mean = mean_hazard_curves(curves, {asc: [0.3, 0.7], scr: [1]})
+        expected0 = self._hazard_curves({asc: 0, scr: 0})
+        expected1 = self._hazard_curves({asc: 1, scr: 0})
+        for imt in self.imts:
+            numpy.testing.assert_allclose(
+                mean[imt], 0.3 * expected0[imt] + 0.7 * expected1[imt])
+
+    def test_mean_hazard_curves_wrong_weights(self):
+        asc = const.TRT.ACTIVE_SHALLOW_CRUST
+        curves = {asc: [{imt.PGA(): numpy.zeros((1, 2)) + 0.1}] * 2}
+        with self.assertRaises(ValueError) as ve:
+            mean_hazard_curves(curves, {asc: [1]})
+        self.assertEqual(ve.exception.message,
+                         '1 weights given for 2 GSIMs of %s' % asc)
+        with self.assertRaises(ValueError) as ve:
+            mean_hazard_curves(curves, {asc: [0.5, 0.6]})
+        self.assertEqual(ve.exception.message,
+                         'the weights of %s do not sum up to 1' % asc)
@@ -0,0 +1,107 @@
+# The Hazard Library
+# Copyright (C) 2012-2014, GEM Foundation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import unittest
+
+import numpy
+from numpy.testing import assert_allclose
+
+from openquake.hazardlib.imt import PGA, PGV, SA
+from openquake.hazardlib.calc.hazard_map import (
+    compute_hazard_maps, hazard_maps, uniform_hazard_spectra, MIN_POE)
+
+
+class ComputeHazardMapsTestCase(unittest.TestCase):
+    IMLS = [0.005, 0.007, 0.0098, 0.0137, 0.0192, 0.0269]
+    CURVES = [
+        [0.9999, 0.9996, 0.9948, 0.8938, 0.5214, 0.1538],
+        [0.9999, 0.9999, 0.9965, 0.9300, 0.6140, 0.2000],
+        [0.5, 0.4, 0.0, 0.0, 0.0, 0.0],
+    ]
+
+    def _expected(self, curves, poes):
+        # interpolate the curves one at a time
+        log_imls = numpy.log(self.IMLS)
+        return numpy.array([
+            [numpy.exp(numpy.interp(
+                numpy.log(poe),
+                numpy.log(numpy.maximum(curve, MIN_POE))[::-1],
+                log_imls[::-1])) for poe in poes]
+            for curve in curves])
+
+    def test_same_as_interp(self):
+        poes = [0.99, 0.95, 0.6, 0.45, 0.2, 0.1, 1E-5]
+        maps = compute_hazard_maps(self.CURVES, self.IMLS, poes)
+        self.assertEqual(maps.shape, (3, 7))
+        assert_allclose(maps, self._expected(self.CURVES, poes))
+
+    def test_levels_of_the_curve(self):
+        maps = compute_hazard_maps(self.CURVES[:1], self.IMLS,
+                                   self.CURVES[0][1:-1])
+        assert_allclose(maps[0], self.IMLS[1:-1])
+
+    def test_out_of_range(self):
+        maps = compute_hazard_maps(self.CURVES, self.IMLS, [1, 0.01])
+        assert_allclose(maps[:, 0], self.IMLS[0])
+        assert_allclose(maps[:2, 1], self.IMLS[-1])
+        # the zero probabilities are interpolated as very small ones
+        self.assertTrue(self.IMLS[1] < maps[2, 1] < self.IMLS[2])
+
+    def test_chunks(self):
+        numpy.random.seed(42)
+        curves = numpy.sort(numpy.random.random((50, 6)), axis=1)[:, ::-1]
+        poes = [0.9, 0.5, 0.1]
+        maps = compute_hazard_maps(curves, self.IMLS, poes,
+                                   sites_per_chunk=7)
+        numpy.testing.assert_array_equal(
+            maps, compute_hazard_maps(curves, self.IMLS, poes))
+        assert_allclose(maps, self._expected(curves, poes))
+
+    def test_wrong_poes(self):
+        with self.assertRaises(ValueError) as ve:
+            compute_hazard_maps(self.CURVES, self.IMLS, [0.1, 0])
+        self.assertEqual(str(ve.exception), 'poes must be positive')
+
+
+class UniformHazardSpectraTestCase(unittest.TestCase):
+    def setUp(self):
+        imls = [0.01, 0.1, 1]
+        self.imts = {PGA(): imls, SA(1.0): imls, SA(0.2): imls, PGV(): imls}
+        self.curves = {
+            PGA(): numpy.array([[0.5, 0.1, 0.01], [0.2, 0.1, 0.05]]),
+            SA(0.2): numpy.array([[0.8, 0.3, 0.02], [0.3, 0.2, 0.1]]),
+            SA(1.0): numpy.array([[0.4, 0.05, 0.001], [0.1, 0.01, 0.]]),
+            PGV(): numpy.array([[0.1, 0.01, 0.001], [0.1, 0.01, 0.]])}
+
+    def test_hazard_maps(self):
+        maps = hazard_maps(self.curves, self.imts, [0.1, 0.02])
+        self.assertEqual(sorted(maps), sorted(self.imts))
+        assert_allclose(maps[PGA()][0], [0.1, 0.1 * 10 ** (
+            numpy.log(0.1 / 0.02) / numpy.log(0.1 / 0.01))])
+        assert_allclose(maps[SA(0.2)][0, 1], 1)
+
+    def test_uhs(self):
+        periods, spectra = uniform_hazard_spectra(
+            self.curves, self.imts, [0.1, 0.02])
+        assert_allclose(periods, [0, 0.2, 1.0])
+        self.assertEqual(spectra.shape, (2, 2, 3))
+        maps = hazard_maps(self.curves, self.imts, [0.1, 0.02])
+        for i, imt in enumerate([PGA(), SA(0.2), SA(1.0)]):
+            assert_allclose(spectra[:, :, i], maps[imt])
+
+    def test_no_spectral_accelerations(self):
+        with self.assertRaises(ValueError):
+            uniform_hazard_spectra({PGV(): self.curves[PGV()]},
+                                   self.imts, [0.1])
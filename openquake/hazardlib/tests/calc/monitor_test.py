@@ -0,0 +1,91 @@
+# The Hazard Library
+# Copyright (C) 2012-2014, GEM Foundation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import json
+import time
+import unittest
+
+from openquake.hazardlib.calc.monitor import Monitor, DummyMonitor
+
+
+def _slow_range(n, delay):
+    for i in range(n):
+        time.sleep(delay)
+        yield i
+
+
+class MonitorTestCase(unittest.TestCase):
+    def test_stages_and_counters(self):
+        monitor = Monitor()
+        for _ in range(3):
+            with monitor('stage', 'src1'):
+                pass
+        monitor.count('items', 2, 'src1')
+        monitor.count('items', 3)
+        self.assertEqual(monitor.stages['stage']['calls'], 3)
+        self.assertEqual(monitor.counters, {'items': 5})
+        self.assertEqual(monitor.sources['src1']['counters'], {'items': 2})
+        self.assertEqual(
+            monitor.sources['src1']['stages']['stage']['calls'], 3)
+
+    def test_nested_stages_are_exclusive(self):
+        monitor = Monitor()
+        with monitor('outer'):
+            time.sleep(0.05)
+            with monitor('inner'):
+                time.sleep(0.1)
+        self.assertLess(monitor.stages['outer']['wall_time'], 0.09)
+        self.assertGreaterEqual(monitor.stages['inner']['wall_time'], 0.09)
+
+    def test_iterate(self):
+        monitor = Monitor()
+        items = monitor.iterate(
+            monitor.iterate(_slow_range(3, 0.02), 'inner', 'src', 'inner'),
+            'outer', counter='outer')
+        self.assertEqual(list(items), [0, 1, 2])
+        # one call more for the StopIteration
+        self.assertEqual(monitor.stages['inner']['calls'], 4)
+        self.assertEqual(monitor.stages['outer']['calls'], 4)
+        self.assertEqual(monitor.counters, {'inner': 3, 'outer': 3})
+        self.assertGreaterEqual(monitor.stages['inner']['wall_time'], 0.05)
+        self.assertLess(monitor.stages['outer']['wall_time'], 0.05)
+        self.assertEqual(sorted(monitor.sources), ['src'])
+
+    def test_errors(self):
+        monitor = Monitor()
+        with self.assertRaises(ZeroDivisionError):
+            with monitor('outer'):
+                with monitor('inner'):
+                    1 / 0
+        self.assertEqual(monitor._inner_times, [])
+        self.assertEqual(sorted(monitor.stages), ['inner', 'outer'])
+
+    def test_to_json(self):
+        monitor = Monitor()
+        with monitor('stage', 'src'):
+            monitor.count('items', 1, 'src')
+        report = json.loads(monitor.to_json())
+        self.assertEqual(sorted(report), ['counters', 'sources', 'stages'])
+        self.assertEqual(report['stages']['stage']['calls'], 1)
+        self.assertEqual(report['sources']['src']['counters'], {'items': 1})
+
+
+class DummyMonitorTestCase(unittest.TestCase):
+    def test(self):
+        monitor = DummyMonitor()
+        items = [1, 2]
+        self.assertIs(monitor.iterate(items, 'stage'), items)
+        with monitor('stage', 'src'):
+            monitor.count('items', 1, 'src')
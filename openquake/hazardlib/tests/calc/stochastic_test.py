@@ -15,7 +15,11 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import unittest
 
-from openquake.hazardlib.calc.stochastic import stochastic_event_set
+import numpy
+
+from openquake.hazardlib.calc.stochastic import (
+    stochastic_event_set, random_state)
+from openquake.hazardlib.calc.monitor import Monitor
 
 
 class StochasticEventSetTestCase(unittest.TestCase):
@@ -23,8 +27,11 @@ class StochasticEventSetTestCase(unittest.TestCase):
         def __init__(self, occurrences):
             self.occurrences = occurrences
 
-        def sample_number_of_occurrences(self):
-            return self.occurrences
+        def sample_number_of_occurrences(self, rng=None):
+            if rng is None:
+                return self.occurrences
+            # the occurrences are the expected value of the sample
+            return rng.poisson(self.occurrences)
 
     class FakeSource(object):
         def __init__(self, source_id, ruptures):
@@ -56,6 +63,19 @@ class StochasticEventSetTestCase(unittest.TestCase):
             ))
         self.assertEqual(ses, [self.r1_1, self.r1_2, self.r1_2, self.r2_1])
 
+    def test_monitor(self):
+        monitor = Monitor()
+        ses = list(stochastic_event_set(
+            [self.source1, self.source2], [1, 2, 3], monitor=monitor))
+        self.assertEqual(ses, [self.r1_1, self.r1_2, self.r1_2, self.r2_1])
+        self.assertEqual(sorted(monitor.stages), [
+            'iter_ruptures', 'rupture_filtering', 'sampling',
+            'source_filtering'])
+        self.assertEqual(monitor.counters, {
+            'sources': 2, 'ruptures': 4, 'filtered_ruptures': 4})
+        self.assertEqual(monitor.sources[1]['counters']['ruptures'], 3)
+        self.assertEqual(monitor.sources[1]['stages']['sampling']['calls'], 3)
+
     def test_filter(self):
         def extract_first_source(sources_sites):
             for source, _sites in sources_sites:
@@ -116,3 +136,64 @@ class StochasticEventSetTestCase(unittest.TestCase):
             'An error occurred with source id=2. Error: Something bad happened'
         )
         self.assertEqual(expected_error, ae.exception.message)
+
+
+class RandomStateTestCase(unittest.TestCase):
+    def test_same_keys(self):
+        self.assertEqual(random_state(42, 'src', 3).random_sample(5).tolist(),
+                         random_state(42, 'src', 3).random_sample(5).tolist())
+
+    def test_different_keys(self):
+        samples = [random_state(*keys).random_sample(5).tolist()
+                   for keys in [(42, 'src', 3), (43, 'src', 3),
+                                (42, 'src2', 3), (42, 'src', 4), (42, 'src')]]
+        for i, sample in enumerate(samples):
+            for other in samples[i + 1:]:
+                self.assertNotEqual(sample, other)
+
+    def test_global_state_untouched(self):
+        state = numpy.random.get_state()
+        random_state(42, 'src', 3).random_sample(5)
+        self.assertEqual(numpy.random.get_state()[1].tolist(),
+                         state[1].tolist())
+
+
+class StochasticEventSetSeedTestCase(unittest.TestCase):
+    FakeRupture = StochasticEventSetTestCase.FakeRupture
+    FakeSource = StochasticEventSetTestCase.FakeSource
+
+    def setUp(self):
+        self.sources = [
+            self.FakeSource('src%d' % i, [self.FakeRupture(2)
+                                          for _ in range(20)])
+            for i in range(4)]
+
+    def _ses(self, sources, **kwargs):
+        return [(source.source_id, source.ruptures.index(rupture))
+                for source in sources
+                for rupture in stochastic_event_set([source], **kwargs)]
+
+    def test_independent_of_chunking(self):
+        ses = self._ses(self.sources, seed=42)
+        self.assertGreater(len(ses), 0)
+        # the sources are processed separately and in reverse order,
+        # with the global generator in a different state
+        numpy.random.seed(1)
+        ses_by_source = {}
+        for source in reversed(self.sources):
+            ses_by_source[source.source_id] = self._ses([source], seed=42)
+        self.assertEqual(
+            sum([ses_by_source[source.source_id]
+                 for source in self.sources], []), ses)
+        self.assertNotEqual(self._ses(self.sources, seed=43), ses)
+
+    def test_independent_of_filtering(self):
+        def drop_odd_ruptures(ruptures_sites):
+            for i, (rupture, sites) in enumerate(ruptures_sites):
+                if i % 2 == 0:
+                    yield rupture, sites
+        ses = self._ses(self.sources, seed=42)
+        filtered_ses = self._ses(self.sources, seed=42, sites=[1, 2, 3],
+                                 rupture_site_filter=drop_odd_ruptures)
+        self.assertEqual(filtered_ses,
+                         [(src, i) for src, i in ses if i % 2 == 0])
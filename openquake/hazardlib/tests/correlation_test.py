@@ -13,12 +13,14 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import pickle
 import unittest
 
 import numpy
 
 from openquake.hazardlib.imt import SA, PGA
-from openquake.hazardlib.correlation import JB2009CorrelationModel
+from openquake.hazardlib.correlation import (
+    JB2009CorrelationModel, NearestNeighboursFactor, _get_preceding_neighbours)
 from openquake.hazardlib.site import Site, SiteCollection
 from openquake.hazardlib.geo import Point
 
@@ -134,3 +136,181 @@ class JB2009ApplyCorrelationTestCase(unittest.TestCase):
         actual_corrcoef = cormo._get_correlation_matrix(self.SITECOL, PGA())
         numpy.testing.assert_almost_equal(inferred_corrcoef, actual_corrcoef,
                                           decimal=2)
+
+
+class JB2009CorrelationCacheTestCase(unittest.TestCase):
+    SITECOL = SiteCollection([Site(Point(2, -40), 1, True, 1, 1),
+                              Site(Point(2, -40.1), 1, True, 1, 1),
+                              Site(Point(2.1, -40), 1, True, 1, 1),
+                              Site(Point(2, -39.9), 1, True, 1, 1)])
+
+    def test_same_sites_and_imt(self):
+        cormo = JB2009CorrelationModel(vs30_clustering=False)
+        lt1 = cormo.get_lower_triangle_correlation_matrix(self.SITECOL, PGA())
+        lt2 = cormo.get_lower_triangle_correlation_matrix(self.SITECOL, PGA())
+        self.assertIs(lt1, lt2)
+        lt3 = cormo.get_lower_triangle_correlation_matrix(
+            self.SITECOL, SA(period=0.5, damping=5))
+        self.assertIsNot(lt1, lt3)
+
+    def test_filtered_sites(self):
+        cormo = JB2009CorrelationModel(vs30_clustering=True)
+        imt = SA(period=0.5, damping=5)
+        sites = self.SITECOL.filter(numpy.array([True, False, True, True]))
+        lt = cormo.get_lower_triangle_correlation_matrix(sites, imt)
+        # the distances are taken from the matrix of the complete collection
+        self.assertIs(cormo._distances[0], self.SITECOL)
+        expected = numpy.linalg.cholesky(cormo._get_correlation_model(
+            sites.mesh.get_distance_matrix(), imt))
+        aaae(lt, expected)
+        # the same subset filtered again gives the cached matrix
+        sites2 = self.SITECOL.filter(numpy.array([True, False, True, True]))
+        self.assertIs(cormo.get_lower_triangle_correlation_matrix(sites2, imt),
+                      lt)
+        # a different subset does not
+        sites3 = self.SITECOL.filter(numpy.array([True, True, False, True]))
+        lt3 = cormo.get_lower_triangle_correlation_matrix(sites3, imt)
+        expected = numpy.linalg.cholesky(cormo._get_correlation_model(
+            sites3.mesh.get_distance_matrix(), imt))
+        aaae(lt3, expected)
+
+    def test_too_many_sites(self):
+        cormo = JB2009CorrelationModel(vs30_clustering=False,
+                                       max_cached_sites=3)
+        sites = self.SITECOL.filter(numpy.array([True, False, True, True]))
+        lt = cormo.get_lower_triangle_correlation_matrix(sites, PGA())
+        self.assertIsNone(cormo._distances)
+        expected = numpy.linalg.cholesky(cormo._get_correlation_model(
+            sites.mesh.get_distance_matrix(), PGA()))
+        aaae(lt, expected)
+
+    def test_bounded(self):
+        cormo = JB2009CorrelationModel(vs30_clustering=False, cache_size=2)
+        imts = [SA(period=period, damping=5) for period in (0.1, 0.2, 0.3)]
+        lts = [cormo.get_lower_triangle_correlation_matrix(self.SITECOL, imt)
+               for imt in imts]
+        self.assertEqual(len(cormo._factors), 2)
+        # the least recently used matrix has been discarded
+        self.assertIsNot(
+            cormo.get_lower_triangle_correlation_matrix(self.SITECOL, imts[0]),
+            lts[0])
+        self.assertIs(
+            cormo.get_lower_triangle_correlation_matrix(self.SITECOL, imts[2]),
+            lts[2])
+
+    def test_bounded_bytes(self):
+        # room for two matrices of four sites
+        cormo = JB2009CorrelationModel(vs30_clustering=False,
+                                       max_cache_bytes=2 * 16 * 8)
+        imts = [SA(period=period, damping=5) for period in (0.1, 0.2, 0.3)]
+        lts = [cormo.get_lower_triangle_correlation_matrix(self.SITECOL, imt)
+               for imt in imts]
+        self.assertEqual(len(cormo._factors), 2)
+        self.assertEqual(cormo._cached_bytes, 2 * 16 * 8)
+        # the least recently used matrix has been discarded
+        self.assertIsNot(
+            cormo.get_lower_triangle_correlation_matrix(self.SITECOL, imts[0]),
+            lts[0])
+        self.assertIs(
+            cormo.get_lower_triangle_correlation_matrix(self.SITECOL, imts[2]),
+            lts[2])
+
+    def test_too_large_to_cache(self):
+        cormo = JB2009CorrelationModel(vs30_clustering=False,
+                                       max_cache_bytes=16 * 8 - 1)
+        small = self.SITECOL.filter(numpy.array([True, False, True, True]))
+        lt = cormo.get_lower_triangle_correlation_matrix(small, PGA())
+        self.assertEqual(len(cormo._factors), 1)
+        # the matrix of the four sites does not fit and evicts nothing
+        lt4 = cormo.get_lower_triangle_correlation_matrix(self.SITECOL, PGA())
+        self.assertIsNot(
+            cormo.get_lower_triangle_correlation_matrix(self.SITECOL, PGA()),
+            lt4)
+        self.assertEqual(cormo._factors.values()[0][1].tolist(), lt.tolist())
+        self.assertEqual(cormo._cached_bytes, 9 * 8)
+
+    def test_pickle(self):
+        cormo = JB2009CorrelationModel(vs30_clustering=False)
+        cormo.get_lower_triangle_correlation_matrix(self.SITECOL, PGA())
+        cormo2 = pickle.loads(pickle.dumps(cormo))
+        self.assertEqual(cormo2.vs30_clustering, False)
+        self.assertEqual(len(cormo2._factors), 0)
+        self.assertIsNone(cormo2._distances)
+
+
+class NearestNeighboursFactorTestCase(unittest.TestCase):
+    def setUp(self):
+        rnd = numpy.random.RandomState(1)
+        self.sites = SiteCollection([
+            Site(Point(lon, lat), 760, True, 1, 1)
+            for lon, lat in zip(rnd.uniform(0, 0.5, 50),
+                                rnd.uniform(0, 0.5, 50))])
+        self.cormo = JB2009CorrelationModel(vs30_clustering=False)
+        self.corma = numpy.asarray(
+            self.cormo._get_correlation_matrix(self.sites, PGA()))
+
+    def _get_covariance(self, num_neighbours):
+        factor = NearestNeighboursFactor(
+            self.sites, lambda distances: self.cormo._get_correlation_model(
+                distances, PGA()), num_neighbours)
+        # the columns are the correlated residuals of unit vectors
+        lt = factor.apply(numpy.eye(len(self.sites)))
+        return numpy.dot(lt, lt.T)
+
+    def test_exact(self):
+        aaae(self._get_covariance(num_neighbours=49), self.corma, decimal=6)
+
+    def test_approximate(self):
+        error = abs(self._get_covariance(num_neighbours=10) - self.corma)
+        self.assertLess(error.max(), 0.01)
+        error_fewer = abs(self._get_covariance(num_neighbours=5) - self.corma)
+        self.assertGreater(error_fewer.max(), error.max())
+
+    def test_apply_correlation(self):
+        cormo = JB2009CorrelationModel(vs30_clustering=False,
+                                       max_dense_sites=10)
+        residuals = numpy.random.RandomState(13).normal(size=(50, 20000))
+        correlated = cormo.apply_correlation(self.sites, PGA(), residuals)
+        [(kind, _, _, _)] = cormo._factors
+        self.assertEqual(kind, 'sparse')
+        self.assertAlmostEqual(correlated.mean(), 0, delta=0.01)
+        self.assertAlmostEqual(correlated.std(), 1, delta=0.01)
+        inferred_corrcoef = numpy.corrcoef(correlated)
+        self.assertLess(abs(inferred_corrcoef - self.corma).max(), 0.05)
+
+    def test_nbytes(self):
+        cormo = JB2009CorrelationModel(vs30_clustering=False,
+                                       max_dense_sites=10, num_neighbours=5)
+        cormo.apply_correlation(self.sites, PGA(), numpy.zeros((50, 1)))
+        [(_, factor)] = cormo._factors.values()
+        # much less than the dense factor of the 50 sites
+        self.assertLess(factor.nbytes, 50 * 50 * 8 / 2)
+        self.assertEqual(cormo._cached_bytes, factor.nbytes)
+        # a budget smaller than the factor keeps nothing
+        cormo = JB2009CorrelationModel(vs30_clustering=False,
+                                       max_dense_sites=10, num_neighbours=5,
+                                       max_cache_bytes=factor.nbytes - 1)
+        cormo.apply_correlation(self.sites, PGA(), numpy.zeros((50, 1)))
+        self.assertEqual(len(cormo._factors), 0)
+        self.assertEqual(cormo._cached_bytes, 0)
+
+    def test_preceding_neighbours(self):
+        points = numpy.random.RandomState(42).uniform(size=(300, 3))
+        neighbours = _get_preceding_neighbours(points, 4)
+        self.assertEqual(neighbours.shape, (300, 4))
+        self.assertEqual(neighbours[:5].tolist(), [[-1, -1, -1, -1],
+                                                   [0, -1, -1, -1],
+                                                   [0, 1, -1, -1],
+                                                   [0, 1, 2, -1],
+                                                   [0, 1, 2, 3]])
+        for i in xrange(5, 300):
+            distances = ((points[:i] - points[i]) ** 2).sum(axis=1)
+            self.assertEqual(neighbours[i].tolist(),
+                             numpy.argsort(distances)[:4].tolist())
+
+    def test_preceding_neighbours_few_points(self):
+        self.assertEqual(
+            _get_preceding_neighbours(numpy.zeros((1, 3)), 4).shape, (1, 0))
+        self.assertEqual(
+            _get_preceding_neighbours(numpy.zeros((3, 3)), 4).tolist(),
+            [[-1, -1], [0, -1], [0, 1]])
@@ -18,6 +18,7 @@ import unittest
 import numpy
 
 from openquake.hazardlib.geo.point import Point
+from openquake.hazardlib.geo.geodetic import geodetic_distance
 from openquake.hazardlib.geo.mesh import Mesh, RectangularMesh
 from openquake.hazardlib.geo.surface.base import BaseQuadrilateralSurface
 
@@ -286,6 +287,28 @@ class GetBoundingBoxTestCase(unittest.TestCase):
         self.assertEqual(-0.3, south)
 
 
+class GetBoundingCircleTestCase(unittest.TestCase):
+    def test_get_bounding_circle(self):
+        corners = [[(0.0, 0.0, 0.0), (0.1, 0.2, 0.0)],
+                   [(0.05, -0.3, 10.0), (0.3, 0.05, 10.0)]]
+        surface = DummySurface(corners)
+        lon, lat, radius = surface.get_bounding_circle()
+        self.assertAlmostEqual(0.15, lon, places=5)
+        self.assertAlmostEqual(-0.05, lat, places=5)
+        mesh = surface.get_mesh()
+        dists = geodetic_distance(lon, lat, mesh.lons, mesh.lats)
+        self.assertAlmostEqual(dists.max(), radius)
+        # all the points of the mesh are used, not just the corners
+        self.assertLess(radius, geodetic_distance(lon, lat, 0.3, 0.2))
+
+    def test_cached(self):
+        corners = [[(0.0, 0.0, 0.0), (0.1, 0.2, 0.0)],
+                   [(0.05, -0.3, 10.0), (0.3, 0.05, 10.0)]]
+        surface = DummySurface(corners)
+        self.assertIs(surface.get_bounding_circle(),
+                      surface.get_bounding_circle())
+
+
 class GetMiddlePointTestCase(unittest.TestCase):
     def test_get_middle_point(self):
         corners = [[(0.0, 0.0, 0.0), (0.0, 0.089932, 0.0)],
@@ -554,6 +554,20 @@ class PlanarSurfaceGetBoundingBoxTestCase(unittest.TestCase):
         self.assertEqual(-0.00449661, south)
 
 
+class PlanarSurfaceGetBoundingCircleTestCase(unittest.TestCase):
+    def test(self):
+        corners = [Point(-0.00317958, -0.00449661, 4.64644661),
+                   Point(-0.00317958, 0.00449661, 4.64644661),
+                   Point(0.00317958, 0.00449661, 5.35355339),
+                   Point(0.00317958, -0.00449661, 5.35355339)]
+        surface = PlanarSurface(1, 0.0, 45.0, *corners)
+        lon, lat, radius = surface.get_bounding_circle()
+        self.assertAlmostEqual(0, lon)
+        self.assertAlmostEqual(0, lat)
+        self.assertAlmostEqual(
+            radius, Point(0, 0).distance(Point(0.00317958, 0.00449661)))
+
+
 class PlanarSurfaceGetMiddlePointTestCase(unittest.TestCase):
     def test(self):
         corners = [Point(0.0, 0.0, 0.0), Point(0.0, 0.089932, 0.0),
@@ -223,6 +223,30 @@ class GetMiddlePointTestCase(unittest.TestCase):
         )
 
 
+class GetBoundingCircleTestCase(unittest.TestCase):
+    def test_single_point(self):
+        lon, lat, radius = utils.get_bounding_circle([10], [20])
+        self.assertAlmostEqual(lon, 10)
+        self.assertAlmostEqual(lat, 20)
+        self.assertAlmostEqual(radius, 0)
+
+    def test_encloses_points(self):
+        lons = [10, 10.5, 11, 10.2]
+        lats = [44, 45, 44.2, 44.9]
+        lon, lat, radius = utils.get_bounding_circle(lons, lats)
+        self.assertAlmostEqual(lon, 10.5, places=1)
+        self.assertAlmostEqual(lat, 44.5, places=1)
+        dists = geo.geodetic.geodetic_distance(lon, lat, lons, lats)
+        self.assertAlmostEqual(radius, max(dists))
+        self.assertLess(radius, 70)
+
+    def test_international_date_line(self):
+        lon, lat, radius = utils.get_bounding_circle([179, -179], [0, 0])
+        self.assertAlmostEqual(abs(lon), 180)
+        self.assertAlmostEqual(lat, 0)
+        self.assertAlmostEqual(radius, 111.2, places=1)
+
+
 class SphericalToCartesianAndBackTestCase(unittest.TestCase):
     def _test(self, (lons, lats, depths), vectors):
         res_cart = utils.spherical_to_cartesian(lons, lats, depths)
@@ -18,15 +18,20 @@ import collections
 import mock
 
 import numpy
+from scipy.stats import truncnorm
 
 from openquake.hazardlib import const
 from openquake.hazardlib.gsim.base import (
     GMPE, IPE, SitesContext, RuptureContext, DistancesContext,
-    NotVerifiedWarning)
+    DistancesCache, CoeffsTable, NotVerifiedWarning, _epsilon_bands)
+from openquake.hazardlib.gsim.berge_thierry_2003 import \
+    BergeThierryEtAl2003SIGMA
+from openquake.hazardlib.gsim.cauzzi_faccioli_2008 import CauzziFaccioli2008
 from openquake.hazardlib.geo.mesh import Mesh
 from openquake.hazardlib.geo.point import Point
-from openquake.hazardlib.imt import PGA, PGV
-from openquake.hazardlib.site import Site, SiteCollection
+from openquake.hazardlib.imt import PGA, PGV, SA
+from openquake.hazardlib.site import \
+    Site, SiteCollection, FilteredSiteCollection
 from openquake.hazardlib.source.rupture import Rupture
 
 
@@ -192,6 +197,57 @@ class GetPoEsTestCase(_FakeGSIMTestCase):
         self.assertAlmostEqual(poe23, 0.5521092)
 
 
+class GetPoEsByIMTTestCase(_FakeGSIMTestCase):
+    def setUp(self):
+        super(GetPoEsByIMTTestCase, self).setUp()
+        self.gsim.DEFINED_FOR_INTENSITY_MEASURE_TYPES.add(SA)
+        self.gsim_class.DEFINED_FOR_STANDARD_DEVIATION_TYPES.add(
+            const.StdDev.TOTAL
+        )
+        means_stddevs = {PGA(): (numpy.array([3., 4.]),
+                                 numpy.array([0.5, 0.6])),
+                         SA(0.1, 5): (numpy.array([2., 5.]),
+                                      numpy.array([0.7, 0.8]))}
+
+        def get_mean_and_stddevs(sites, rup, dists, imt, stddev_types):
+            mean, stddev = means_stddevs[imt]
+            return mean, [stddev for _ in stddev_types]
+        self.gsim.get_mean_and_stddevs = get_mean_and_stddevs
+        self.imts = {PGA(): [2, 3, 4], SA(0.1, 5): [1, 5]}
+
+    def test_get_means_and_stddevs(self):
+        imts = [SA(0.1, 5), PGA()]
+        means, stddevs = self.gsim.get_means_and_stddevs(
+            SitesContext(), RuptureContext(), DistancesContext(), imts,
+            [const.StdDev.TOTAL])
+        numpy.testing.assert_equal(means, [[2, 5], [3, 4]])
+        numpy.testing.assert_equal(stddevs, [[[0.7, 0.8]], [[0.5, 0.6]]])
+
+    def test_same_as_get_poes(self):
+        for truncation_level in (None, 0, 2.0):
+            poes = self.gsim.get_poes_by_imt(
+                SitesContext(), RuptureContext(), DistancesContext(),
+                self.imts, truncation_level)
+            self.assertEqual(sorted(poes), sorted(self.imts))
+            for imt in self.imts:
+                numpy.testing.assert_equal(
+                    poes[imt], self._get_poes(imt=imt, imls=self.imts[imt],
+                                              truncation_level=
+                                              truncation_level))
+
+    def test_wrong_input(self):
+        err = 'imt PGV is not supported by FakeGSIM'
+        self._assert_value_error(
+            self.gsim.get_poes_by_imt, err, sctx=SitesContext(),
+            rctx=RuptureContext(), dctx=DistancesContext(),
+            imts={PGA(): [1], PGV(): [1]}, truncation_level=1)
+        err = 'truncation level must be zero, positive number or None'
+        self._assert_value_error(
+            self.gsim.get_poes_by_imt, err, sctx=SitesContext(),
+            rctx=RuptureContext(), dctx=DistancesContext(),
+            imts=self.imts, truncation_level=-1)
+
+
 class DisaggregatePoETestCase(_FakeGSIMTestCase):
     def test_zero_poe(self):
         self.gsim_class.DEFINED_FOR_STANDARD_DEVIATION_TYPES.add(
@@ -297,6 +353,41 @@ class DisaggregatePoETestCase(_FakeGSIMTestCase):
                  [0.03467403, 0.23896796, 0.45271601, 0.23896796, 0.03467403]]
         aaae(poes, epoes)
 
+    def test_partition_poe_against_truncnorm(self):
+        truncation_level, n_epsilons = 2.5, 7
+        epsilons = numpy.linspace(- truncation_level, truncation_level,
+                                  n_epsilons + 1)
+        # the standard imls are on both sides of the truncation interval,
+        # inside the bins and exactly on their edges
+        standard_imls = numpy.concatenate([
+            [-numpy.inf, -10, 10, numpy.inf], epsilons,
+            numpy.linspace(-3, 3, 101)])
+        mean = numpy.zeros(len(standard_imls))
+        stddev = numpy.ones(len(standard_imls))
+        poes = self.gsim.partition_poe(mean, stddev, standard_imls,
+                                       truncation_level, n_epsilons)
+        self.assertEqual(poes.shape, (len(standard_imls), n_epsilons))
+
+        distribution = truncnorm(- truncation_level, truncation_level)
+        lower = numpy.maximum(standard_imls[:, None], epsilons[:-1])
+        upper = epsilons[1:]
+        expected = numpy.where(lower < upper,
+                               distribution.cdf(upper)
+                               - distribution.cdf(numpy.minimum(lower, upper)),
+                               0)
+        numpy.testing.assert_array_almost_equal(poes, expected)
+        numpy.testing.assert_array_almost_equal(
+            poes.sum(axis=1), distribution.sf(standard_imls))
+
+    def test_epsilon_bands_cached(self):
+        bands = _epsilon_bands(3, 6)
+        self.assertIs(_epsilon_bands(3, 6), bands)
+        self.assertIsNot(_epsilon_bands(3, 5), bands)
+        lower, upper, cdf_upper, z = bands
+        numpy.testing.assert_array_almost_equal(lower, [-3, -2, -1, 0, 1, 2])
+        numpy.testing.assert_array_almost_equal(upper, [-2, -1, 0, 1, 2, 3])
+        self.assertRaises(ValueError, lower.__setitem__, 0, 1)
+
 
 class TGMPE(GMPE):
     DEFINED_FOR_TECTONIC_REGION_TYPE = None
@@ -504,6 +595,78 @@ class MakeContextsTestCase(_FakeGSIMTestCase):
                           'get_joyner_boore_distance': 1,
                           'get_strike': 1})
 
+    def test_distances_cache(self):
+        self.gsim_class.REQUIRES_DISTANCES = set('rjb rrup'.split())
+        sites = SiteCollection([self.site1, self.site2])
+        cache = DistancesCache()
+        _, _, dctx1 = self.gsim.make_contexts(sites, self.rupture, cache)
+        self.gsim_class.REQUIRES_DISTANCES = set('rjb rx'.split())
+        _, _, dctx2 = self.gsim.make_contexts(sites, self.rupture, cache)
+        self.assertIs(dctx1.rjb, dctx2.rjb)
+        self.assertTrue((dctx2.rx == [4, 5]).all())
+        self.assertEqual(self.fake_surface.call_counts,
+                         {'get_joyner_boore_distance': 1,
+                          'get_min_distance': 1, 'get_rx_distance': 1})
+
+        # a filtered collection with the same sites shares the distances
+        filtered = FilteredSiteCollection(numpy.array([0, 1]), sites)
+        self.gsim.make_contexts(filtered, self.rupture, cache)
+        self.assertEqual(
+            self.fake_surface.call_counts['get_joyner_boore_distance'], 1)
+
+        # distances are computed again for other sites and other ruptures
+        other_sites = SiteCollection([self.site1, self.site2])
+        self.gsim.make_contexts(other_sites, self.rupture, cache)
+        self.assertEqual(
+            self.fake_surface.call_counts['get_joyner_boore_distance'], 2)
+        other_rupture = Rupture(
+            mag=123.45, rake=123.56,
+            tectonic_region_type=const.TRT.VOLCANIC,
+            hypocenter=self.rupture_hypocenter, surface=self.fake_surface(),
+            source_typology=object()
+        )
+        self.gsim.make_contexts(other_sites, other_rupture, cache)
+        self.assertEqual(
+            self.fake_surface.call_counts['get_joyner_boore_distance'], 3)
+
+
+class SharedDistancesTestCase(unittest.TestCase):
+    def setUp(self):
+        # sites closer to the hypocenter than the minimum distances
+        # of the GSIMs, so that they clip rhypo
+        self.sites = SiteCollection([
+            Site(Point(0, 0), 800, True, 100, 1),
+            Site(Point(0.05, 0), 800, True, 100, 1),
+            Site(Point(0.5, 0), 800, True, 100, 1)])
+        self.rupture = Rupture(
+            mag=6, rake=0, tectonic_region_type=const.TRT.ACTIVE_SHALLOW_CRUST,
+            hypocenter=Point(0, 0, 2), surface=None, source_typology=object())
+        self.gsims = [CauzziFaccioli2008(), BergeThierryEtAl2003SIGMA()]
+
+    def _get_mean(self, gsim, distances_cache=None):
+        sctx, rctx, dctx = gsim.make_contexts(self.sites, self.rupture,
+                                              distances_cache)
+        mean, _ = gsim.get_mean_and_stddevs(sctx, rctx, dctx, PGA(),
+                                            [const.StdDev.TOTAL])
+        return mean
+
+    def test_same_as_standalone(self):
+        expected = [self._get_mean(gsim) for gsim in self.gsims]
+        cache = DistancesCache()
+        for gsim, expected_mean in zip(self.gsims, expected):
+            numpy.testing.assert_array_equal(self._get_mean(gsim, cache),
+                                             expected_mean)
+        self.assertEqual(cache.distances['rhypo'][0], 2)
+
+    def test_read_only(self):
+        cache = DistancesCache()
+        _, _, dctx = self.gsims[0].make_contexts(self.sites, self.rupture,
+                                                 cache)
+        self.assertFalse(dctx.rhypo.flags.writeable)
+        with self.assertRaises(ValueError):
+            dctx.rhypo[0] = 15
+
+
 class ContextTestCase(unittest.TestCase):
     def test_equality(self):
         sctx1 = SitesContext()
@@ -548,6 +711,38 @@ class ContextTestCase(unittest.TestCase):
         self.assertTrue(sctx1 != rctx)
 
 
+class CoeffsTableTestCase(unittest.TestCase):
+    def setUp(self):
+        self.table = CoeffsTable(sa_damping=5, table="""
+            imt   a    b
+            pga   1    2
+            1.0   3    4
+            0.1  10   20
+            10    2    4
+        """)
+
+    def test_sa_array_sorted_by_period(self):
+        numpy.testing.assert_equal(self.table.sa_periods, [0.1, 1.0, 10])
+        numpy.testing.assert_equal(self.table.sa_array['a'], [10, 3, 2])
+
+    def test_interpolation_is_memoized(self):
+        coeffs = self.table[SA(period=0.5, damping=5)]
+        self.assertIs(self.table[SA(period=0.5, damping=5)], coeffs)
+        self.assertAlmostEqual(coeffs['a'], 10 - 7 * numpy.log10(5))
+
+    def test_get_coeffs(self):
+        imts = [SA(period=10, damping=5), PGA(), SA(period=0.5, damping=5)]
+        coeffs = self.table.get_coeffs(imts)
+        self.assertEqual(coeffs.dtype.names, ('a', 'b'))
+        for i, imt in enumerate(imts):
+            self.assertEqual(coeffs['a'][i], self.table[imt]['a'])
+            self.assertEqual(coeffs['b'][i], self.table[imt]['b'])
+
+    def test_get_coeffs_missing_imt(self):
+        with self.assertRaises(KeyError):
+            self.table.get_coeffs([PGA(), SA(period=20, damping=5)])
+
+
 class GsimWarningTestCase(unittest.TestCase):
     def test_deprecated(self):
         # check that a deprecation warning is raised when a deprecated
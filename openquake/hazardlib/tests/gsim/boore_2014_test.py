@@ -20,7 +20,13 @@ GMPE
 Test data are generated from the Fortran implementation provided by
 David M. Boore (Jul, 2014)
 """
+import numpy
+
 import openquake.hazardlib.gsim.boore_2014 as bssa
+from openquake.hazardlib import const
+from openquake.hazardlib.gsim.base import (
+    SitesContext, RuptureContext, DistancesContext)
+from openquake.hazardlib.imt import PGA, PGV, SA
 from openquake.hazardlib.tests.gsim.utils import BaseGSIMTestCase
 
 
@@ -61,6 +67,34 @@ class BooreEtAl2014TestCase(BaseGSIMTestCase):
         self.check(self.INTRA_FILE,
                    max_discrep_percentage=STDDEV_DISCREP)
 
+    def test_get_means_and_stddevs(self):
+        # all the IMTs are computed at once, with the same results of
+        # separate calls
+        gsim = self.GSIM_CLASS()
+        sctx = SitesContext()
+        sctx.vs30 = numpy.array([180., 225., 260., 760., 1500.])
+        sctx.z1pt0 = numpy.array([500., 800., 200., 50., 10.])
+        dctx = DistancesContext()
+        dctx.rjb = numpy.array([0., 28., 119., 200., 300.])
+        imts = [PGA(), SA(0.2, 5), SA(1.0, 5), SA(3.0, 5), PGV()]
+        stddev_types = [const.StdDev.TOTAL, const.StdDev.INTER_EVENT,
+                        const.StdDev.INTRA_EVENT]
+        for mag in (4., 5., 6.5):
+            rctx = RuptureContext()
+            rctx.mag = mag
+            rctx.rake = 90.
+            means, stddevs = gsim.get_means_and_stddevs(
+                sctx, rctx, dctx, imts, stddev_types)
+            self.assertEqual(means.shape, (5, 5))
+            self.assertEqual(stddevs.shape, (5, 3, 5))
+            for imt, mean, imt_stddevs in zip(imts, means, stddevs):
+                expected_mean, expected_stddevs = gsim.get_mean_and_stddevs(
+                    sctx, rctx, dctx, imt, stddev_types)
+                numpy.testing.assert_allclose(mean, expected_mean,
+                                              rtol=1e-14)
+                numpy.testing.assert_allclose(imt_stddevs, expected_stddevs,
+                                              rtol=1e-14)
+
 
 class BooreEtAl2014HighQTestCase(BooreEtAl2014TestCase):
     """
@@ -13,7 +13,13 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import numpy
+
+from openquake.hazardlib import const
+from openquake.hazardlib.gsim.base import (
+    SitesContext, RuptureContext, DistancesContext)
 from openquake.hazardlib.gsim.chiou_youngs_2014 import ChiouYoungs2014
+from openquake.hazardlib.imt import PGA, PGV, SA
 
 from openquake.hazardlib.tests.gsim.utils import BaseGSIMTestCase
 
@@ -53,3 +59,36 @@ class ChiouYoungs2014TestCase(BaseGSIMTestCase):
         # data generated from opensha
         self.check('NGA/CY14/CY14_TOTAL_EVENT_SIGMA.csv',
                    max_discrep_percentage=0.05)
+
+
+    def test_get_means_and_stddevs(self):
+        # all the IMTs are computed at once, with the same results of
+        # separate calls
+        gsim = ChiouYoungs2014()
+        sctx = SitesContext()
+        sctx.vs30 = numpy.array([300., 760., 1500.])
+        sctx.vs30measured = numpy.array([True, False, True])
+        sctx.z1pt0 = numpy.array([200., 50., 10.])
+        dctx = DistancesContext()
+        dctx.rrup = numpy.array([5., 30., 120.])
+        dctx.rjb = numpy.array([0., 28., 119.])
+        dctx.rx = numpy.array([3., -20., 100.])
+        imts = [PGA(), SA(0.2, 5), SA(1.0, 5), PGV()]
+        stddev_types = [const.StdDev.TOTAL, const.StdDev.INTER_EVENT]
+        for mag in (4., 6.5):
+            rctx = RuptureContext()
+            rctx.mag = mag
+            rctx.rake = 90.
+            rctx.dip = 45.
+            rctx.ztor = 2.
+            means, stddevs = gsim.get_means_and_stddevs(
+                sctx, rctx, dctx, imts, stddev_types)
+            self.assertEqual(means.shape, (4, 3))
+            self.assertEqual(stddevs.shape, (4, 2, 3))
+            for imt, mean, imt_stddevs in zip(imts, means, stddevs):
+                expected_mean, expected_stddevs = gsim.get_mean_and_stddevs(
+                    sctx, rctx, dctx, imt, stddev_types)
+                numpy.testing.assert_allclose(mean, expected_mean,
+                                              rtol=1e-14)
+                numpy.testing.assert_allclose(imt_stddevs, expected_stddevs,
+                                              rtol=1e-14)
@@ -13,14 +13,18 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
 import pickle
+import shutil
+import tempfile
 import unittest
 
 import numpy
 
 from openquake.hazardlib.site import \
-    Site, SiteCollection, FilteredSiteCollection
+    Site, SiteCollection, FilteredSiteCollection, site_param_dt
 from openquake.hazardlib.geo.point import Point
+from openquake.hazardlib.geo.geodetic import geodetic_distance
 
 assert_eq = numpy.testing.assert_equal
 
@@ -117,6 +121,93 @@ class SiteCollectionCreationTestCase(unittest.TestCase):
         self.assertEqual(len(cll), 2)
 
 
+class SiteCollectionFromArrayTestCase(unittest.TestCase):
+    def setUp(self):
+        self.array = numpy.array([(1, 10, 20, 1.2, True, 3.4, 5.6),
+                                  (2, -1.2, -3.4, 55.4, False, 66.7, 88.9)],
+                                 site_param_dt)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _assert_collection(self, cll):
+        assert_eq(cll.sids, [1, 2])
+        assert_eq(cll.mesh.lons, [10, -1.2])
+        assert_eq(cll.mesh.lats, [20, -3.4])
+        assert_eq(cll.vs30, [1.2, 55.4])
+        assert_eq(cll.vs30measured, [True, False])
+        assert_eq(cll.z1pt0, [3.4, 66.7])
+        assert_eq(cll.z2pt5, [5.6, 88.9])
+        for arr in (cll.vs30, cll.vs30measured, cll.z1pt0, cll.z2pt5,
+                    cll.lons, cll.lats, cll.sids):
+            self.assertEqual(arr.flags.writeable, False)
+        self.assertEqual(len(cll), 2)
+
+    def test_from_array(self):
+        cll = SiteCollection.from_array(self.array)
+        self._assert_collection(cll)
+        # no data is copied
+        self.assertIs(cll.array, self.array)
+        self.assertTrue(numpy.may_share_memory(cll.vs30, self.array))
+
+    def test_same_as_from_sites(self):
+        cll = SiteCollection.from_array(self.array)
+        self.assertEqual(list(cll), list(SiteCollection(list(cll))))
+        assert_eq(SiteCollection(list(cll)).array, self.array)
+
+    def test_different_dtype(self):
+        dtype = [(name, numpy.float32) for name in site_param_dt.names]
+        array = numpy.array([(1, 10, 20, 1.2, True, 3.5, 5.5)], dtype)
+        cll = SiteCollection.from_array(array)
+        self.assertEqual(cll.array.dtype, site_param_dt)
+        self.assertEqual(cll.vs30measured.dtype, bool)
+        assert_eq(cll.z1pt0, [3.5])
+
+    def test_missing_field(self):
+        array = numpy.zeros(2, [('lons', float), ('lats', float)])
+        with self.assertRaises(ValueError) as ar:
+            SiteCollection.from_array(array)
+        self.assertEqual(
+            str(ar.exception), 'missing site parameters: sids, vs30, '
+            'vs30measured, z1pt0, z2pt5')
+
+    def test_wrong_vs30(self):
+        array = self.array.copy()
+        array['vs30'][1] = 0
+        with self.assertRaises(ValueError) as ar:
+            SiteCollection.from_array(array)
+        self.assertEqual(str(ar.exception), 'vs30 must be positive')
+
+    def test_from_npy_file(self):
+        fname = os.path.join(self.tmpdir, 'sites.npy')
+        numpy.save(fname, self.array)
+        cll = SiteCollection.from_file(fname)
+        self._assert_collection(cll)
+        self.assertIsInstance(cll.array, numpy.memmap)
+
+    def test_from_binary_file(self):
+        fname = os.path.join(self.tmpdir, 'sites.bin')
+        self.array.tofile(fname)
+        cll = SiteCollection.from_file(fname)
+        self._assert_collection(cll)
+        self.assertIsInstance(cll.array, numpy.memmap)
+
+    def test_pickle(self):
+        cll = SiteCollection.from_array(self.array)
+        cll.kdtree
+        cll2 = pickle.loads(pickle.dumps(cll))
+        self._assert_collection(cll2)
+        self.assertIs(cll2._kdtree, None)
+        self.assertTrue(numpy.may_share_memory(cll2.vs30, cll2.array))
+
+    def test_derived_arrays_are_cached(self):
+        cll = SiteCollection.from_array(self.array)
+        self.assertIs(cll.mesh, cll.mesh)
+        self.assertIs(cll.xyz, cll.xyz)
+        self.assertEqual(cll.xyz.shape, (2, 3))
+
+
 class SiteCollectionFilterTestCase(unittest.TestCase):
     SITES = [
         Site(location=Point(10, 20, 30), vs30=1.2, vs30measured=True,
@@ -210,6 +301,122 @@ class SiteCollectionFilterTestCase(unittest.TestCase):
         data_expanded_expected = data_condensed
         numpy.testing.assert_array_equal(data_expanded, data_expanded_expected)
 
+    def test_expand_into_2d(self):
+        col = SiteCollection(self.SITES).filter(
+            numpy.array([False, True, False, True]))
+        target = numpy.ones((4, 3)) * 2
+        col.expand_into(target, numpy.array([[1, 2, 3], [5, 6, 7]]))
+        numpy.testing.assert_array_equal(target, [[2, 2, 2],
+                                                  [2, 4, 6],
+                                                  [2, 2, 2],
+                                                  [10, 12, 14]])
+
+    def test_expand_into_contiguous(self):
+        col = SiteCollection(self.SITES).filter(
+            numpy.array([False, True, True, False]))
+        target = numpy.array([1., 2, 3, 4])
+        col.expand_into(target, numpy.array([10, 20]), numpy.add)
+        numpy.testing.assert_array_equal(target, [1, 12, 23, 4])
+
+    def test_expand_into_same_as_expand(self):
+        col = SiteCollection(self.SITES).filter(
+            numpy.array([True, False, True, True]))
+        data = numpy.array([[.1, .2], [.3, .4], [.5, .6]])
+        target = numpy.array([[.9] * 2] * 4)
+        expected = target * col.expand(data, placeholder=1)
+        col.expand_into(target, data)
+        numpy.testing.assert_array_equal(target, expected)
+
+    def test_expand_into_no_filtering(self):
+        col = SiteCollection(self.SITES)
+        target = numpy.array([1., 2, 3, 4])
+        col.expand_into(target, numpy.array([3, 2, 1, 0]))
+        numpy.testing.assert_array_equal(target, [3, 4, 3, 0])
+
+
+class SiteCollectionFilterByDistanceTestCase(unittest.TestCase):
+    SITES = [
+        Site(location=Point(0, 0), vs30=1, vs30measured=True,
+             z1pt0=3, z2pt5=5),
+        Site(location=Point(0, 0.5), vs30=2, vs30measured=False,
+             z1pt0=6, z2pt5=8),
+        Site(location=Point(1, 0), vs30=3, vs30measured=True,
+             z1pt0=9, z2pt5=17),
+        Site(location=Point(179.9, 0), vs30=4, vs30measured=False,
+             z1pt0=22, z2pt5=11),
+        Site(location=Point(-179.9, 0), vs30=5, vs30measured=False,
+             z1pt0=22, z2pt5=11),
+    ]
+
+    def test_filter(self):
+        col = SiteCollection(self.SITES)
+        # distance between the first and the second site is about 55.6 km
+        filtered = col.filter_by_distance(0, 0, 60)
+        self.assertIsInstance(filtered, FilteredSiteCollection)
+        numpy.testing.assert_array_equal(filtered.indices, [0, 1])
+        numpy.testing.assert_array_equal(filtered.vs30, [1, 2])
+        filtered = col.filter_by_distance(0, 0, 50)
+        numpy.testing.assert_array_equal(filtered.indices, [0])
+
+    def test_international_date_line(self):
+        col = SiteCollection(self.SITES)
+        filtered = col.filter_by_distance(180, 0, 20)
+        numpy.testing.assert_array_equal(filtered.indices, [3, 4])
+
+    def test_filter_all_out(self):
+        col = SiteCollection(self.SITES)
+        self.assertIs(col.filter_by_distance(90, 45, 100), None)
+
+    def test_filter_all_in(self):
+        col = SiteCollection(self.SITES)
+        self.assertIs(col.filter_by_distance(0, 0, 30000), col)
+
+    def test_same_as_distances(self):
+        col = SiteCollection(self.SITES)
+        dists = geodetic_distance(0.5, 0.2, col.lons, col.lats)
+        for distance in [10, 59.88, 59.89, 65, 1000, 20000]:
+            filtered = col.filter_by_distance(0.5, 0.2, distance)
+            expected = (dists <= distance).nonzero()[0]
+            if not len(expected):
+                self.assertIs(filtered, None)
+            elif len(expected) == len(col):
+                self.assertIs(filtered, col)
+            else:
+                numpy.testing.assert_array_equal(filtered.indices, expected)
+
+    def test_filtered_collection(self):
+        col = SiteCollection(self.SITES)
+        filtered = col.filter(numpy.array([False, True, True, True, False]))
+        filtered2 = filtered.filter_by_distance(0, 0, 120)
+        numpy.testing.assert_array_equal(filtered2.indices, [1, 2])
+        self.assertIs(filtered2.complete, col)
+        self.assertIs(filtered.filter_by_distance(0, 0, 30000), filtered)
+        self.assertIs(filtered.filter_by_distance(0, 0, 10), None)
+
+    def test_contiguous_indices_are_views(self):
+        col = SiteCollection(self.SITES)
+        filtered = FilteredSiteCollection(numpy.array([1, 2]), col)
+        for name in 'vs30 vs30measured z1pt0 z2pt5 lons lats sids'.split():
+            arr = getattr(filtered, name)
+            self.assertTrue(numpy.may_share_memory(arr, col.array))
+            assert_eq(arr, getattr(col, name)[1:3])
+        assert_eq(filtered.xyz, col.xyz[1:3])
+        filtered = FilteredSiteCollection(numpy.array([0, 2]), col)
+        self.assertFalse(numpy.may_share_memory(filtered.vs30, col.array))
+        assert_eq(filtered.xyz, col.xyz[[0, 2]])
+
+    def test_kdtree_is_cached(self):
+        col = SiteCollection(self.SITES)
+        self.assertIs(col.kdtree, col.kdtree)
+
+    def test_kdtree_is_not_pickled(self):
+        col = SiteCollection(self.SITES)
+        col.filter_by_distance(0, 0, 60)
+        col2 = pickle.loads(pickle.dumps(col))
+        self.assertIs(col2._kdtree, None)
+        numpy.testing.assert_array_equal(
+            col2.filter_by_distance(0, 0, 60).indices, [0, 1])
+
 
 class SiteCollectionIterTestCase(unittest.TestCase):
 
@@ -22,6 +22,7 @@ from openquake.hazardlib.mfd import EvenlyDiscretizedMFD
 from openquake.hazardlib.scalerel.peer import PeerMSR
 from openquake.hazardlib.source.base import ParametricSeismicSource
 from openquake.hazardlib.geo import Polygon, Point, RectangularMesh
+from openquake.hazardlib.geo.utils import get_bounding_circle
 from openquake.hazardlib.calc import filters
 from openquake.hazardlib.site import \
     Site, SiteCollection, FilteredSiteCollection
@@ -144,8 +145,31 @@ class SeismicSourceFilterSitesByRuptureTestCase(_BaseSeismicSourceTestCase):
                 def get_joyner_boore_distance(cls, mesh):
                     return surface_mesh.get_joyner_boore_distance(mesh)
 
+                @classmethod
+                def get_bounding_circle(cls):
+                    return get_bounding_circle(surface_mesh.lons.flatten(),
+                                               surface_mesh.lats.flatten())
+
         filtered = filters.filter_sites_by_distance_to_rupture(
             rupture=rupture, integration_distance=1.01, sites=self.sitecol
         )
         numpy.testing.assert_array_equal(filtered.indices,
                                          [0, 1, 2, 3, 4, 5, 6, 7, 8])
+
+        rejected = {'bounding_circle': 0, 'distance': 0}
+        filtered = filters.filter_sites_by_distance_to_rupture(
+            rupture=rupture, integration_distance=1.1, sites=self.sitecol,
+            rejected=rejected
+        )
+        numpy.testing.assert_array_equal(filtered.indices,
+                                         [0, 1, 2, 3, 4, 5, 6, 7, 8])
+        # the site 1.1 km away is rejected by the exact distance test only
+        self.assertEqual(rejected, {'bounding_circle': 2, 'distance': 1})
+
+        filtered = filters.filter_sites_by_distance_to_rupture(
+            rupture=rupture, integration_distance=1.2, sites=self.sitecol,
+            rejected=rejected
+        )
+        numpy.testing.assert_array_equal(filtered.indices,
+                                         [0, 1, 2, 3, 4, 5, 6, 7, 8, 9])
+        self.assertEqual(rejected, {'bounding_circle': 4, 'distance': 1})
@@ -195,3 +195,9 @@ class NonParametricProbabilisticRuptureTestCase(unittest.TestCase):
         self.assertAlmostEqual(p_occs_0, 0.7, places=2)
         self.assertAlmostEqual(p_occs_1, 0.2, places=2)
         self.assertAlmostEqual(p_occs_2, 0.1, places=2)
+
+        # the same numbers are given by an explicit generator
+        rng = numpy.random.RandomState(123)
+        self.assertEqual(
+            [rup.sample_number_of_occurrences(rng) for i in range(100)],
+            n_occs[:100].tolist())
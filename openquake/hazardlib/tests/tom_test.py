@@ -55,6 +55,15 @@ class PoissonTOMTestCase(unittest.TestCase):
                    for i in xrange(num_samples)) / float(num_samples)
         self.assertAlmostEqual(mean, rate * time_span, delta=1e-3)
 
+    def test_sample_number_of_occurrences_rng(self):
+        tom = PoissonTOM(40)
+        numpy.random.seed(31)
+        expected = [tom.sample_number_of_occurrences(0.05) for i in xrange(5)]
+        rng = numpy.random.RandomState(31)
+        self.assertEqual(
+            [tom.sample_number_of_occurrences(0.05, rng) for i in xrange(5)],
+            expected)
+
     def test_get_probability_no_exceedance(self):
         time_span = 50.
         rate = 0.01
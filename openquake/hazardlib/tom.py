@@ -65,21 +65,27 @@ class PoissonTOM(object):
         """
         return scipy.stats.poisson(occurrence_rate * self.time_span).pmf(1)
 
-    def sample_number_of_occurrences(self, occurrence_rate):
+    def sample_number_of_occurrences(self, occurrence_rate, rng=None):
         """
         Draw a random sample from the distribution and return a number
         of events to occur.
 
-        Method uses numpy random generator, which needs to be seeded
-        outside of this method in order to get reproducible results.
+        If ``rng`` is not given the method uses the global numpy random
+        generator, which needs to be seeded outside of this method in order
+        to get reproducible results.
 
         :param occurrence_rate:
             The average number of events per year.
+        :param rng:
+            Optional :class:`numpy.random.RandomState` to draw the sample
+            from.
         :return:
             Sampled integer number of events to occur within model's
             time span.
         """
-        return numpy.random.poisson(occurrence_rate * self.time_span)
+        if rng is None:
+            rng = numpy.random
+        return rng.poisson(occurrence_rate * self.time_span)
 
     def get_probability_no_exceedance(self, occurrence_rate, poes):
         """